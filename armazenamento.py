@@ -0,0 +1,161 @@
+from abc import ABC, abstractmethod
+
+# Contrato das operações de dados do bot (videos, pending_requests, admins e o que
+# gira em torno deles). O bot só fala com esta interface; BancoAssincrono
+# (Postgres) e BancoSQLite (arquivo local) são as implementações.
+
+
+class Armazenamento(ABC):
+    # ————— ciclo de vida —————
+    @abstractmethod
+    async def abrir(self):
+        """Prepara conexões (e o esquema, quando a implementação cuida disso)."""
+
+    @abstractmethod
+    async def fechar(self):
+        ...
+
+    @abstractmethod
+    async def verificar(self):
+        """Ida mínima ao banco; levanta exceção se ele não responder."""
+
+    @abstractmethod
+    def estatisticas(self):
+        """Uso das conexões, no formato de PoolAssincrono.estatisticas()."""
+
+    # ————— videos —————
+    @abstractmethod
+    async def buscar_link(self, vid):
+        ...
+
+    @abstractmethod
+    async def upsert_video(self, vid, link=None):
+        ...
+
+    @abstractmethod
+    async def resolver_pedido(self, usuario_id, username, first_name, video_id, provavelmente_sem_link=False):
+        """
+        Devolve o link se já existir, senão garante o vídeo e enfileira o
+        pedido. Retorna {"link", "novo", "status", "repetido"}.
+        """
+
+    @abstractmethod
+    async def videos_alterados(self, desde_versao, limite):
+        """Vídeos com `versao` > desde_versao em ordem de versão: {"id", "link", "versao"}."""
+
+    @abstractmethod
+    async def importar_videos(self, itens):
+        """Upsert de vários (id, link) e enfileiramento; retorna (novos, atualizados, ids)."""
+
+    # ————— pending_requests —————
+    @abstractmethod
+    async def registrar_pedido(self, usuario_id, username, first_name, video_id, status="pendente"):
+        ...
+
+    @abstractmethod
+    async def registrar_pedidos_lote(self, linhas):
+        """Linhas (user_id, username, first_name, video_id, status, requested_at)."""
+
+    @abstractmethod
+    async def listar_pedidos(self, status=None, user_id=None, video_id=None, mais_recentes_primeiro=False):
+        ...
+
+    @abstractmethod
+    async def pagina_pedidos(self, status=None, cursor=None, anterior=False, limite=10):
+        """Página por keyset em (requested_at, id); retorna (linhas, tem_mais)."""
+
+    @abstractmethod
+    def exportar_pedidos(self, status=None, desde=None, ate=None, lote=1000):
+        """Gerador assíncrono de lotes de pedidos em ordem (requested_at, id)."""
+
+    @abstractmethod
+    async def contar_pedidos(self):
+        ...
+
+    @abstractmethod
+    async def estatisticas_pedidos(self, dias=7, top=10):
+        """{"por_status", "chegadas", "top_24h", "top_periodo"}."""
+
+    @abstractmethod
+    async def fila_por_demanda(self, peso_demanda=1.0, peso_idade=0.1, limite=10):
+        ...
+
+    @abstractmethod
+    async def podar_estatisticas(self, dias=8):
+        ...
+
+    # ————— notification_outbox —————
+    @abstractmethod
+    async def enfileirar_notificacoes(self, video_ids):
+        ...
+
+    @abstractmethod
+    async def reivindicar_notificacoes(self, limite, trava_expira):
+        ...
+
+    @abstractmethod
+    async def marcar_notificacao_entregue(self, outbox_id):
+        ...
+
+    @abstractmethod
+    async def marcar_notificacao_falha(self, outbox_id, erro, definitiva, max_tentativas, atraso):
+        ...
+
+    @abstractmethod
+    async def progresso_notificacoes(self, ids):
+        ...
+
+    # ————— persistência (user_data e conversas) —————
+    @abstractmethod
+    async def carregar_dados_usuario(self, user_id):
+        ...
+
+    @abstractmethod
+    async def listar_usuarios_com_dados(self):
+        ...
+
+    @abstractmethod
+    async def gravar_dados_usuarios(self, gravar, remover):
+        ...
+
+    @abstractmethod
+    async def remover_dados_usuario(self, user_id):
+        ...
+
+    @abstractmethod
+    async def carregar_conversas(self, nome):
+        ...
+
+    @abstractmethod
+    async def gravar_conversas(self, gravar, remover):
+        ...
+
+    # ————— file_ids de mídias já enviadas —————
+    @abstractmethod
+    async def carregar_file_ids(self):
+        ...
+
+    @abstractmethod
+    async def gravar_file_ids(self, linhas):
+        ...
+
+    # ————— admins —————
+    @abstractmethod
+    async def inserir_admin(self, user_id, expira_em=None):
+        """Cadastra ou renova o admin; `expira_em` None = sem validade."""
+
+    @abstractmethod
+    async def remover_admin(self, user_id):
+        """Retorna se havia um admin com esse id."""
+
+    @abstractmethod
+    async def versao_admins(self):
+        """Contador que muda a cada alteração na tabela admins."""
+
+    @abstractmethod
+    async def carregar_admins(self):
+        """{"versao", "admins": {user_id: expira_em}}, lidos nessa ordem."""
+
+    @abstractmethod
+    async def remover_admins_expirados(self, agora):
+        ...
@@ -0,0 +1,811 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+from armazenamento import Armazenamento
+
+# Acesso assíncrono ao Postgres usando o modo assíncrono nativo do psycopg2:
+# as conexões são abertas com async_=True e o próprio event loop espera o
+# socket ficar pronto (add_reader/add_writer), sem passar por threads.
+
+logger = logging.getLogger(__name__)
+
+
+def parametros_conexao():
+    return {
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT"),
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+    }
+
+
+async def _aguardar(conn):
+    """Espera a operação assíncrona pendente em `conn` terminar."""
+    loop = asyncio.get_running_loop()
+    while True:
+        estado = conn.poll()
+        if estado == psycopg2.extensions.POLL_OK:
+            return
+
+        fd = conn.fileno()
+        pronto = loop.create_future()
+
+        def acordar():
+            if not pronto.done():
+                pronto.set_result(None)
+
+        if estado == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, acordar)
+            remover = loop.remove_reader
+        elif estado == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, acordar)
+            remover = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f"poll() retornou estado inesperado: {estado}")
+
+        try:
+            await pronto
+        finally:
+            remover(fd)
+
+
+class ConexaoAssincrona:
+    """Conexão psycopg2 em modo assíncrono (sempre em autocommit)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.criada_em = time.monotonic()
+        self.usada_em = self.criada_em
+
+    @classmethod
+    async def abrir(cls, **params):
+        conn = psycopg2.connect(
+            async_=True,
+            cursor_factory=psycopg2.extras.RealDictCursor,
+            **params
+        )
+        try:
+            await _aguardar(conn)
+        except BaseException:
+            conn.close()
+            raise
+        return cls(conn)
+
+    @property
+    def fechada(self):
+        return bool(self.conn.closed)
+
+    async def executar(self, query, params=None):
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        await _aguardar(self.conn)
+        return cur
+
+    async def buscar_todos(self, query, params=None):
+        cur = await self.executar(query, params)
+        return cur.fetchall() if cur.description else []
+
+    async def buscar_um(self, query, params=None):
+        cur = await self.executar(query, params)
+        return cur.fetchone() if cur.description else None
+
+    def fechar(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class PoolAssincrono:
+    """
+    Pool de conexões assíncronas. Mesmas regras do pool síncrono do bot:
+    tamanho entre `minimo` e `maximo`, SELECT 1 nas conexões paradas há mais
+    de `checar_apos` segundos e reciclagem das que passaram de `max_idade`.
+    """
+
+    def __init__(self, params, minimo=1, maximo=10, timeout=10.0, max_idade=1800.0, checar_apos=30.0):
+        self._params = params
+        self.minimo = minimo
+        self.maximo = max(maximo, minimo, 1)
+        self.timeout = timeout
+        self.max_idade = max_idade
+        self.checar_apos = checar_apos
+
+        self._ociosas = deque()
+        self._em_uso = set()
+        self._total = 0
+        self._cond = None
+        self._fechado = False
+
+        # estatísticas
+        self.pedidos = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.criadas = 0
+        self.recicladas = 0
+        self.descartadas = 0
+        self.timeouts = 0
+
+    def _condicao(self):
+        # criada sob demanda para ficar presa ao loop que realmente usa o pool
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def abrir(self):
+        conns = [await self.pegar() for _ in range(self.minimo)]
+        for c in conns:
+            await self.devolver(c)
+
+    async def _saudavel(self, c):
+        if c.fechada:
+            return False
+        agora = time.monotonic()
+        if agora - c.criada_em > self.max_idade:
+            self.recicladas += 1
+            return False
+        if agora - c.usada_em > self.checar_apos:
+            try:
+                await c.executar("SELECT 1")
+            except Exception:
+                return False
+        return True
+
+    async def _descartar(self, c):
+        c.fechar()
+        self.descartadas += 1
+        cond = self._condicao()
+        async with cond:
+            self._total -= 1
+            cond.notify()
+
+    async def pegar(self):
+        cond = self._condicao()
+        inicio = time.monotonic()
+        esperou = False
+        while True:
+            c = None
+            async with cond:
+                if self._fechado:
+                    raise psycopg2.OperationalError("Pool assíncrono fechado.")
+                while not self._ociosas and self._total >= self.maximo:
+                    restante = inicio + self.timeout - time.monotonic()
+                    if restante <= 0:
+                        self.timeouts += 1
+                        raise asyncio.TimeoutError(
+                            f"Nenhuma conexão livre após {self.timeout:.1f}s "
+                            f"({self._total}/{self.maximo} em uso)."
+                        )
+                    esperou = True
+                    try:
+                        await asyncio.wait_for(cond.wait(), restante)
+                    except asyncio.TimeoutError:
+                        pass
+                if self._ociosas:
+                    c = self._ociosas.pop()
+                else:
+                    self._total += 1
+
+            if c is None:
+                try:
+                    c = await ConexaoAssincrona.abrir(**self._params)
+                except BaseException:
+                    async with cond:
+                        self._total -= 1
+                        cond.notify()
+                    raise
+                self.criadas += 1
+            elif not await self._saudavel(c):
+                await self._descartar(c)
+                continue
+
+            espera = time.monotonic() - inicio
+            self._em_uso.add(c)
+            self.pedidos += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+            if esperou:
+                self.esperas += 1
+            return c
+
+    async def devolver(self, c, descartar=False):
+        self._em_uso.discard(c)
+        if descartar or c.fechada or self._fechado:
+            await self._descartar(c)
+            return
+        c.usada_em = time.monotonic()
+        cond = self._condicao()
+        async with cond:
+            self._ociosas.append(c)
+            cond.notify()
+
+    @asynccontextmanager
+    async def conexao(self):
+        c = await self.pegar()
+        descartar = False
+        try:
+            yield c
+        except BaseException as e:
+            # cancelamento no meio de uma query deixa a conexão em estado incerto
+            descartar = (
+                c.fechada
+                or isinstance(e, (asyncio.CancelledError, psycopg2.OperationalError))
+                or c.conn.isexecuting()
+            )
+            raise
+        finally:
+            await self.devolver(c, descartar)
+
+    @asynccontextmanager
+    async def transacao(self):
+        """Conexão dentro de BEGIN/COMMIT (modo assíncrono não tem commit())."""
+        async with self.conexao() as c:
+            await c.executar("BEGIN")
+            try:
+                yield c
+            except BaseException:
+                if not c.fechada and not c.conn.isexecuting():
+                    try:
+                        await c.executar("ROLLBACK")
+                    except Exception:
+                        pass
+                raise
+            await c.executar("COMMIT")
+
+    async def fechar(self):
+        self._fechado = True
+        while self._ociosas:
+            await self._descartar(self._ociosas.pop())
+
+    def estatisticas(self):
+        return {
+            "em_uso": len(self._em_uso),
+            "ociosas": len(self._ociosas),
+            "total": self._total,
+            "minimo": self.minimo,
+            "maximo": self.maximo,
+            "pedidos": self.pedidos,
+            "esperas": self.esperas,
+            "espera_media_ms": (self.espera_total / self.pedidos * 1000) if self.pedidos else 0.0,
+            "espera_max_ms": self.espera_max * 1000,
+            "criadas": self.criadas,
+            "recicladas": self.recicladas,
+            "descartadas": self.descartadas,
+            "timeouts": self.timeouts,
+        }
+
+
+class BancoAssincrono(Armazenamento):
+    """Operações de banco usadas pelos handlers do bot, no Postgres."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def abrir(self):
+        await self.pool.abrir()
+
+    async def fechar(self):
+        await self.pool.fechar()
+
+    async def verificar(self):
+        await self.buscar_um("SELECT 1 AS ok")
+
+    def estatisticas(self):
+        return self.pool.estatisticas()
+
+    async def buscar_todos(self, query, params=()):
+        async with self.pool.conexao() as c:
+            return await c.buscar_todos(query, params)
+
+    async def buscar_um(self, query, params=()):
+        async with self.pool.conexao() as c:
+            return await c.buscar_um(query, params)
+
+    async def executar(self, query, params=()):
+        async with self.pool.conexao() as c:
+            cur = await c.executar(query, params)
+            return cur.rowcount
+
+    # ————— videos —————
+    async def buscar_link(self, vid):
+        row = await self.buscar_um("SELECT link FROM videos WHERE id=%s", (vid,))
+        return row["link"] if row else None
+
+    async def upsert_video(self, vid, link=None):
+        if link is not None:
+            # insere ou atualiza o link se já existir id igual
+            await self.executar(
+                """
+                INSERT INTO videos (id, link)
+                VALUES (%s, %s)
+                ON CONFLICT (id) DO UPDATE
+                  SET link = EXCLUDED.link
+                """,
+                (vid, link)
+            )
+        else:
+            # insere só o id (não substitui nada se já existir)
+            await self.executar(
+                """
+                INSERT INTO videos (id)
+                VALUES (%s)
+                ON CONFLICT (id) DO NOTHING
+                """,
+                (vid,)
+            )
+
+    async def videos_alterados(self, desde_versao, limite):
+        # `versao` vem de uma sequence, atribuída por trigger a cada link novo ou alterado
+        return await self.buscar_todos(
+            "SELECT id, link, versao FROM videos WHERE versao > %s ORDER BY versao LIMIT %s",
+            (desde_versao, limite)
+        )
+
+    async def resolver_pedido(self, usuario_id, username, first_name, video_id, provavelmente_sem_link=False):
+        """
+        Resolve um pedido de ID numa única instrução: devolve o link se já
+        existir, senão garante a linha em `videos` e enfileira o pedido.
+        Retorna {"link", "novo", "status", "repetido"}; `novo` indica que o ID
+        nunca tinha sido pedido antes e `repetido` que o usuário já tinha um
+        pedido aberto para ele (só o contador e last_seen_at são atualizados).
+        Pedidos encontrados não são gravados aqui: o registro de auditoria
+        deles vai pelo buffer do bot.
+
+        Com `provavelmente_sem_link` (cache negativo) pula a leitura prévia e
+        vai direto ao upsert com trava, que ainda devolve o link mais recente.
+
+        Quando o link ainda não existe, o ON CONFLICT DO UPDATE trava a linha
+        do vídeo, então quem cadastra o link espera este pedido terminar e
+        o enxerga ao concluir os pendentes (ninguém fica sem aviso).
+        """
+        return await self.buscar_um(
+            """
+            WITH existente AS (
+                SELECT link FROM videos
+                 WHERE id = %(vid)s AND link IS NOT NULL AND NOT %(sem_link)s
+            ), v AS (
+                INSERT INTO videos (id)
+                SELECT %(vid)s WHERE NOT EXISTS (SELECT 1 FROM existente)
+                ON CONFLICT (id) DO UPDATE SET id = EXCLUDED.id
+                RETURNING link, (xmax = 0) AS novo
+            ), resolvido AS (
+                SELECT link, FALSE AS novo FROM existente
+                UNION ALL
+                SELECT link, novo FROM v
+            ), p AS (
+                INSERT INTO pending_requests
+                  (user_id, username, first_name, video_id, status)
+                SELECT %(user_id)s, %(username)s, %(first_name)s, %(vid)s, 'pendente'
+                  FROM resolvido r
+                 WHERE r.link IS NULL
+                ON CONFLICT (user_id, video_id) WHERE status = 'pendente' DO UPDATE
+                   SET repeat_count = pending_requests.repeat_count + 1,
+                       last_seen_at = CURRENT_TIMESTAMP,
+                       username = EXCLUDED.username,
+                       first_name = EXCLUDED.first_name
+                RETURNING status, (xmax <> 0) AS repetido
+            )
+            SELECT r.link, r.novo, COALESCE(p.status, 'encontrado') AS status,
+                   COALESCE(p.repetido, FALSE) AS repetido
+              FROM resolvido r LEFT JOIN p ON TRUE
+            """,
+            {
+                "vid": video_id,
+                "user_id": usuario_id,
+                "username": username,
+                "first_name": first_name,
+                "sem_link": provavelmente_sem_link,
+            }
+        )
+
+    # ————— pending_requests —————
+    async def registrar_pedido(self, usuario_id, username, first_name, video_id, status="pendente"):
+        await self.executar(
+            """
+            INSERT INTO pending_requests
+              (user_id, username, first_name, video_id, status)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id, video_id) WHERE status = 'pendente' DO UPDATE
+               SET repeat_count = pending_requests.repeat_count + 1,
+                   last_seen_at = CURRENT_TIMESTAMP
+            """,
+            (usuario_id, username, first_name, video_id, status)
+        )
+
+    async def registrar_pedidos_lote(self, linhas):
+        """Grava várias linhas (user_id, username, first_name, video_id, status, requested_at) de uma vez."""
+        async with self.pool.conexao() as c:
+            cur = c.conn.cursor()
+            valores = b",".join(cur.mogrify("(%s, %s, %s, %s, %s, %s)", linha) for linha in linhas)
+            await c.executar(
+                b"INSERT INTO pending_requests"
+                b" (user_id, username, first_name, video_id, status, requested_at)"
+                b" VALUES " + valores
+            )
+
+    async def listar_pedidos(self, status=None, user_id=None, video_id=None, mais_recentes_primeiro=False):
+        filtros, params = [], []
+        if status is not None:
+            filtros.append("status = %s")
+            params.append(status)
+        if user_id is not None:
+            filtros.append("user_id = %s")
+            params.append(user_id)
+        if video_id is not None:
+            filtros.append("video_id = %s")
+            params.append(video_id)
+
+        query = (
+            "SELECT user_id, username, video_id, requested_at, status, repeat_count "
+            "FROM pending_requests"
+        )
+        if filtros:
+            query += " WHERE " + " AND ".join(filtros)
+        query += " ORDER BY requested_at " + ("DESC" if mais_recentes_primeiro else "ASC")
+        return await self.buscar_todos(query, tuple(params))
+
+    async def pagina_pedidos(self, status=None, cursor=None, anterior=False, limite=10):
+        """
+        Uma página de pedidos em ordem (requested_at, id), por keyset: `cursor`
+        é o (requested_at, id) da borda da página atual e `anterior` diz para
+        que lado andar. Busca um item a mais para saber se há outra página.
+        Retorna (linhas, tem_mais) com as linhas sempre em ordem crescente.
+        """
+        filtros, params = [], []
+        if status is not None:
+            filtros.append("status = %s")
+            params.append(status)
+        if cursor is not None:
+            filtros.append("(requested_at, id) " + ("<" if anterior else ">") + " (%s, %s)")
+            params.extend(cursor)
+
+        ordem = "DESC" if anterior else "ASC"
+        query = "SELECT id, user_id, username, video_id, requested_at, status FROM pending_requests"
+        if filtros:
+            query += " WHERE " + " AND ".join(filtros)
+        query += f" ORDER BY requested_at {ordem}, id {ordem} LIMIT %s"
+        params.append(limite + 1)
+
+        rows = await self.buscar_todos(query, tuple(params))
+        tem_mais = len(rows) > limite
+        rows = rows[:limite]
+        if anterior:
+            rows.reverse()
+        return rows, tem_mais
+
+    async def exportar_pedidos(self, status=None, desde=None, ate=None, lote=1000):
+        """
+        Gerador assíncrono de lotes de pedidos lidos por um cursor no servidor
+        (DECLARE/FETCH), para exportar a tabela inteira sem carregá-la na memória.
+        `desde` é inclusivo e `ate` exclusivo.
+        """
+        filtros, params = [], []
+        if status is not None:
+            filtros.append("status = %s")
+            params.append(status)
+        if desde is not None:
+            filtros.append("requested_at >= %s")
+            params.append(desde)
+        if ate is not None:
+            filtros.append("requested_at < %s")
+            params.append(ate)
+
+        query = (
+            "DECLARE exportacao NO SCROLL CURSOR FOR "
+            "SELECT id, user_id, username, first_name, video_id, requested_at, status "
+            "FROM pending_requests"
+        )
+        if filtros:
+            query += " WHERE " + " AND ".join(filtros)
+        query += " ORDER BY requested_at, id"
+
+        async with self.pool.transacao() as c:
+            await c.executar(query, tuple(params))
+            while True:
+                rows = await c.buscar_todos("FETCH FORWARD %s FROM exportacao", (lote,))
+                if not rows:
+                    break
+                yield rows
+
+    async def contar_pedidos(self):
+        # request_counters é mantida por trigger; somar os shards não depende do tamanho da tabela
+        row = await self.buscar_um("SELECT COALESCE(SUM(total), 0) AS total FROM request_counters")
+        return row["total"] if row else 0
+
+    async def estatisticas_pedidos(self, dias=7, top=10):
+        """Lê os contadores e agregados mantidos pelos triggers de pending_requests."""
+        async with self.pool.conexao() as c:
+            por_status = await c.buscar_todos(
+                "SELECT status, SUM(total) AS total FROM request_counters "
+                "GROUP BY status HAVING SUM(total) <> 0 ORDER BY status"
+            )
+            por_dia = await c.buscar_todos(
+                """
+                SELECT status, SUM(total) AS total
+                  FROM request_daily_stats
+                 WHERE day > CURRENT_DATE - %s
+                 GROUP BY status
+                """,
+                (dias,)
+            )
+            tops = {}
+            for horas in (24, 24 * dias):
+                tops[horas] = await c.buscar_todos(
+                    """
+                    SELECT video_id, SUM(total) AS total
+                      FROM video_request_hourly
+                     WHERE hour > date_trunc('hour', LOCALTIMESTAMP) - %s * INTERVAL '1 hour'
+                     GROUP BY video_id
+                     ORDER BY total DESC, video_id
+                     LIMIT %s
+                    """,
+                    (horas, top)
+                )
+        return {
+            "por_status": {r["status"]: r["total"] for r in por_status},
+            "chegadas": {r["status"]: r["total"] for r in por_dia},
+            "top_24h": tops[24],
+            "top_periodo": tops[24 * dias],
+        }
+
+    async def fila_por_demanda(self, peso_demanda=1.0, peso_idade=0.1, limite=10):
+        """
+        IDs ainda sem link ordenados pela prioridade
+        pedidos * peso_demanda + horas_do_pedido_mais_antigo * peso_idade,
+        lidos de video_demand (mantida por trigger, sem GROUP BY nos pedidos).
+        """
+        return await self.buscar_todos(
+            """
+            SELECT d.video_id,
+                   d.requesters,
+                   d.oldest_requested_at,
+                   EXTRACT(EPOCH FROM LOCALTIMESTAMP - d.oldest_requested_at) AS idade_segundos,
+                   d.requesters * %(peso_demanda)s
+                     + EXTRACT(EPOCH FROM LOCALTIMESTAMP - d.oldest_requested_at) / 3600 * %(peso_idade)s
+                     AS prioridade
+              FROM video_demand d
+              JOIN videos v ON v.id = d.video_id
+             WHERE v.link IS NULL
+             ORDER BY prioridade DESC, d.oldest_requested_at
+             LIMIT %(limite)s
+            """,
+            {"peso_demanda": peso_demanda, "peso_idade": peso_idade, "limite": limite}
+        )
+
+    async def podar_estatisticas(self, dias=8):
+        """Apaga buckets por hora mais antigos que a maior janela usada em /estatisticas."""
+        return await self.executar(
+            "DELETE FROM video_request_hourly WHERE hour < LOCALTIMESTAMP - %s * INTERVAL '1 day'",
+            (dias,)
+        )
+
+    # ————— notification_outbox —————
+    SQL_ENFILEIRAR_NOTIFICACOES = """
+        INSERT INTO notification_outbox (request_id, chat_id, video_id, link)
+        SELECT p.id, p.user_id, p.video_id, v.link
+          FROM pending_requests p
+          JOIN videos v ON v.id = p.video_id
+         WHERE p.video_id = ANY(%s) AND p.status = 'pendente' AND v.link IS NOT NULL
+        ON CONFLICT (request_id) DO UPDATE
+           SET link = EXCLUDED.link,
+               status = 'pendente',
+               attempts = 0,
+               next_attempt_at = CURRENT_TIMESTAMP,
+               last_error = NULL
+         WHERE notification_outbox.status IN ('pendente', 'falhou')
+        RETURNING id
+    """
+
+    async def enfileirar_notificacoes(self, video_ids):
+        """
+        Cria uma notificação na caixa de saída para cada pedido pendente dos
+        vídeos (com o link atual de cada um) e devolve os ids criados. O
+        pedido só vira 'concluido' quando a mensagem é entregue (ver
+        marcar_notificacao_entregue).
+        """
+        rows = await self.buscar_todos(self.SQL_ENFILEIRAR_NOTIFICACOES, (list(video_ids),))
+        return [r["id"] for r in rows]
+
+    async def importar_videos(self, itens):
+        """
+        Upsert de vários (id, link) numa única instrução e, na mesma transação,
+        enfileira as notificações dos pedidos pendentes desses IDs. O upsert
+        trava as linhas dos vídeos antes do enfileiramento, como no cadastro
+        individual. Retorna (novos, atualizados, ids_notificacoes).
+        """
+        async with self.pool.transacao() as c:
+            cur = c.conn.cursor()
+            valores = b",".join(cur.mogrify("(%s, %s)", item) for item in itens)
+            rows = await c.buscar_todos(
+                b"INSERT INTO videos (id, link) VALUES " + valores +
+                b" ON CONFLICT (id) DO UPDATE SET link = EXCLUDED.link"
+                b" RETURNING (xmax = 0) AS novo"
+            )
+            novos = sum(1 for r in rows if r["novo"])
+            notificacoes = await c.buscar_todos(
+                self.SQL_ENFILEIRAR_NOTIFICACOES, ([vid for vid, _ in itens],)
+            )
+        return novos, len(rows) - novos, [r["id"] for r in notificacoes]
+
+    async def reivindicar_notificacoes(self, limite, trava_expira):
+        """
+        Pega até `limite` notificações prontas para envio, pulando as que outro
+        trabalhador já travou. Notificações presas em 'enviando' há mais de
+        `trava_expira` segundos (processo que morreu no meio) voltam a valer.
+        """
+        return await self.buscar_todos(
+            """
+            UPDATE notification_outbox o
+               SET status = 'enviando',
+                   locked_at = CURRENT_TIMESTAMP,
+                   attempts = o.attempts + 1
+              FROM (
+                SELECT id FROM notification_outbox
+                 WHERE (status = 'pendente' AND next_attempt_at <= CURRENT_TIMESTAMP)
+                    OR (status = 'enviando' AND locked_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                 ORDER BY id
+                 LIMIT %s
+                 FOR UPDATE SKIP LOCKED
+              ) livre
+             WHERE o.id = livre.id
+            RETURNING o.id, o.request_id, o.chat_id, o.video_id, o.link, o.attempts
+            """,
+            (trava_expira, limite)
+        )
+
+    async def marcar_notificacao_entregue(self, outbox_id):
+        await self.executar(
+            """
+            WITH o AS (
+                UPDATE notification_outbox
+                   SET status = 'entregue', delivered_at = CURRENT_TIMESTAMP, locked_at = NULL
+                 WHERE id = %s
+                RETURNING request_id
+            )
+            UPDATE pending_requests SET status = 'concluido'
+             WHERE id IN (SELECT request_id FROM o) AND status = 'pendente'
+            """,
+            (outbox_id,)
+        )
+
+    async def marcar_notificacao_falha(self, outbox_id, erro, definitiva, max_tentativas, atraso):
+        # falha definitiva encerra o pedido também, para ele sair da fila e não
+        # absorver os próximos pedidos do mesmo usuário e ID
+        await self.executar(
+            """
+            WITH o AS (
+                UPDATE notification_outbox
+                   SET status = CASE WHEN %s OR attempts >= %s THEN 'falhou' ELSE 'pendente' END,
+                       next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                       locked_at = NULL,
+                       last_error = %s
+                 WHERE id = %s
+                RETURNING request_id, status
+            )
+            UPDATE pending_requests SET status = 'falhou'
+             WHERE id IN (SELECT request_id FROM o WHERE status = 'falhou') AND status = 'pendente'
+            """,
+            (definitiva, max_tentativas, atraso, erro, outbox_id)
+        )
+
+    async def progresso_notificacoes(self, ids):
+        rows = await self.buscar_todos(
+            "SELECT status, COUNT(*) AS total FROM notification_outbox "
+            "WHERE id = ANY(%s) GROUP BY status",
+            (list(ids),)
+        )
+        return {r["status"]: r["total"] for r in rows}
+
+    # ————— persistência (user_data e conversas) —————
+    async def carregar_dados_usuario(self, user_id):
+        rows = await self.buscar_todos(
+            "SELECT chave, valor FROM user_data WHERE user_id = %s", (user_id,)
+        )
+        return {r["chave"]: r["valor"] for r in rows}
+
+    async def listar_usuarios_com_dados(self):
+        rows = await self.buscar_todos("SELECT DISTINCT user_id FROM user_data")
+        return {r["user_id"] for r in rows}
+
+    async def gravar_dados_usuarios(self, gravar, remover):
+        """
+        Aplica de uma vez as chaves alteradas de vários usuários: `gravar` é uma
+        lista de (user_id, chave, valor_json) e `remover` de (user_id, chave).
+        """
+        async with self.pool.transacao() as c:
+            cur = c.conn.cursor()
+            if gravar:
+                valores = b",".join(cur.mogrify("(%s, %s, %s::jsonb)", linha) for linha in gravar)
+                await c.executar(
+                    b"INSERT INTO user_data (user_id, chave, valor) VALUES " + valores +
+                    b" ON CONFLICT (user_id, chave) DO UPDATE"
+                    b" SET valor = EXCLUDED.valor, updated_at = CURRENT_TIMESTAMP"
+                )
+            if remover:
+                valores = b",".join(cur.mogrify("(%s::bigint, %s)", linha) for linha in remover)
+                await c.executar(
+                    b"DELETE FROM user_data WHERE (user_id, chave) IN (VALUES " + valores + b")"
+                )
+
+    async def remover_dados_usuario(self, user_id):
+        await self.executar("DELETE FROM user_data WHERE user_id = %s", (user_id,))
+
+    async def carregar_conversas(self, nome):
+        return await self.buscar_todos(
+            "SELECT chave, estado FROM conversations WHERE nome = %s", (nome,)
+        )
+
+    async def gravar_conversas(self, gravar, remover):
+        """`gravar`: (nome, chave, estado_json); `remover`: (nome, chave)."""
+        async with self.pool.transacao() as c:
+            cur = c.conn.cursor()
+            if gravar:
+                valores = b",".join(cur.mogrify("(%s, %s, %s::jsonb)", linha) for linha in gravar)
+                await c.executar(
+                    b"INSERT INTO conversations (nome, chave, estado) VALUES " + valores +
+                    b" ON CONFLICT (nome, chave) DO UPDATE"
+                    b" SET estado = EXCLUDED.estado, updated_at = CURRENT_TIMESTAMP"
+                )
+            if remover:
+                valores = b",".join(cur.mogrify("(%s, %s)", linha) for linha in remover)
+                await c.executar(
+                    b"DELETE FROM conversations WHERE (nome, chave) IN (VALUES " + valores + b")"
+                )
+
+    # ————— file_ids de mídias já enviadas —————
+    async def carregar_file_ids(self):
+        rows = await self.buscar_todos("SELECT chave, assinatura, file_id FROM telegram_file_ids")
+        return {r["chave"]: (r["assinatura"], r["file_id"]) for r in rows}
+
+    async def gravar_file_ids(self, linhas):
+        """`linhas`: lista de (chave, assinatura, file_id)."""
+        async with self.pool.conexao() as c:
+            cur = c.conn.cursor()
+            valores = b",".join(cur.mogrify("(%s, %s, %s)", linha) for linha in linhas)
+            await c.executar(
+                b"INSERT INTO telegram_file_ids (chave, assinatura, file_id) VALUES " + valores +
+                b" ON CONFLICT (chave) DO UPDATE SET assinatura = EXCLUDED.assinatura,"
+                b" file_id = EXCLUDED.file_id, updated_at = CURRENT_TIMESTAMP"
+            )
+
+    # ————— admins —————
+    async def inserir_admin(self, user_id, expira_em=None):
+        await self.executar(
+            """
+            INSERT INTO admins (user_id, expires_at)
+            VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET expires_at = EXCLUDED.expires_at
+            """,
+            (user_id, expira_em)
+        )
+
+    async def remover_admin(self, user_id):
+        return await self.executar("DELETE FROM admins WHERE user_id = %s", (user_id,)) > 0
+
+    async def versao_admins(self):
+        # admins_versao é atualizada por trigger a cada INSERT/UPDATE/DELETE em admins
+        row = await self.buscar_um("SELECT versao FROM admins_versao")
+        return row["versao"] if row else 0
+
+    async def carregar_admins(self):
+        async with self.pool.conexao() as c:
+            # a versão vem antes: uma mudança no meio do caminho só causa uma releitura a mais
+            versao = await c.buscar_um("SELECT versao FROM admins_versao")
+            rows = await c.buscar_todos("SELECT user_id, expires_at FROM admins")
+        return {
+            "versao": versao["versao"] if versao else 0,
+            "admins": {r["user_id"]: r["expires_at"] for r in rows},
+        }
+
+    async def remover_admins_expirados(self, agora):
+        return await self.executar("DELETE FROM admins WHERE expires_at <= %s", (agora,))
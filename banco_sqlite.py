@@ -0,0 +1,786 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from armazenamento import Armazenamento
+
+# Implementação embutida do armazenamento num arquivo SQLite, para instalações
+# pequenas e testes sem servidor. O arquivo fica em WAL: uma conexão de escrita
+# (as escritas são serializadas numa thread só) e algumas de leitura em paralelo.
+# As consultas são fixas e parametrizadas, então o cache de statements do sqlite3
+# reaproveita o preparo de cada uma.
+
+logger = logging.getLogger(__name__)
+
+# carimbo de data/hora local com milissegundos; o mesmo formato sai do adaptador
+# abaixo, para comparações de texto (keyset, janelas) darem o resultado certo
+AGORA = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+AGORA_MAIS = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', ?)"
+
+
+def _adaptar_datetime(d):
+    if d.tzinfo is not None:
+        d = d.astimezone().replace(tzinfo=None)
+    return d.strftime("%Y-%m-%d %H:%M:%S.") + f"{d.microsecond // 1000:03d}"
+
+
+def _converter_timestamp(valor):
+    return datetime.fromisoformat(valor.decode())
+
+
+sqlite3.register_adapter(datetime, _adaptar_datetime)
+sqlite3.register_converter("TIMESTAMP", _converter_timestamp)
+
+
+def _segundos(n):
+    return f"{float(n):+} seconds"
+
+
+def _linha_dict(cur, row):
+    return {d[0]: v for d, v in zip(cur.description, row)}
+
+
+# Cada migração roda uma vez, numa transação; a versão aplicada fica em
+# PRAGMA user_version. Mesmo esquema do Postgres, sem os shards dos contadores.
+MIGRACOES_SQLITE = [
+    (1, "esquema inicial", [
+        "CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY)",
+        """CREATE TABLE IF NOT EXISTS videos (
+            id TEXT PRIMARY KEY,
+            link TEXT
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS pending_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            video_id TEXT,
+            requested_at TIMESTAMP DEFAULT ({AGORA}),
+            status TEXT DEFAULT 'pendente',
+            repeat_count INTEGER NOT NULL DEFAULT 1,
+            last_seen_at TIMESTAMP DEFAULT ({AGORA})
+        )""",
+        """CREATE INDEX IF NOT EXISTS pending_requests_video_status_idx
+           ON pending_requests (video_id, status)""",
+        """CREATE INDEX IF NOT EXISTS pending_requests_status_requested_id_idx
+           ON pending_requests (status, requested_at, id)""",
+        """CREATE INDEX IF NOT EXISTS pending_requests_requested_id_idx
+           ON pending_requests (requested_at, id)""",
+        """CREATE INDEX IF NOT EXISTS pending_requests_user_requested_idx
+           ON pending_requests (user_id, requested_at DESC)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS pending_requests_aberto_uniq
+           ON pending_requests (user_id, video_id) WHERE status = 'pendente'""",
+        f"""CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER NOT NULL UNIQUE
+                REFERENCES pending_requests(id) ON DELETE CASCADE,
+            chat_id INTEGER NOT NULL,
+            video_id TEXT NOT NULL,
+            link TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT ({AGORA}),
+            locked_at TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT ({AGORA}),
+            delivered_at TIMESTAMP,
+            last_error TEXT
+        )""",
+        """CREATE INDEX IF NOT EXISTS notification_outbox_prontas_idx
+           ON notification_outbox (next_attempt_at) WHERE status = 'pendente'""",
+        """CREATE INDEX IF NOT EXISTS notification_outbox_enviando_idx
+           ON notification_outbox (locked_at) WHERE status = 'enviando'""",
+        # contadores e agregados mantidos por trigger, como no Postgres
+        """CREATE TABLE IF NOT EXISTS request_counters (
+            status TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS request_daily_stats (
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, status)
+        )""",
+        """CREATE TABLE IF NOT EXISTS video_request_hourly (
+            hour TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, video_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS video_demand (
+            video_id TEXT PRIMARY KEY,
+            requesters INTEGER NOT NULL DEFAULT 0,
+            oldest_requested_at TIMESTAMP,
+            last_requested_at TIMESTAMP
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS pending_requests_ins AFTER INSERT ON pending_requests
+           BEGIN
+               INSERT INTO request_counters (status, total) SELECT NEW.status, 1 WHERE NEW.status IS NOT NULL
+               ON CONFLICT (status) DO UPDATE SET total = total + 1;
+               INSERT INTO request_daily_stats (day, status, total)
+               SELECT date(NEW.requested_at), COALESCE(NEW.status, ''), 1 WHERE NEW.requested_at IS NOT NULL
+               ON CONFLICT (day, status) DO UPDATE SET total = total + 1;
+               INSERT INTO video_request_hourly (hour, video_id, total)
+               SELECT strftime('%Y-%m-%d %H:00:00', NEW.requested_at), NEW.video_id, 1
+                WHERE NEW.video_id IS NOT NULL AND NEW.requested_at IS NOT NULL
+               ON CONFLICT (hour, video_id) DO UPDATE SET total = total + 1;
+               INSERT INTO video_demand (video_id, requesters, oldest_requested_at, last_requested_at)
+               SELECT NEW.video_id, 1, NEW.requested_at, NEW.requested_at
+                WHERE NEW.status = 'pendente' AND NEW.video_id IS NOT NULL
+               ON CONFLICT (video_id) DO UPDATE
+                  SET requesters = requesters + 1,
+                      oldest_requested_at = min(oldest_requested_at, excluded.oldest_requested_at),
+                      last_requested_at = max(last_requested_at, excluded.last_requested_at);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS pending_requests_del AFTER DELETE ON pending_requests
+           BEGIN
+               UPDATE request_counters SET total = total - 1 WHERE status = OLD.status;
+               UPDATE video_demand
+                  SET requesters = requesters - 1,
+                      oldest_requested_at = CASE
+                          WHEN oldest_requested_at < OLD.requested_at THEN oldest_requested_at
+                          ELSE (SELECT MIN(requested_at) FROM pending_requests
+                                 WHERE video_id = OLD.video_id AND status = 'pendente')
+                      END
+                WHERE video_id = OLD.video_id AND OLD.status = 'pendente';
+               DELETE FROM video_demand WHERE video_id = OLD.video_id AND requesters <= 0;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS pending_requests_upd AFTER UPDATE OF status ON pending_requests
+           WHEN OLD.status IS NOT NEW.status
+           BEGIN
+               UPDATE request_counters SET total = total - 1 WHERE status = OLD.status;
+               INSERT INTO request_counters (status, total) SELECT NEW.status, 1 WHERE NEW.status IS NOT NULL
+               ON CONFLICT (status) DO UPDATE SET total = total + 1;
+               UPDATE video_demand
+                  SET requesters = requesters - 1,
+                      oldest_requested_at = CASE
+                          WHEN oldest_requested_at < OLD.requested_at THEN oldest_requested_at
+                          ELSE (SELECT MIN(requested_at) FROM pending_requests
+                                 WHERE video_id = OLD.video_id AND status = 'pendente')
+                      END
+                WHERE video_id = OLD.video_id AND OLD.status = 'pendente';
+               DELETE FROM video_demand WHERE video_id = OLD.video_id AND requesters <= 0;
+               INSERT INTO video_demand (video_id, requesters, oldest_requested_at, last_requested_at)
+               SELECT NEW.video_id, 1, NEW.requested_at, NEW.requested_at
+                WHERE NEW.status = 'pendente' AND NEW.video_id IS NOT NULL
+               ON CONFLICT (video_id) DO UPDATE
+                  SET requesters = requesters + 1,
+                      oldest_requested_at = min(oldest_requested_at, excluded.oldest_requested_at),
+                      last_requested_at = max(last_requested_at, excluded.last_requested_at);
+           END""",
+        # persistência do bot
+        f"""CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER NOT NULL,
+            chave TEXT NOT NULL,
+            valor TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT ({AGORA}),
+            PRIMARY KEY (user_id, chave)
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS conversations (
+            nome TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT ({AGORA}),
+            PRIMARY KEY (nome, chave)
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS telegram_file_ids (
+            chave TEXT PRIMARY KEY,
+            assinatura TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT ({AGORA})
+        )""",
+    ]),
+    (2, "versão de cada vídeo para a réplica local", [
+        "ALTER TABLE videos ADD COLUMN versao INTEGER NOT NULL DEFAULT 0",
+        "UPDATE videos SET versao = rowid",
+        "CREATE INDEX IF NOT EXISTS videos_versao_idx ON videos (versao)",
+        """CREATE TRIGGER IF NOT EXISTS videos_versao_ins AFTER INSERT ON videos
+           BEGIN
+               UPDATE videos SET versao = (SELECT MAX(versao) FROM videos) + 1 WHERE id = NEW.id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS videos_versao_upd AFTER UPDATE OF link ON videos
+           WHEN OLD.link IS NOT NEW.link
+           BEGIN
+               UPDATE videos SET versao = (SELECT MAX(versao) FROM videos) + 1 WHERE id = NEW.id;
+           END""",
+    ]),
+    (3, "validade dos admins e versão para sincronizar instâncias", [
+        "ALTER TABLE admins ADD COLUMN expires_at TIMESTAMP",
+        "CREATE TABLE IF NOT EXISTS admins_versao (versao INTEGER NOT NULL)",
+        "INSERT INTO admins_versao (versao) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM admins_versao)",
+        """CREATE TRIGGER IF NOT EXISTS admins_versao_ins AFTER INSERT ON admins
+           BEGIN UPDATE admins_versao SET versao = versao + 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS admins_versao_upd AFTER UPDATE ON admins
+           BEGIN UPDATE admins_versao SET versao = versao + 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS admins_versao_del AFTER DELETE ON admins
+           BEGIN UPDATE admins_versao SET versao = versao + 1; END""",
+    ]),
+]
+
+
+class BancoSQLite(Armazenamento):
+    """Operações de banco usadas pelos handlers do bot, num arquivo SQLite."""
+
+    def __init__(self, caminho, leitores=4, cache_statements=256, timeout=10.0):
+        self.caminho = caminho
+        self.n_leitores = max(leitores, 1)
+        self.cache_statements = cache_statements
+        self.timeout = timeout
+
+        self._escritor = None
+        self._leitores = None
+        self._exec_escrita = None
+        self._exec_leitura = None
+        # o PTB lê a persistência no initialize(), antes do post_init chamar abrir()
+        self._abertura = asyncio.Lock()
+
+        # estatísticas (mesmas chaves do pool do Postgres)
+        self.pedidos = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.timeouts = 0
+        self._escrevendo = 0
+
+    # ————— conexões —————
+    def _conectar(self):
+        conn = sqlite3.connect(
+            self.caminho,
+            timeout=self.timeout,
+            isolation_level=None,  # transações explícitas (BEGIN IMMEDIATE)
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            cached_statements=self.cache_statements,
+        )
+        conn.row_factory = _linha_dict
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        return conn
+
+    def _migrar(self, conn):
+        conn.execute("PRAGMA journal_mode = WAL")
+        versao = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+        for numero, descricao, comandos in MIGRACOES_SQLITE:
+            if numero <= versao:
+                continue
+            logger.info(f"Aplicando migração SQLite {numero}: {descricao}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for comando in comandos:
+                    conn.execute(comando)
+                conn.execute(f"PRAGMA user_version = {numero}")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            versao = numero
+        return versao
+
+    async def abrir(self):
+        """Conecta e migra; pode ser chamado várias vezes e também roda no primeiro uso."""
+        async with self._abertura:
+            if self._escritor is not None:
+                return
+            pasta = os.path.dirname(os.path.abspath(self.caminho))
+            os.makedirs(pasta, exist_ok=True)
+            loop = asyncio.get_running_loop()
+            self._exec_escrita = ThreadPoolExecutor(1, thread_name_prefix="sqlite-escrita")
+            self._exec_leitura = ThreadPoolExecutor(self.n_leitores, thread_name_prefix="sqlite-leitura")
+            self._escritor = await loop.run_in_executor(self._exec_escrita, self._conectar)
+            versao = await loop.run_in_executor(self._exec_escrita, self._migrar, self._escritor)
+            logger.info(f"SQLite {self.caminho} na versão {versao}.")
+            leitores = asyncio.Queue()
+            for _ in range(self.n_leitores):
+                leitores.put_nowait(await loop.run_in_executor(self._exec_leitura, self._conectar))
+            # só fica visível com todas as conexões prontas
+            self._leitores = leitores
+
+    async def fechar(self):
+        if self._escritor is None:
+            return
+        loop = asyncio.get_running_loop()
+        while not self._leitores.empty():
+            conn = self._leitores.get_nowait()
+            await loop.run_in_executor(self._exec_leitura, conn.close)
+        await loop.run_in_executor(self._exec_escrita, self._escritor.close)
+        self._exec_leitura.shutdown()
+        self._exec_escrita.shutdown()
+        self._escritor = None
+        self._leitores = None
+
+    async def _pegar_leitor(self):
+        if self._leitores is None:
+            await self.abrir()
+        inicio = time.monotonic()
+        esperou = self._leitores.empty()
+        try:
+            conn = await asyncio.wait_for(self._leitores.get(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        espera = time.monotonic() - inicio
+        self.pedidos += 1
+        self.espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+        if esperou:
+            self.esperas += 1
+        return conn
+
+    async def _ler(self, fn, *args):
+        conn = await self._pegar_leitor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._exec_leitura, fn, conn, *args)
+        finally:
+            self._leitores.put_nowait(conn)
+
+    async def _escrever(self, fn, *args):
+        """Roda `fn(conn, *args)` numa transação na thread de escrita."""
+        def transacao():
+            self._escritor.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = fn(self._escritor, *args)
+            except BaseException:
+                self._escritor.execute("ROLLBACK")
+                raise
+            self._escritor.execute("COMMIT")
+            return resultado
+
+        if self._leitores is None:
+            await self.abrir()
+        self._escrevendo += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._exec_escrita, transacao)
+        finally:
+            self._escrevendo -= 1
+
+    async def _buscar_todos(self, query, params=()):
+        return await self._ler(lambda conn: conn.execute(query, params).fetchall())
+
+    async def _buscar_um(self, query, params=()):
+        return await self._ler(lambda conn: conn.execute(query, params).fetchone())
+
+    async def _executar(self, query, params=()):
+        return await self._escrever(lambda conn: conn.execute(query, params).rowcount)
+
+    async def verificar(self):
+        await self._buscar_um("SELECT 1 AS ok")
+
+    def estatisticas(self):
+        ociosas = self._leitores.qsize() if self._leitores is not None else 0
+        return {
+            "em_uso": (self.n_leitores - ociosas) + min(self._escrevendo, 1),
+            "ociosas": ociosas,
+            "total": self.n_leitores + 1,
+            "minimo": self.n_leitores + 1,
+            "maximo": self.n_leitores + 1,
+            "pedidos": self.pedidos,
+            "esperas": self.esperas,
+            "espera_media_ms": (self.espera_total / self.pedidos * 1000) if self.pedidos else 0.0,
+            "espera_max_ms": self.espera_max * 1000,
+            "criadas": self.n_leitores + 1,
+            "recicladas": 0,
+            "descartadas": 0,
+            "timeouts": self.timeouts,
+        }
+
+    # ————— videos —————
+    async def buscar_link(self, vid):
+        row = await self._buscar_um("SELECT link FROM videos WHERE id = ?", (vid,))
+        return row["link"] if row else None
+
+    async def upsert_video(self, vid, link=None):
+        if link is not None:
+            await self._executar(
+                "INSERT INTO videos (id, link) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET link = excluded.link",
+                (vid, link)
+            )
+        else:
+            await self._executar("INSERT INTO videos (id) VALUES (?) ON CONFLICT (id) DO NOTHING", (vid,))
+
+    @staticmethod
+    def _upsert_pendente(conn, usuario_id, username, first_name, video_id, status="pendente"):
+        """Insere o pedido ou soma no pendente aberto do mesmo usuário/ID; diz se era repetido."""
+        row = conn.execute(
+            f"""
+            INSERT INTO pending_requests (user_id, username, first_name, video_id, status)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, video_id) WHERE status = 'pendente' DO UPDATE
+               SET repeat_count = repeat_count + 1,
+                   last_seen_at = {AGORA},
+                   username = excluded.username,
+                   first_name = excluded.first_name
+            RETURNING repeat_count
+            """,
+            (usuario_id, username, first_name, video_id, status)
+        ).fetchone()
+        return row["repeat_count"] > 1
+
+    async def resolver_pedido(self, usuario_id, username, first_name, video_id, provavelmente_sem_link=False):
+        """
+        Leitura sem trava quando o link provavelmente existe; senão uma
+        transação de escrita, que no SQLite já é exclusiva (quem cadastra o
+        link espera este pedido terminar, como no Postgres).
+        """
+        if not provavelmente_sem_link:
+            link = await self.buscar_link(video_id)
+            if link is not None:
+                return {"link": link, "novo": False, "status": "encontrado", "repetido": False}
+
+        def resolver(conn):
+            row = conn.execute("SELECT link FROM videos WHERE id = ?", (video_id,)).fetchone()
+            if row and row["link"] is not None:
+                return {"link": row["link"], "novo": False, "status": "encontrado", "repetido": False}
+            if row is None:
+                conn.execute("INSERT INTO videos (id) VALUES (?)", (video_id,))
+            repetido = self._upsert_pendente(conn, usuario_id, username, first_name, video_id)
+            return {"link": None, "novo": row is None, "status": "pendente", "repetido": repetido}
+
+        return await self._escrever(resolver)
+
+    async def videos_alterados(self, desde_versao, limite):
+        return await self._buscar_todos(
+            "SELECT id, link, versao FROM videos WHERE versao > ? ORDER BY versao LIMIT ?",
+            (desde_versao, limite)
+        )
+
+    async def importar_videos(self, itens):
+        def importar(conn):
+            ids = json.dumps([vid for vid, _ in itens])
+            existentes = {
+                r["id"] for r in conn.execute(
+                    "SELECT id FROM videos WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+                )
+            }
+            conn.executemany(
+                "INSERT INTO videos (id, link) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET link = excluded.link",
+                itens
+            )
+            notificacoes = self._enfileirar(conn, ids)
+            novos = len({vid for vid, _ in itens} - existentes)
+            return novos, len(itens) - novos, notificacoes
+
+        return await self._escrever(importar)
+
+    # ————— pending_requests —————
+    async def registrar_pedido(self, usuario_id, username, first_name, video_id, status="pendente"):
+        await self._escrever(self._upsert_pendente, usuario_id, username, first_name, video_id, status)
+
+    async def registrar_pedidos_lote(self, linhas):
+        await self._escrever(lambda conn: conn.executemany(
+            "INSERT INTO pending_requests (user_id, username, first_name, video_id, status, requested_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            linhas
+        ))
+
+    async def listar_pedidos(self, status=None, user_id=None, video_id=None, mais_recentes_primeiro=False):
+        filtros, params = [], []
+        if status is not None:
+            filtros.append("status = ?")
+            params.append(status)
+        if user_id is not None:
+            filtros.append("user_id = ?")
+            params.append(user_id)
+        if video_id is not None:
+            filtros.append("video_id = ?")
+            params.append(video_id)
+
+        query = (
+            "SELECT user_id, username, video_id, requested_at, status, repeat_count "
+            "FROM pending_requests"
+        )
+        if filtros:
+            query += " WHERE " + " AND ".join(filtros)
+        query += " ORDER BY requested_at " + ("DESC" if mais_recentes_primeiro else "ASC")
+        return await self._buscar_todos(query, tuple(params))
+
+    async def pagina_pedidos(self, status=None, cursor=None, anterior=False, limite=10):
+        filtros, params = [], []
+        if status is not None:
+            filtros.append("status = ?")
+            params.append(status)
+        if cursor is not None:
+            filtros.append("(requested_at, id) " + ("<" if anterior else ">") + " (?, ?)")
+            params.extend(cursor)
+
+        ordem = "DESC" if anterior else "ASC"
+        query = "SELECT id, user_id, username, video_id, requested_at, status FROM pending_requests"
+        if filtros:
+            query += " WHERE " + " AND ".join(filtros)
+        query += f" ORDER BY requested_at {ordem}, id {ordem} LIMIT ?"
+        params.append(limite + 1)
+
+        rows = await self._buscar_todos(query, tuple(params))
+        tem_mais = len(rows) > limite
+        rows = rows[:limite]
+        if anterior:
+            rows.reverse()
+        return rows, tem_mais
+
+    async def exportar_pedidos(self, status=None, desde=None, ate=None, lote=1000):
+        """Lotes lidos de um cursor só, numa conexão de leitura presa até o fim."""
+        filtros, params = [], []
+        if status is not None:
+            filtros.append("status = ?")
+            params.append(status)
+        if desde is not None:
+            filtros.append("requested_at >= ?")
+            params.append(desde)
+        if ate is not None:
+            filtros.append("requested_at < ?")
+            params.append(ate)
+
+        query = "SELECT id, user_id, username, first_name, video_id, requested_at, status FROM pending_requests"
+        if filtros:
+            query += " WHERE " + " AND ".join(filtros)
+        query += " ORDER BY requested_at, id"
+
+        loop = asyncio.get_running_loop()
+        conn = await self._pegar_leitor()
+        cur = None
+        try:
+            cur = await loop.run_in_executor(self._exec_leitura, conn.execute, query, tuple(params))
+            while True:
+                rows = await loop.run_in_executor(self._exec_leitura, cur.fetchmany, lote)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            if cur is not None:
+                await loop.run_in_executor(self._exec_leitura, cur.close)
+            self._leitores.put_nowait(conn)
+
+    async def contar_pedidos(self):
+        row = await self._buscar_um("SELECT COALESCE(SUM(total), 0) AS total FROM request_counters")
+        return row["total"] if row else 0
+
+    async def estatisticas_pedidos(self, dias=7, top=10):
+        def ler(conn):
+            por_status = conn.execute(
+                "SELECT status, total FROM request_counters WHERE total <> 0 ORDER BY status"
+            ).fetchall()
+            por_dia = conn.execute(
+                "SELECT status, SUM(total) AS total FROM request_daily_stats "
+                "WHERE day > date('now', 'localtime', ?) GROUP BY status",
+                (f"-{int(dias)} days",)
+            ).fetchall()
+            tops = {}
+            for horas in (24, 24 * dias):
+                tops[horas] = conn.execute(
+                    "SELECT video_id, SUM(total) AS total FROM video_request_hourly "
+                    "WHERE hour > strftime('%Y-%m-%d %H:00:00', 'now', 'localtime', ?) "
+                    "GROUP BY video_id ORDER BY total DESC, video_id LIMIT ?",
+                    (f"-{int(horas)} hours", top)
+                ).fetchall()
+            return por_status, por_dia, tops
+
+        por_status, por_dia, tops = await self._ler(ler)
+        return {
+            "por_status": {r["status"]: r["total"] for r in por_status},
+            "chegadas": {r["status"]: r["total"] for r in por_dia},
+            "top_24h": tops[24],
+            "top_periodo": tops[24 * dias],
+        }
+
+    async def fila_por_demanda(self, peso_demanda=1.0, peso_idade=0.1, limite=10):
+        return await self._buscar_todos(
+            """
+            SELECT d.video_id,
+                   d.requesters,
+                   d.oldest_requested_at,
+                   (julianday('now', 'localtime') - julianday(d.oldest_requested_at)) * 86400 AS idade_segundos,
+                   d.requesters * :peso_demanda
+                     + (julianday('now', 'localtime') - julianday(d.oldest_requested_at)) * 24 * :peso_idade
+                     AS prioridade
+              FROM video_demand d
+              JOIN videos v ON v.id = d.video_id
+             WHERE v.link IS NULL
+             ORDER BY prioridade DESC, d.oldest_requested_at
+             LIMIT :limite
+            """,
+            {"peso_demanda": peso_demanda, "peso_idade": peso_idade, "limite": limite}
+        )
+
+    async def podar_estatisticas(self, dias=8):
+        return await self._executar(
+            "DELETE FROM video_request_hourly WHERE hour < strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime', ?)",
+            (f"-{int(dias)} days",)
+        )
+
+    # ————— notification_outbox —————
+    @staticmethod
+    def _enfileirar(conn, ids_json):
+        rows = conn.execute(
+            f"""
+            INSERT INTO notification_outbox (request_id, chat_id, video_id, link)
+            SELECT p.id, p.user_id, p.video_id, v.link
+              FROM pending_requests p
+              JOIN videos v ON v.id = p.video_id
+             WHERE p.video_id IN (SELECT value FROM json_each(?))
+               AND p.status = 'pendente' AND v.link IS NOT NULL
+            ON CONFLICT (request_id) DO UPDATE
+               SET link = excluded.link,
+                   status = 'pendente',
+                   attempts = 0,
+                   next_attempt_at = {AGORA},
+                   last_error = NULL
+             WHERE notification_outbox.status IN ('pendente', 'falhou')
+            RETURNING id
+            """,
+            (ids_json,)
+        ).fetchall()
+        return [r["id"] for r in rows]
+
+    async def enfileirar_notificacoes(self, video_ids):
+        return await self._escrever(self._enfileirar, json.dumps(list(video_ids)))
+
+    async def reivindicar_notificacoes(self, limite, trava_expira):
+        # a escrita já é exclusiva no SQLite: não há o que pular com SKIP LOCKED
+        return await self._escrever(lambda conn: conn.execute(
+            f"""
+            UPDATE notification_outbox
+               SET status = 'enviando', locked_at = {AGORA}, attempts = attempts + 1
+             WHERE id IN (
+                SELECT id FROM notification_outbox
+                 WHERE (status = 'pendente' AND next_attempt_at <= {AGORA})
+                    OR (status = 'enviando' AND locked_at < {AGORA_MAIS})
+                 ORDER BY id
+                 LIMIT ?
+             )
+            RETURNING id, request_id, chat_id, video_id, link, attempts
+            """,
+            (_segundos(-trava_expira), limite)
+        ).fetchall())
+
+    async def marcar_notificacao_entregue(self, outbox_id):
+        def entregar(conn):
+            row = conn.execute(
+                f"UPDATE notification_outbox SET status = 'entregue', delivered_at = {AGORA}, locked_at = NULL "
+                "WHERE id = ? RETURNING request_id",
+                (outbox_id,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE pending_requests SET status = 'concluido' WHERE id = ? AND status = 'pendente'",
+                    (row["request_id"],)
+                )
+
+        await self._escrever(entregar)
+
+    async def marcar_notificacao_falha(self, outbox_id, erro, definitiva, max_tentativas, atraso):
+        def falhar(conn):
+            row = conn.execute(
+                f"""
+                UPDATE notification_outbox
+                   SET status = CASE WHEN ? OR attempts >= ? THEN 'falhou' ELSE 'pendente' END,
+                       next_attempt_at = {AGORA_MAIS},
+                       locked_at = NULL,
+                       last_error = ?
+                 WHERE id = ?
+                RETURNING request_id, status
+                """,
+                (bool(definitiva), max_tentativas, _segundos(atraso), erro, outbox_id)
+            ).fetchone()
+            # falha definitiva encerra o pedido também (sai da fila e não absorve novos pedidos)
+            if row and row["status"] == "falhou":
+                conn.execute(
+                    "UPDATE pending_requests SET status = 'falhou' WHERE id = ? AND status = 'pendente'",
+                    (row["request_id"],)
+                )
+
+        await self._escrever(falhar)
+
+    async def progresso_notificacoes(self, ids):
+        rows = await self._buscar_todos(
+            "SELECT status, COUNT(*) AS total FROM notification_outbox "
+            "WHERE id IN (SELECT value FROM json_each(?)) GROUP BY status",
+            (json.dumps(list(ids)),)
+        )
+        return {r["status"]: r["total"] for r in rows}
+
+    # ————— persistência (user_data e conversas) —————
+    async def carregar_dados_usuario(self, user_id):
+        rows = await self._buscar_todos("SELECT chave, valor FROM user_data WHERE user_id = ?", (user_id,))
+        return {r["chave"]: json.loads(r["valor"]) for r in rows}
+
+    async def listar_usuarios_com_dados(self):
+        rows = await self._buscar_todos("SELECT DISTINCT user_id FROM user_data")
+        return {r["user_id"] for r in rows}
+
+    async def gravar_dados_usuarios(self, gravar, remover):
+        def gravar_tudo(conn):
+            conn.executemany(
+                f"INSERT INTO user_data (user_id, chave, valor) VALUES (?, ?, ?) "
+                f"ON CONFLICT (user_id, chave) DO UPDATE SET valor = excluded.valor, updated_at = {AGORA}",
+                gravar
+            )
+            conn.executemany("DELETE FROM user_data WHERE user_id = ? AND chave = ?", remover)
+
+        await self._escrever(gravar_tudo)
+
+    async def remover_dados_usuario(self, user_id):
+        await self._executar("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def carregar_conversas(self, nome):
+        rows = await self._buscar_todos("SELECT chave, estado FROM conversations WHERE nome = ?", (nome,))
+        return [{"chave": r["chave"], "estado": json.loads(r["estado"])} for r in rows]
+
+    async def gravar_conversas(self, gravar, remover):
+        def gravar_tudo(conn):
+            conn.executemany(
+                f"INSERT INTO conversations (nome, chave, estado) VALUES (?, ?, ?) "
+                f"ON CONFLICT (nome, chave) DO UPDATE SET estado = excluded.estado, updated_at = {AGORA}",
+                gravar
+            )
+            conn.executemany("DELETE FROM conversations WHERE nome = ? AND chave = ?", remover)
+
+        await self._escrever(gravar_tudo)
+
+    # ————— file_ids de mídias já enviadas —————
+    async def carregar_file_ids(self):
+        rows = await self._buscar_todos("SELECT chave, assinatura, file_id FROM telegram_file_ids")
+        return {r["chave"]: (r["assinatura"], r["file_id"]) for r in rows}
+
+    async def gravar_file_ids(self, linhas):
+        await self._escrever(lambda conn: conn.executemany(
+            f"INSERT INTO telegram_file_ids (chave, assinatura, file_id) VALUES (?, ?, ?) "
+            f"ON CONFLICT (chave) DO UPDATE SET assinatura = excluded.assinatura, "
+            f"file_id = excluded.file_id, updated_at = {AGORA}",
+            linhas
+        ))
+
+    # ————— admins —————
+    async def inserir_admin(self, user_id, expira_em=None):
+        await self._executar(
+            "INSERT INTO admins (user_id, expires_at) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET expires_at = excluded.expires_at",
+            (user_id, expira_em)
+        )
+
+    async def remover_admin(self, user_id):
+        return await self._executar("DELETE FROM admins WHERE user_id = ?", (user_id,)) > 0
+
+    async def versao_admins(self):
+        row = await self._buscar_um("SELECT versao FROM admins_versao")
+        return row["versao"] if row else 0
+
+    async def carregar_admins(self):
+        def ler(conn):
+            versao = conn.execute("SELECT versao FROM admins_versao").fetchone()
+            rows = conn.execute("SELECT user_id, expires_at FROM admins").fetchall()
+            return versao, rows
+
+        versao, rows = await self._ler(ler)
+        return {
+            "versao": versao["versao"] if versao else 0,
+            "admins": {r["user_id"]: r["expires_at"] for r in rows},
+        }
+
+    async def remover_admins_expirados(self, agora):
+        return await self._executar("DELETE FROM admins WHERE expires_at <= ?", (agora,))
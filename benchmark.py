@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+# Benchmark de carga do buscavideo.py: chama os handlers de verdade (tratar_id,
+# receber_link_produto, mostrar_fila, mostrar_meus_pedidos) com milhares de
+# usuários simulados, contra uma Bot API falsa local e um banco SQLite semeado.
+# Mede vazão, percentis de latência e idas ao banco por update, e salva/compara
+# uma linha de base em JSON para regressões aparecerem.
+#
+#   python benchmark.py --videos 50000 --pedidos 20000 --acerto 0.7
+#   python benchmark.py --salvar-base base.json
+#   python benchmark.py --comparar base.json   # sai com 1 se houve regressão
+
+TOKEN_FALSO = "123456:BENCHMARK"
+ADMIN_BENCH = 1
+PRIMEIRO_USUARIO = 1000
+
+# métodos da Bot API que o bot usa; a Bot API falsa responde todos com sucesso
+METODOS_MENSAGEM = ("sendMessage", "editMessageText", "sendPhoto", "sendDocument")
+METODOS_BOOL = (
+    "setMyCommands", "deleteMyCommands", "setMyDescription", "setMyShortDescription",
+    "answerCallbackQuery", "deleteMessage", "setWebhook", "deleteWebhook",
+)
+
+# a regressão é medida nestes números (maior é pior, exceto vazão)
+METRICAS_COMPARADAS = ("vazao", "p95", "p99", "banco_por_update")
+
+
+def argumentos(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark de carga do buscavideo com Bot API falsa.")
+    p.add_argument("--videos", type=int, default=20000, help="vídeos semeados")
+    p.add_argument("--com-link", type=float, default=0.5, help="fração dos vídeos semeados que já têm link")
+    p.add_argument("--pedidos", type=int, default=10000, help="pedidos pendentes semeados")
+    p.add_argument("--usuarios", type=int, default=5000, help="usuários simulados distintos")
+    p.add_argument("--acerto", type=float, default=0.7, help="fração dos IDs enviados que têm link")
+    p.add_argument("--operacoes", type=int, default=5000, help="updates de tratar_id")
+    p.add_argument("--consultas", type=int, default=1000, help="updates de /meus_pedidos")
+    p.add_argument("--filas", type=int, default=200, help="updates de /fila")
+    p.add_argument("--links", type=int, default=200, help="links cadastrados por receber_link_produto")
+    p.add_argument("--concorrencia", type=int, default=64, help="updates em andamento ao mesmo tempo")
+    p.add_argument("--latencia-api", type=float, default=0.0, help="atraso da Bot API falsa, em ms")
+    p.add_argument("--com-limite", action="store_true", help="mantém o limite de pedidos por usuário")
+    p.add_argument("--semente", type=int, default=42)
+    p.add_argument("--banco", help="arquivo SQLite (padrão: temporário, apagado no fim)")
+    p.add_argument("--salvar-base", metavar="ARQUIVO", help="grava o resultado como linha de base")
+    p.add_argument("--comparar", metavar="ARQUIVO", help="compara com uma linha de base salva")
+    p.add_argument("--tolerancia", type=float, default=0.2, help="piora aceitável ao comparar (0.2 = 20%%)")
+    return p.parse_args(argv)
+
+
+def preparar_ambiente(args, caminho):
+    # buscavideo lê tudo do ambiente na importação; tem que vir antes do import
+    os.environ["TELEGRAM_BOT_TOKEN"] = TOKEN_FALSO
+    os.environ["BANCO"] = "sqlite"
+    os.environ["SQLITE_CAMINHO"] = caminho
+    os.environ["ADMIN_IDS"] = str(ADMIN_BENCH)
+    os.environ["CANAL_ID"] = "-100"
+    os.environ["REPLICA_VIDEOS"] = "0"
+    if not args.com_limite:
+        os.environ["PEDIDOS_TAXA"] = "1000000"
+        os.environ["PEDIDOS_RAJADA"] = "1000000"
+
+
+def id_video(n):
+    """Índice -> ID no formato AAA-AAA-AAA (base 26)."""
+    letras = []
+    for _ in range(9):
+        n, resto = divmod(n, 26)
+        letras.append(chr(ord("A") + resto))
+    s = "".join(reversed(letras))
+    return f"{s[:3]}-{s[3:6]}-{s[6:]}"
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    k = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[k]
+
+
+# ————— Bot API falsa —————
+class BotAPIFalsa:
+    def __init__(self, porta=0, latencia=0.0):
+        import buscavideo as bv
+        self.servidor = bv.ServidorHTTP("127.0.0.1", porta)
+        self.latencia = latencia
+        self.chamadas = Counter()
+        self._mensagem_id = 0
+        for metodo in METODOS_MENSAGEM:
+            self.servidor.rota(f"/bot{TOKEN_FALSO}/{metodo}", self._responder(metodo, self._mensagem))
+        for metodo in METODOS_BOOL:
+            self.servidor.rota(f"/bot{TOKEN_FALSO}/{metodo}", self._responder(metodo, lambda _: True))
+        self.servidor.rota(f"/bot{TOKEN_FALSO}/getMe", self._responder("getMe", self._eu))
+        self.servidor.rota(
+            f"/bot{TOKEN_FALSO}/sendMediaGroup",
+            self._responder("sendMediaGroup", lambda d: [self._mensagem(d), self._mensagem(d)])
+        )
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.porta}/bot"
+
+    async def iniciar(self):
+        await self.servidor.iniciar()
+        self.porta = self.servidor._servidor.sockets[0].getsockname()[1]
+
+    async def parar(self):
+        await self.servidor.parar()
+
+    @staticmethod
+    def _eu(_):
+        return {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+    def _mensagem(self, dados):
+        self._mensagem_id += 1
+        try:
+            chat_id = int(dados.get("chat_id", 0))
+        except ValueError:
+            chat_id = 0
+        return {
+            "message_id": self._mensagem_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "text": dados.get("text", ""),
+        }
+
+    def _responder(self, metodo, resultado):
+        async def rota(_metodo_http, cabecalhos, corpo):
+            self.chamadas[metodo] += 1
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            dados = {}
+            tipo = cabecalhos.get("content-type", "")
+            if tipo.startswith("application/json"):
+                dados = json.loads(corpo or b"{}")
+            elif tipo.startswith("application/x-www-form-urlencoded"):
+                dados = {k: v[0] for k, v in parse_qs(corpo.decode()).items()}
+            return 200, "application/json", json.dumps({"ok": True, "result": resultado(dados)})
+        return rota
+
+
+# ————— Banco semeado —————
+async def semear(banco, args, rnd):
+    com_link = int(args.videos * args.com_link)
+    lote = 5000
+    for inicio in range(0, args.videos, lote):
+        itens = [
+            (id_video(i), f"https://s.shopee.com.br/bench{i}" if i < com_link else None)
+            for i in range(inicio, min(inicio + lote, args.videos))
+        ]
+        await banco.importar_videos(itens)
+
+    # pendentes só em vídeos sem link; um usuário não repete o mesmo vídeo pendente
+    sem_link = args.videos - com_link
+    pares = set()
+    maximo = min(args.pedidos, sem_link * args.usuarios)
+    while len(pares) < maximo:
+        pares.add((PRIMEIRO_USUARIO + rnd.randrange(args.usuarios), com_link + rnd.randrange(sem_link)))
+    agora = datetime.now()
+    linhas = [
+        (uid, f"u{uid}", f"Usuário {uid}", id_video(i), "pendente",
+         agora - timedelta(seconds=rnd.randrange(30 * 86400)))
+        for uid, i in pares
+    ]
+    for inicio in range(0, len(linhas), lote):
+        await banco.registrar_pedidos_lote(linhas[inicio:inicio + lote])
+    return com_link
+
+
+def contar_operacoes(banco, contador):
+    """Troca os métodos do banco por versões que contam as chamadas (idas ao banco)."""
+    from armazenamento import Armazenamento
+    ignorados = {"abrir", "fechar", "estatisticas", "exportar_pedidos"}
+    for nome in Armazenamento.__abstractmethods__ - ignorados:
+        original = getattr(banco, nome)
+
+        async def contado(*a, _original=original, _nome=nome, **k):
+            contador[_nome] += 1
+            return await _original(*a, **k)
+
+        setattr(banco, nome, contado)
+
+
+# ————— Updates simulados —————
+class Simulador:
+    def __init__(self, app):
+        self.app = app
+        self._update_id = 0
+
+    def update(self, user_id, texto):
+        from telegram import Chat, Message, Update, User
+        self._update_id += 1
+        user = User(user_id, f"Usuário {user_id}", False, username=f"u{user_id}")
+        msg = Message(
+            self._update_id, datetime.now(timezone.utc), Chat(user_id, "private"),
+            from_user=user, text=texto
+        )
+        msg.set_bot(self.app.bot)
+        upd = Update(self._update_id, message=msg)
+        upd.set_bot(self.app.bot)
+        return upd
+
+    def contexto(self, update):
+        from telegram.ext import CallbackContext
+        return CallbackContext.from_update(update, self.app)
+
+
+async def rodar_fase(nome, total, concorrencia, gerar, banco_ops, api):
+    """Executa `total` chamadas de gerar(i) -> coroutine e devolve as métricas da fase."""
+    latencias = []
+    erros = 0
+    proximo = iter(range(total))
+
+    async def trabalhador():
+        nonlocal erros
+        for i in proximo:
+            inicio = time.perf_counter()
+            try:
+                await gerar(i)
+            except Exception:
+                erros += 1
+                logging.getLogger(__name__).exception(f"Erro na fase {nome}")
+            latencias.append(time.perf_counter() - inicio)
+
+    banco_antes = sum(banco_ops.values())
+    api_antes = sum(api.chamadas.values())
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabalhador() for _ in range(min(concorrencia, total))))
+    duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+    ms = [x * 1000 for x in latencias]
+    return {
+        "updates": total,
+        "erros": erros,
+        "duracao": round(duracao, 3),
+        "vazao": round(total / duracao, 1) if duracao else 0.0,
+        "p50": round(percentil(ms, 50), 3),
+        "p95": round(percentil(ms, 95), 3),
+        "p99": round(percentil(ms, 99), 3),
+        "max": round(ms[-1], 3) if ms else 0.0,
+        "banco_por_update": round((sum(banco_ops.values()) - banco_antes) / total, 3) if total else 0.0,
+        "api_por_update": round((sum(api.chamadas.values()) - api_antes) / total, 3) if total else 0.0,
+    }
+
+
+async def executar(args, caminho):
+    import buscavideo as bv
+    from telegram.ext import ApplicationBuilder
+
+    rnd = random.Random(args.semente)
+    api = BotAPIFalsa(latencia=args.latencia_api / 1000)
+    await api.iniciar()
+
+    # sem post_init: o ciclo de vida é chamado à mão para semear antes de medir
+    app = ApplicationBuilder().token(TOKEN_FALSO).base_url(api.base_url).build()
+    await app.initialize()
+    await bv.DB.abrir()
+    print(f"Semeando {args.videos} vídeos e {args.pedidos} pedidos em {caminho}...")
+    com_link = await semear(bv.DB, args, rnd)
+
+    banco_ops = Counter()
+    contar_operacoes(bv.DB, banco_ops)
+    await bv.pos_inicializacao(app)
+    # sem updater: só deixa a aplicação "rodando" para as tarefas criadas pelos handlers
+    await app.start()
+    sim = Simulador(app)
+
+    def usuario():
+        return PRIMEIRO_USUARIO + rnd.randrange(args.usuarios)
+
+    def vid_pedido():
+        if com_link and (rnd.random() < args.acerto or com_link == args.videos):
+            return id_video(rnd.randrange(com_link))
+        # sem link: metade já semeada (com fila), metade nunca vista
+        return id_video(com_link + rnd.randrange(max(args.videos - com_link, 1) * 2))
+
+    async def tratar_id(_):
+        upd = sim.update(usuario(), vid_pedido())
+        await bv.tratar_id(upd, sim.contexto(upd))
+
+    async def meus_pedidos(_):
+        upd = sim.update(usuario(), "/meus_pedidos")
+        await bv.mostrar_meus_pedidos(upd, sim.contexto(upd))
+
+    async def fila(_):
+        upd = sim.update(ADMIN_BENCH, "/fila")
+        await bv.mostrar_fila(upd, sim.contexto(upd))
+
+    # cadastra links dos vídeos sem link, a começar pelos que já têm fila
+    sem_link = list(range(com_link, args.videos))
+    rnd.shuffle(sem_link)
+
+    async def receber_link(i):
+        upd = sim.update(ADMIN_BENCH, f"https://s.shopee.com.br/novo{i}")
+        ctx = sim.contexto(upd)
+        ctx.user_data["nome_produto"] = f"Produto {i}"
+        ctx.user_data["id_produto"] = id_video(sem_link[i % len(sem_link)] if sem_link else i)
+        await bv.receber_link_produto(upd, ctx)
+
+    fases = [
+        ("tratar_id", args.operacoes, tratar_id),
+        ("mostrar_meus_pedidos", args.consultas, meus_pedidos),
+        ("mostrar_fila", args.filas, fila),
+        ("receber_link_produto", args.links, receber_link),
+    ]
+    resultado = {"parametros": {k: v for k, v in vars(args).items() if k not in ("salvar_base", "comparar")},
+                 "fases": {}}
+    try:
+        for nome, total, gerar in fases:
+            if total <= 0:
+                continue
+            metricas = await rodar_fase(nome, total, args.concorrencia, gerar, banco_ops, api)
+            resultado["fases"][nome] = metricas
+            print(
+                f"{nome:<22} {metricas['vazao']:>9.1f} upd/s  "
+                f"p50 {metricas['p50']:>8.2f} ms  p95 {metricas['p95']:>8.2f} ms  "
+                f"p99 {metricas['p99']:>8.2f} ms  banco/upd {metricas['banco_por_update']:>5.2f}  "
+                f"api/upd {metricas['api_por_update']:>5.2f}  erros {metricas['erros']}"
+            )
+            # deixa o buffer de auditoria gravar antes da próxima fase
+            await asyncio.sleep(bv.BUFFER_AUDITORIA.intervalo * 2)
+    finally:
+        await app.stop()
+        await bv.pos_parada(app)
+        await app.shutdown()
+        await bv.pos_encerramento(app)
+        await api.parar()
+
+    resultado["banco"] = dict(banco_ops.most_common())
+    resultado["api"] = dict(api.chamadas.most_common())
+    resultado["cache"] = bv.CACHE_LINKS.estatisticas()
+    return resultado
+
+
+# ————— Linha de base —————
+def comparar(atual, base, tolerancia):
+    """Lista de regressões (texto) em relação à linha de base."""
+    regressoes = []
+    for fase, metricas in atual["fases"].items():
+        anterior = base.get("fases", {}).get(fase)
+        if anterior is None:
+            continue
+        for chave in METRICAS_COMPARADAS:
+            novo, velho = metricas[chave], anterior.get(chave)
+            if not velho:
+                continue
+            variacao = (novo - velho) / velho
+            piorou = variacao < -tolerancia if chave == "vazao" else variacao > tolerancia
+            marca = "❌" if piorou else "  "
+            print(f"{marca} {fase:<22} {chave:<17} {velho:>10} -> {novo:>10} ({variacao:+.1%})")
+            if piorou:
+                regressoes.append(f"{fase}.{chave}")
+    return regressoes
+
+
+def main(argv=None):
+    args = argumentos(argv)
+    temporario = args.banco is None
+    caminho = args.banco or os.path.join(tempfile.mkdtemp(prefix="buscavideo-bench-"), "bench.sqlite3")
+    preparar_ambiente(args, caminho)
+
+    logging.basicConfig(level=logging.WARNING)
+    import buscavideo  # noqa: F401 (configura o logging na importação)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    try:
+        resultado = asyncio.run(executar(args, caminho))
+    finally:
+        if temporario:
+            for sufixo in ("", "-wal", "-shm"):
+                if os.path.exists(caminho + sufixo):
+                    os.remove(caminho + sufixo)
+            os.rmdir(os.path.dirname(caminho))
+
+    if args.salvar_base:
+        with open(args.salvar_base, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"Linha de base salva em {args.salvar_base}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regressoes = comparar(resultado, base, args.tolerancia)
+        if regressoes:
+            print(f"Regressões: {', '.join(regressoes)}")
+            return 1
+        print("Sem regressões.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,48 @@
 import sys
+import csv
+import gzip
+import hashlib
+import hmac
+import json
+import signal
+import tempfile
 import psycopg2.extras
 import re
 import os
 import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from contextlib import aclosing, contextmanager
 from telegram import BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats
 import asyncio
 from dotenv import load_dotenv
-from telegram import BotCommand, BotCommandScopeDefault, Update, InputFile
+from banco_async import BancoAssincrono, PoolAssincrono, parametros_conexao
+from banco_sqlite import BancoSQLite
+from metricas import RegistroMetricas, RequisicaoMedida, medir_armazenamento, medir_chamada
+from replica import ReplicaVideos
+from telegram import (
+    BotCommand,
+    BotCommandScopeDefault,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    InputMediaPhoto,
+    Update,
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    BasePersistence,
+    BaseUpdateProcessor,
+    CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,
+    PersistenceInput,
     filters)
 
 load_dotenv()
@@ -57,8 +87,222 @@ def get_conn_pg():
     )
 
 
+# ————— Pool de conexões —————
+POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
+# conexões mais velhas que isso (segundos) são fechadas e reabertas
+POOL_MAX_IDADE = float(os.getenv("POSTGRES_POOL_MAX_IDADE", "1800"))
+# conexões paradas há mais que isso (segundos) passam por um SELECT 1 antes de voltar ao uso
+POOL_CHECAR_APOS = float(os.getenv("POSTGRES_POOL_CHECAR_APOS", "30"))
+
+# updates processados ao mesmo tempo (1 = um por vez, como antes)
+ATUALIZACOES_CONCORRENCIA = int(os.getenv("ATUALIZACOES_CONCORRENCIA", "16"))
+# updates aceitos esperando ou em execução; acima disso os novos são descartados
+ATUALIZACOES_FILA_MAX = int(os.getenv("ATUALIZACOES_FILA_MAX", "500"))
+# updates pendentes de um mesmo usuário antes de descartar os dele
+ATUALIZACOES_POR_USUARIO = int(os.getenv("ATUALIZACOES_POR_USUARIO", "10"))
+# o pool dos handlers acompanha a concorrência, com folga para os trabalhadores de fundo
+POOL_ASYNC_MAX = int(os.getenv("POSTGRES_POOL_ASYNC_MAX", str(max(POOL_MAX, ATUALIZACOES_CONCORRENCIA + 4))))
+
+
+class PoolEsgotado(Exception):
+    pass
+
+
+class PoolConexoes:
+    """
+    Pool de conexões Postgres compartilhado pelas funções de banco.
+    Mantém entre `minimo` e `maximo` conexões abertas, testa as que ficaram
+    muito tempo paradas e recicla as que passaram de `max_idade`.
+    """
+
+    def __init__(self, fabrica, minimo=1, maximo=10, timeout=10.0, max_idade=1800.0, checar_apos=30.0):
+        self._fabrica = fabrica
+        self.minimo = minimo
+        self.maximo = max(maximo, minimo, 1)
+        self.timeout = timeout
+        self.max_idade = max_idade
+        self.checar_apos = checar_apos
+
+        self._cond = threading.Condition()
+        self._ociosas = deque()  # (conn, criada_em, usada_em)
+        self._criada_em = {}     # id(conn) -> criada_em das conexões em uso
+        self._total = 0          # em uso + ociosas + sendo abertas
+        self._fechado = False
+
+        # estatísticas
+        self.pedidos = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.criadas = 0
+        self.recicladas = 0
+        self.descartadas = 0
+        self.timeouts = 0
+
+    def _abrir(self):
+        conn = self._fabrica()
+        with self._cond:
+            self.criadas += 1
+        return conn
+
+    def _saudavel(self, conn, criada_em, usada_em):
+        if conn.closed:
+            return False
+        agora = time.monotonic()
+        if agora - criada_em > self.max_idade:
+            with self._cond:
+                self.recicladas += 1
+            return False
+        if agora - usada_em > self.checar_apos:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self.descartadas += 1
+            self._cond.notify()
+
+    def pegar(self):
+        inicio = time.monotonic()
+        esperou = False
+        while True:
+            item = None
+            with self._cond:
+                if self._fechado:
+                    raise PoolEsgotado("Pool de conexões fechado.")
+                while not self._ociosas and self._total >= self.maximo:
+                    restante = inicio + self.timeout - time.monotonic()
+                    if restante <= 0:
+                        self.timeouts += 1
+                        raise PoolEsgotado(
+                            f"Nenhuma conexão livre após {self.timeout:.1f}s "
+                            f"({self._total}/{self.maximo} em uso)."
+                        )
+                    esperou = True
+                    self._cond.wait(restante)
+                if self._ociosas:
+                    # LIFO: reaproveita a conexão mais quente
+                    item = self._ociosas.pop()
+                else:
+                    # reserva a vaga antes de abrir, fora do lock
+                    self._total += 1
+
+            if item is None:
+                try:
+                    conn = self._abrir()
+                except BaseException:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                criada_em = time.monotonic()
+            else:
+                conn, criada_em, usada_em = item
+                if not self._saudavel(conn, criada_em, usada_em):
+                    self._descartar(conn)
+                    continue
+
+            espera = time.monotonic() - inicio
+            with self._cond:
+                self._criada_em[id(conn)] = criada_em
+                self.pedidos += 1
+                self.espera_total += espera
+                self.espera_max = max(self.espera_max, espera)
+                if esperou:
+                    self.esperas += 1
+            return conn
+
+    def devolver(self, conn, descartar=False):
+        with self._cond:
+            criada_em = self._criada_em.pop(id(conn), time.monotonic())
+
+        if not descartar and not conn.closed:
+            try:
+                # não deixa transação aberta para o próximo usuário da conexão
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+            except Exception:
+                descartar = True
+
+        if descartar or conn.closed or self._fechado:
+            self._descartar(conn)
+            return
+
+        with self._cond:
+            self._ociosas.append((conn, criada_em, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def conexao(self):
+        conn = self.pegar()
+        descartar = False
+        try:
+            yield conn
+        except Exception as e:
+            descartar = conn.closed or isinstance(e, psycopg2.OperationalError)
+            if not descartar:
+                try:
+                    conn.rollback()
+                except Exception:
+                    descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar)
+
+    def fechar(self):
+        with self._cond:
+            self._fechado = True
+            ociosas = list(self._ociosas)
+            self._ociosas.clear()
+        for conn, _, _ in ociosas:
+            self._descartar(conn)
+
+    def estatisticas(self):
+        with self._cond:
+            em_uso = len(self._criada_em)
+            return {
+                "em_uso": em_uso,
+                "ociosas": len(self._ociosas),
+                "total": self._total,
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "pedidos": self.pedidos,
+                "esperas": self.esperas,
+                "espera_media_ms": (self.espera_total / self.pedidos * 1000) if self.pedidos else 0.0,
+                "espera_max_ms": self.espera_max * 1000,
+                "criadas": self.criadas,
+                "recicladas": self.recicladas,
+                "descartadas": self.descartadas,
+                "timeouts": self.timeouts,
+            }
+
+
+POOL = PoolConexoes(
+    get_conn_pg,
+    minimo=POOL_MIN,
+    maximo=POOL_MAX,
+    timeout=POOL_TIMEOUT,
+    max_idade=POOL_MAX_IDADE,
+    checar_apos=POOL_CHECAR_APOS,
+)
+
+
  # Senha para acessar comandos avançados (só admins sabem)
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+# por quantas horas o acesso liberado pela senha vale
+ADMIN_SENHA_VALIDADE = float(os.getenv("ADMIN_SENHA_VALIDADE", "12"))
 TELEGRAM_CHAT_ID = os.getenv("CANAL_ID")
 ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "")
 if ADMIN_IDS_STR:
@@ -71,112 +315,381 @@ else:
     ADMIN_IDS = []
 
 
-def buscar_todos_do_banco(query: str, params: tuple = ()):
-    """
-    Abre conexão, executa SELECT e retorna todos os registros
-    """
-    conn = get_conn_pg()
-    try:
-        cur = conn.cursor()
-        cur.execute(query, params)
-        return cur.fetchall()
-    finally:
-        conn.close()
+# ————— Armazenamento —————
+# BANCO=postgres (padrão) ou sqlite; com sqlite o bot roda sem servidor de banco
+# e as variáveis POSTGRES_* não são usadas.
+BANCO = os.getenv("BANCO", "postgres").lower()
+SQLITE_CAMINHO = os.getenv("SQLITE_CAMINHO", os.path.join(BASE_DIR, "buscavideo.sqlite3"))
+SQLITE_LEITORES = int(os.getenv("SQLITE_LEITORES", "4"))
 
+if BANCO == "sqlite":
+    DB = BancoSQLite(SQLITE_CAMINHO, leitores=SQLITE_LEITORES, timeout=POOL_TIMEOUT)
+else:
+    # pool assíncrono usado pelos handlers (o POOL síncrono fica para as migrações)
+    DB = BancoAssincrono(PoolAssincrono(
+        parametros_conexao(),
+        minimo=POOL_MIN,
+        maximo=POOL_ASYNC_MAX,
+        timeout=POOL_TIMEOUT,
+        max_idade=POOL_MAX_IDADE,
+        checar_apos=POOL_CHECAR_APOS,
+    ))
+
+
+# ————— Métricas —————
+# Latência por handler, por operação de banco e por método da Bot API, mais o
+# tamanho das filas internas. Saem em texto do Prometheus num servidor HTTP local
+# (METRICAS_PORTA, nos dois modos) e resumidas no /metricas.
+METRICAS_ATIVAS = os.getenv("METRICAS", "1").lower() in ("1", "true", "sim")
+METRICAS_ENDERECO = os.getenv("METRICAS_ENDERECO", "127.0.0.1")
+# 0 = sem servidor HTTP; o /metricas continua funcionando
+METRICAS_PORTA = int(os.getenv("METRICAS_PORTA", "0"))
+METRICAS_CAMINHO = os.getenv("METRICAS_CAMINHO", "/metrics")
+
+METRICAS = RegistroMetricas()
+DURACAO_HANDLERS = METRICAS.histograma("handler_segundos", "Duração dos handlers.", ("handler",))
+ERROS_HANDLERS = METRICAS.contador("handler_erros_total", "Handlers que levantaram exceção.", ("handler",))
+if METRICAS_ATIVAS:
+    medir_armazenamento(DB, METRICAS)
+
+
+# ————— Registro de admins —————
+# ADMIN_IDS (do .env) são fixos; os da tabela admins podem ter validade e mudam em
+# tempo de execução. Cada instância confere a versão da tabela a cada
+# ADMINS_INTERVALO segundos e só relê a lista quando ela mudou.
+ADMINS_INTERVALO = float(os.getenv("ADMINS_INTERVALO", "10"))
+
+
+class RegistroAdmins:
+    def __init__(self, banco, fixos, intervalo=10.0):
+        self.banco = banco
+        self.fixos = set(fixos)
+        self.intervalo = intervalo
+        # user_id -> expires_at (None = sem validade)
+        self._dinamicos = {}
+        self._versao = None
+        self._tarefa = None
+
+    def eh_admin(self, user_id):
+        if user_id in self.fixos:
+            return True
+        expira = self._dinamicos.get(user_id, AUSENTE)
+        if expira is AUSENTE:
+            return False
+        return expira is None or expira > datetime.now()
+
+    def listar(self):
+        """(user_id, expires_at, fixo) de todos os admins válidos."""
+        agora = datetime.now()
+        itens = [(uid, None, True) for uid in self.fixos]
+        itens += [
+            (uid, expira, False) for uid, expira in self._dinamicos.items()
+            if uid not in self.fixos and (expira is None or expira > agora)
+        ]
+        return sorted(itens)
 
-def buscar_um_do_banco(query: str, params: tuple = ()):
-    conn = get_conn_pg()
-    try:
-        cur = conn.cursor()
-        cur.execute(query, params)
-        return cur.fetchone()
-    finally:
-        conn.close()
+    async def carregar(self):
+        dados = await self.banco.carregar_admins()
+        self._dinamicos = dados["admins"]
+        self._versao = dados["versao"]
+
+    async def sincronizar(self):
+        if await self.banco.versao_admins() != self._versao:
+            await self.carregar()
+
+    async def adicionar(self, user_id, expira_em=None):
+        await self.banco.inserir_admin(user_id, expira_em)
+        self._dinamicos[user_id] = expira_em
+
+    async def remover(self, user_id):
+        removido = await self.banco.remover_admin(user_id)
+        self._dinamicos.pop(user_id, None)
+        return removido
+
+    def iniciar(self):
+        self._tarefa = asyncio.create_task(self._laco(), name="registro-admins")
+
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+
+    async def _laco(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.sincronizar()
+            except Exception as e:
+                logger.warning(f"Erro ao sincronizar admins: {e}")
+
+
+REGISTRO_ADMINS = RegistroAdmins(DB, ADMIN_IDS, ADMINS_INTERVALO)
+
+
+def eh_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # admin cadastrado (fixo ou da tabela, se ainda válido) ou quem entrou com a senha
+    user = update.effective_user
+    if user is not None and REGISTRO_ADMINS.eh_admin(user.id):
+        return True
+    return context.user_data.get("admin_ate", 0) > time.time()
 
 
 # Estados de conversa
-WAITING_FOR_ID, AGUARDANDO_SENHA, WAITING_FOR_NOME_PRODUTO, WAITING_FOR_ID_PRODUTO, WAITING_FOR_LINK_PRODUTO, WAITING_FOR_QUEM = range(1, 7)
+WAITING_FOR_ID, AGUARDANDO_SENHA, WAITING_FOR_NOME_PRODUTO, WAITING_FOR_ID_PRODUTO, WAITING_FOR_LINK_PRODUTO, WAITING_FOR_QUEM, WAITING_FOR_ARQUIVO_IMPORTACAO = range(1, 8)
 
 ADMIN_MENU = (
     "🔧 *Menu Admin* 🔧\n\n"
     "/adicionar – Adicionar produtos\n"
+    "/importar – Importar produtos em lote (CSV/TSV)\n"
     "/fila – Listar pedidos pendentes\n"
+    "/demanda – IDs pendentes mais pedidos primeiro\n"
+    "/proximo – Próximo ID a cadastrar\n"
     "/historico – Ver todos os pedidos\n"
     "/concluidos – Ver apenas pedidos concluídos\n"
     "/rejeitados – Ver apenas pedidos rejeitados\n"
     "/consultar\\_pedido – Ver quem pediu o ID\n"
     "/total\\_pedidos – Ver total de pedidos no banco\n"
+    "/exportar – Exportar pedidos em CSV ou JSONL\n"
+    "/estatisticas – Totais, backlog e IDs mais pedidos\n"
+    "/pool – Ver estatísticas do pool de conexões\n"
+    "/cache – Ver estatísticas do cache de links\n"
+    "/metricas – Latências de handlers, banco e Bot API\n"
+    "/admins – Listar admins\n"
+    "/addadmin – Adicionar admin (com validade opcional)\n"
+    "/rmadmin – Remover admin\n"
 )
 
 # Regex para validar ID
 ID_PATTERN = re.compile(r'^[A-Za-z]{3}-[A-Za-z]{3}-[A-Za-z]{3}$')
 
+# ————— Cache de links —————
+CACHE_LINKS_MAX = int(os.getenv("CACHE_LINKS_MAX", "5000"))
+CACHE_LINKS_TTL = float(os.getenv("CACHE_LINKS_TTL", "600"))
+# "ainda sem link" expira rápido para não atrasar quem pede logo depois do cadastro
+CACHE_LINKS_TTL_NEGATIVO = float(os.getenv("CACHE_LINKS_TTL_NEGATIVO", "30"))
+
+# marcador para "não está no cache" (None é um resultado válido: ID sem link)
+AUSENTE = object()
+
+
+class CacheLinks:
+    """
+    Cache LRU com TTL para ID → link. Guarda também resultados negativos
+    (ID conhecido mas sem link) com um TTL menor.
+    """
+
+    def __init__(self, maximo=5000, ttl=600.0, ttl_negativo=30.0):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self._itens = OrderedDict()  # vid -> (link | None, expira_em)
+
+        self.hits = 0
+        self.hits_negativos = 0
+        self.misses = 0
+        self.expirados = 0
+        self.despejados = 0
+        self.invalidacoes = 0
+
+    def obter(self, vid):
+        item = self._itens.get(vid)
+        if item is None:
+            self.misses += 1
+            return AUSENTE
+
+        link, expira_em = item
+        if expira_em <= time.monotonic():
+            del self._itens[vid]
+            self.expirados += 1
+            self.misses += 1
+            return AUSENTE
+
+        self._itens.move_to_end(vid)
+        if link is None:
+            self.hits_negativos += 1
+        else:
+            self.hits += 1
+        return link
+
+    def guardar(self, vid, link):
+        if self.maximo <= 0:
+            return
+        ttl = self.ttl if link is not None else self.ttl_negativo
+        self._itens[vid] = (link, time.monotonic() + ttl)
+        self._itens.move_to_end(vid)
+        while len(self._itens) > self.maximo:
+            self._itens.popitem(last=False)
+            self.despejados += 1
+
+    def invalidar(self, vid):
+        if self._itens.pop(vid, None) is not None:
+            self.invalidacoes += 1
+
+    def estatisticas(self):
+        consultas = self.hits + self.hits_negativos + self.misses
+        return {
+            "itens": len(self._itens),
+            "maximo": self.maximo,
+            "hits": self.hits,
+            "hits_negativos": self.hits_negativos,
+            "misses": self.misses,
+            "taxa_acerto": ((self.hits + self.hits_negativos) / consultas) if consultas else 0.0,
+            "expirados": self.expirados,
+            "despejados": self.despejados,
+            "invalidacoes": self.invalidacoes,
+        }
+
+
+CACHE_LINKS = CacheLinks(CACHE_LINKS_MAX, CACHE_LINKS_TTL, CACHE_LINKS_TTL_NEGATIVO)
+
+# ————— Réplica local de videos —————
+# REPLICA_VIDEOS=1 mantém uma cópia de id -> link num arquivo local, atualizada
+# pela coluna `versao`; as buscas consultam cache -> réplica -> banco.
+REPLICA_ATIVA = os.getenv("REPLICA_VIDEOS", "0").lower() in ("1", "true", "sim")
+REPLICA_CAMINHO = os.getenv("REPLICA_CAMINHO", os.path.join(BASE_DIR, "replica_videos.sqlite3"))
+REPLICA_INTERVALO = float(os.getenv("REPLICA_INTERVALO", "5"))
+REPLICA_RESSINCRONIZAR = float(os.getenv("REPLICA_RESSINCRONIZAR", "3600"))
+
+REPLICA = (
+    ReplicaVideos(DB, REPLICA_CAMINHO, intervalo=REPLICA_INTERVALO, ressincronizar=REPLICA_RESSINCRONIZAR)
+    if REPLICA_ATIVA else None
+)
+
+# ————— Buffer de auditoria —————
+# Pedidos "encontrado" são só registro histórico: vão para um buffer gravado em
+# lote, para a resposta ao usuário não esperar por um INSERT.
+AUDITORIA_LOTE = int(os.getenv("AUDITORIA_LOTE", "200"))
+AUDITORIA_INTERVALO_MS = int(os.getenv("AUDITORIA_INTERVALO_MS", "500"))
+AUDITORIA_CAPACIDADE = int(os.getenv("AUDITORIA_CAPACIDADE", "10000"))
+# quanto um handler espera por espaço no buffer cheio antes de descartar a linha
+AUDITORIA_ESPERA_MAX = float(os.getenv("AUDITORIA_ESPERA_MAX", "1.0"))
+
+
+class BufferAuditoria:
+    def __init__(self, banco, lote=200, intervalo_ms=500, capacidade=10000, espera_max=1.0):
+        self.banco = banco
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        self.capacidade = capacidade
+        self.espera_max = espera_max
+        self._fila = None
+        self._tarefa = None
+        self._parando = False
+
+        self.gravadas = 0
+        self.lotes = 0
+        self.descartadas = 0
+        self.esperas = 0
+
+    def iniciar(self):
+        self._fila = asyncio.Queue(maxsize=self.capacidade)
+        self._parando = False
+        self._tarefa = asyncio.create_task(self._descarregar(), name="buffer-auditoria")
+
+    async def adicionar(self, usuario_id, username, first_name, video_id, status="encontrado"):
+        linha = (usuario_id, username, first_name, video_id, status, datetime.now(timezone.utc))
+        try:
+            self._fila.put_nowait(linha)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        # buffer cheio: segura quem está gravando até o descarregador abrir espaço
+        self.esperas += 1
+        try:
+            await asyncio.wait_for(self._fila.put(linha), self.espera_max)
+        except asyncio.TimeoutError:
+            self.descartadas += 1
+            logger.warning("Buffer de auditoria cheio; registro descartado.")
+
+    async def _juntar_lote(self):
+        lote = []
+        prazo = time.monotonic() + self.intervalo
+        while len(lote) < self.lote:
+            try:
+                lote.append(self._fila.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            restante = prazo - time.monotonic()
+            if restante <= 0 or self._parando:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._fila.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _descarregar(self):
+        while not (self._parando and self._fila.empty()):
+            lote = await self._juntar_lote()
+            if not lote:
+                continue
+            try:
+                await self.banco.registrar_pedidos_lote(lote)
+                self.gravadas += len(lote)
+                self.lotes += 1
+            except Exception:
+                logger.exception(f"Erro ao gravar {len(lote)} registro(s) de auditoria")
+                if self._parando:
+                    self.descartadas += len(lote)
+                    continue
+                # devolve o que couber para a próxima tentativa
+                for linha in lote:
+                    try:
+                        self._fila.put_nowait(linha)
+                    except asyncio.QueueFull:
+                        self.descartadas += 1
+                await asyncio.sleep(self.intervalo)
+
+    async def parar(self):
+        """Grava o que ainda estiver no buffer e encerra o descarregador."""
+        if self._tarefa is None:
+            return
+        self._parando = True
+        await self._tarefa
+        self._tarefa = None
+
+    def estatisticas(self):
+        return {
+            "pendentes": self._fila.qsize() if self._fila is not None else 0,
+            "capacidade": self.capacidade,
+            "gravadas": self.gravadas,
+            "lotes": self.lotes,
+            "descartadas": self.descartadas,
+            "esperas": self.esperas,
+        }
+
+
+BUFFER_AUDITORIA = BufferAuditoria(
+    DB,
+    lote=AUDITORIA_LOTE,
+    intervalo_ms=AUDITORIA_INTERVALO_MS,
+    capacidade=AUDITORIA_CAPACIDADE,
+    espera_max=AUDITORIA_ESPERA_MAX,
+)
+
 # ————— Funções de banco —————
 
-def inserir_video(vid, link=None):
-    with get_conn_pg() as conn:  # usa o 'with' para a conexão
-        with conn.cursor() as cur:  # usa o 'with' para o cursor
-            if link is not None:
-                # insere ou atualiza o link se já existir id igual
-                cur.execute(
-                    """
-                    INSERT INTO videos (id, link)
-                    VALUES (%s, %s)
-                    ON CONFLICT (id) DO UPDATE
-                      SET link = EXCLUDED.link
-                    """,
-                    (vid, link)
-                )
-            else:
-                cur.execute(# insere só o id se link for None (não substitui nada se já existir)
-                    """
-                    INSERT INTO videos (id)
-                    VALUES (%s)
-                    ON CONFLICT (id) DO NOTHING
-                    """,
-                    (vid,)
-                )
-        conn.commit()  # commit continua necessário
+async def inserir_video(vid, link=None):
+    try:
+        await DB.upsert_video(vid, link)
+    except Exception:
+        CACHE_LINKS.invalidar(vid)
+        raise
+    if link is not None:
+        # o cache (e a réplica desta instância) passam a responder o link novo imediatamente
+        CACHE_LINKS.guardar(vid, link)
+        if REPLICA is not None:
+            REPLICA.aplicar(vid, link)
 
 async def executar_db(fn, *args):
     try:
-        return await asyncio.to_thread(fn, *args)
+        return await fn(*args)
     except Exception:
-        logger.exception("Erro na operação de banco em thread")
+        logger.exception("Erro na operação de banco")
         return None
 
-def buscar_link_por_id(vid):
-    with get_conn_pg() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT link FROM videos WHERE id=%s", (vid,))
-            row = cur.fetchone()
-            return row["link"] if row else None
-
-
-def salvar_pedido_pendente(usuario_id, username, first_name, video_id, status="pendente"):
-    """
-       Grava na tabela pending_requests:
-         - usuario_id: int
-         - username: str ("" se não tiver)
-         - first_name: str (nome legível)
-         - video_id: str
-         - status: 'pendente' | 'encontrado' | etc.
-       """
-    try:
-        with get_conn_pg() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO pending_requests
-                      (user_id, username, first_name, video_id, status)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (usuario_id, username, first_name, video_id, status)
-                )
-            conn.commit()
-    except Exception as e:
-        logger.error(f"Erro ao salvar pedido pendente: {e}")
-
 # Mensagem de Mural de Entrada
 async def setup_bot_description(app):
     # descrição curta (topo da conversa)
@@ -206,7 +719,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def iniciar_adicionar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # apenas admins podem adicionar
-    if not context.user_data.get("is_admin"):
+    if not eh_admin(update, context):
         await update.message.reply_text("❌ Você não tem permissão para usar /adicionar.")
         return ConversationHandler.END
 
@@ -238,56 +751,738 @@ async def receber_link_produto(update: Update, context: ContextTypes.DEFAULT_TYP
     # Salva no banco de dados
     await executar_db(inserir_video, vid, link)
 
-    # Agora, buscamos usuários e atualizamos status com uma única conexão
-    with get_conn_pg() as conn:
-        with conn.cursor() as cur:
-            # Buscar usuários com pedidos pendentes para esse vídeo
-            cur.execute(
-                "SELECT user_id FROM pending_requests WHERE video_id = %s AND status = 'pendente'",
-                (vid,)
-            )
-            usuarios = cur.fetchall()
+    # Coloca uma notificação na caixa de saída para cada pedido pendente;
+    # os trabalhadores da CAIXA_SAIDA fazem o envio e concluem os pedidos
+    ids = await executar_db(DB.enfileirar_notificacoes, [vid])
+    # só o rascunho do cadastro; admin_ate continua valendo
+    context.user_data.pop("nome_produto", None)
+    context.user_data.pop("id_produto", None)
 
-        for row in usuarios:
-            user_id = row["user_id"]
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📦 Seu pedido para o ID `{vid}` foi concluído!\n🔗 {link}",
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                logger.error(f"Erro ao enviar mensagem para {user_id}: {e}")
+    if ids is None:
+        await update.message.reply_text(
+            "⚠️ Produto salvo, mas não consegui enfileirar as notificações. Cadastre o link de novo."
+        )
+        return ConversationHandler.END
+    if not ids:
+        await update.message.reply_text("✅ Produto adicionado com sucesso! Ninguém estava aguardando esse ID.")
+        return ConversationHandler.END
+
+    CAIXA_SAIDA.acordar()
+    progresso = await update.message.reply_text(
+        f"✅ Produto adicionado com sucesso! Notificando {len(ids)} usuário(s)..."
+    )
+    # o acompanhamento roda em segundo plano para não prender a conversa do admin
+    context.application.create_task(acompanhar_notificacoes(progresso, f"do ID {vid}", ids))
+    return ConversationHandler.END
+
+
+# ————— Importação em lote —————
+IMPORTAR_LOTE = int(os.getenv("IMPORTAR_LOTE", "500"))
+# quantos erros de linha aparecem no resumo para o admin
+IMPORTAR_MAX_ERROS = 10
+
+
+def ler_planilha_importacao(conteudo: str, nome_arquivo: str = ""):
+    """
+    Lê linhas nome,id,link (CSV ou TSV, cabeçalho opcional). Retorna
+    ({id: link}, [erros]); se o mesmo ID aparece mais de uma vez, vale o último.
+    """
+    primeira_linha = conteudo.split("\n", 1)[0]
+    if nome_arquivo.lower().endswith(".tsv") or "\t" in primeira_linha:
+        delimitador = "\t"
+    elif ";" in primeira_linha and "," not in primeira_linha:
+        delimitador = ";"
+    else:
+        delimitador = ","
+
+    itens, erros = {}, []
+    for n, linha in enumerate(csv.reader(conteudo.splitlines(), delimiter=delimitador), 1):
+        if not any(campo.strip() for campo in linha):
+            continue
+        if len(linha) != 3:
+            erros.append(f"linha {n}: esperado nome, id e link")
+            continue
+        _, vid, link = (campo.strip() for campo in linha)
+        vid = vid.upper()
+        if n == 1 and vid == "ID":
+            continue  # cabeçalho
+        if not ID_PATTERN.match(vid):
+            erros.append(f"linha {n}: ID inválido ({vid})")
+            continue
+        if not link.lower().startswith(("http://", "https://")):
+            erros.append(f"linha {n}: link inválido")
+            continue
+        itens[vid] = link
+    return itens, erros
+
+
+async def iniciar_importar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão para usar /importar.")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "📎 Envie um arquivo CSV ou TSV com as colunas nome, id e link (uma linha por produto)."
+    )
+    return WAITING_FOR_ARQUIVO_IMPORTACAO
 
-        with conn.cursor() as cur:
-            # Atualiza o status dos pedidos para "concluido"
-            cur.execute(
-                "UPDATE pending_requests SET status = 'concluido' WHERE video_id = %s AND status = 'pendente'",
-                (vid,)
-            )
-        conn.commit()
 
-    await update.message.reply_text("✅ Produto adicionado com sucesso e usuários notificados!")
-    context.user_data.clear()
+async def receber_arquivo_importacao(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    documento = update.message.document
+    try:
+        arquivo = await documento.get_file()
+        conteudo = (await arquivo.download_as_bytearray()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ O arquivo precisa estar em UTF-8. Envie novamente.")
+        return WAITING_FOR_ARQUIVO_IMPORTACAO
+    except Exception:
+        logger.exception("Erro ao baixar arquivo de importação")
+        await update.message.reply_text("❌ Não consegui baixar o arquivo. Envie novamente.")
+        return WAITING_FOR_ARQUIVO_IMPORTACAO
+
+    itens, erros = ler_planilha_importacao(conteudo, documento.file_name or "")
+    if not itens:
+        await update.message.reply_text("❌ Nenhuma linha válida encontrada.\n" + "\n".join(erros[:IMPORTAR_MAX_ERROS]))
+        return ConversationHandler.END
+
+    await update.message.reply_text(f"⏳ Importando {len(itens)} produto(s)...")
+    lista = list(itens.items())
+    novos = atualizados = 0
+    ids_notificacoes = []
+    for i in range(0, len(lista), IMPORTAR_LOTE):
+        lote = lista[i:i + IMPORTAR_LOTE]
+        try:
+            n, a, ids = await DB.importar_videos(lote)
+        except Exception:
+            logger.exception("Erro ao importar lote de produtos")
+            erros.append(f"lote {i // IMPORTAR_LOTE + 1}: erro no banco ({len(lote)} produto(s) não importados)")
+            continue
+        novos += n
+        atualizados += a
+        ids_notificacoes += ids
+        # como no inserir_video: cache e réplica desta instância já respondem o link novo
+        for vid, link in lote:
+            CACHE_LINKS.guardar(vid, link)
+            if REPLICA is not None:
+                REPLICA.aplicar(vid, link)
+
+    resumo = [
+        "📥 Importação concluída",
+        f"🆕 Novos: {novos}",
+        f"♻️ Atualizados: {atualizados}",
+        f"📤 Notificações enfileiradas: {len(ids_notificacoes)}",
+    ]
+    if erros:
+        resumo.append(f"⚠️ Problemas: {len(erros)}")
+        resumo += [f"• {e}" for e in erros[:IMPORTAR_MAX_ERROS]]
+    # sem Markdown: as mensagens de erro trazem trechos do arquivo
+    await update.message.reply_text("\n".join(resumo))
+
+    if ids_notificacoes:
+        # todas as notificações da importação saem numa única rodada da caixa de saída
+        CAIXA_SAIDA.acordar()
+        progresso = await update.message.reply_text(f"📤 Notificando {len(ids_notificacoes)} usuário(s)...")
+        context.application.create_task(acompanhar_notificacoes(progresso, "da importação", ids_notificacoes))
     return ConversationHandler.END
 
 
 # ————— Funções de notificação —————
-async def notificar_canal_admin(context: ContextTypes.DEFAULT_TYPE, user, vid, message):
-    try:
-        chat_id_str = str(message.chat.id)
-        msg_id_str = str(message.message_id)
-        internal_chat_id = chat_id_str[4:] if chat_id_str.startswith("-100") else None
-        link_mensagem = f"https://t.me/c/{internal_chat_id}/{msg_id_str}" if internal_chat_id else "🔒 (Chat privado)"
+# Telegram aceita ~30 mensagens/s no total e ~1/s por chat
+NOTIF_CONCORRENCIA = int(os.getenv("NOTIF_CONCORRENCIA", "20"))
+NOTIF_TAXA_GLOBAL = float(os.getenv("NOTIF_TAXA_GLOBAL", "25"))
+NOTIF_INTERVALO_CHAT = float(os.getenv("NOTIF_INTERVALO_CHAT", "1.0"))
+NOTIF_TENTATIVAS = int(os.getenv("NOTIF_TENTATIVAS", "5"))
+NOTIF_PROGRESSO_A_CADA = float(os.getenv("NOTIF_PROGRESSO_A_CADA", "3"))
+# depois disso o acompanhamento desiste (banco fora do ar, envios travados...)
+NOTIF_PROGRESSO_MAX = float(os.getenv("NOTIF_PROGRESSO_MAX", "3600"))
+
+
+class LimitadorTaxa:
+    """Token bucket assíncrono: no máximo `taxa` liberações por segundo."""
+
+    def __init__(self, taxa, rajada=None):
+        self.taxa = taxa
+        self.rajada = rajada if rajada is not None else max(taxa, 1.0)
+        self._fichas = self.rajada
+        self._atualizado = time.monotonic()
+
+    async def aguardar(self):
+        while True:
+            agora = time.monotonic()
+            self._fichas = min(self.rajada, self._fichas + (agora - self._atualizado) * self.taxa)
+            self._atualizado = agora
+            if self._fichas >= 1:
+                self._fichas -= 1
+                return
+            await asyncio.sleep((1 - self._fichas) / self.taxa)
+
+    def tentar(self):
+        """Versão sem espera: consome uma ficha se houver e diz se conseguiu."""
+        agora = time.monotonic()
+        self._fichas = min(self.rajada, self._fichas + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+        if self._fichas >= 1:
+            self._fichas -= 1
+            return True
+        return False
+
+
+class LimitadorPorUsuario:
+    """
+    Um token bucket por usuário, sem espera: `permitir` responde na hora.
+    Entradas ociosas já teriam o balde cheio, então são descartadas sem mudar o
+    comportamento; `maximo` limita a memória no pior caso (descarta a mais antiga).
+    `taxa` <= 0 desliga o limite por usuário (o global, se houver, continua valendo).
+    """
+
+    def __init__(self, taxa, rajada, maximo=100_000, limitador_global=None):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.maximo = maximo
+        self.limitador_global = limitador_global
+        self._ocioso = rajada / taxa if taxa > 0 else 0.0
+        # user_id -> [fichas, atualizado, avisado], do menos para o mais recente
+        self._baldes = OrderedDict()
+
+        self.liberados = 0
+        self.barrados = 0
+        self.barrados_global = 0
+
+    def _despejar(self, agora):
+        while self._baldes:
+            chave, balde = next(iter(self._baldes.items()))
+            if len(self._baldes) <= self.maximo and agora - balde[1] < self._ocioso:
+                break
+            del self._baldes[chave]
+
+    def permitir(self, chave):
+        """
+        Retorna (liberado, avisar). `avisar` só é verdadeiro na primeira recusa
+        de uma sequência, para não responder a cada mensagem de quem insiste.
+        """
+        if self.taxa <= 0:
+            # sem balde não há como avisar só uma vez; sob carga global, recusa calado
+            if self.limitador_global is not None and not self.limitador_global.tentar():
+                self.barrados_global += 1
+                return False, False
+            self.liberados += 1
+            return True, False
+
+        agora = time.monotonic()
+        balde = self._baldes.pop(chave, None)
+        if balde is None:
+            balde = [self.rajada, agora, False]
+        else:
+            balde[0] = min(self.rajada, balde[0] + (agora - balde[1]) * self.taxa)
+            balde[1] = agora
+        self._baldes[chave] = balde
+        self._despejar(agora)
+
+        if balde[0] < 1:
+            self.barrados += 1
+            avisar = not balde[2]
+            balde[2] = True
+            return False, avisar
+
+        if self.limitador_global is not None and not self.limitador_global.tentar():
+            self.barrados_global += 1
+            avisar = not balde[2]
+            balde[2] = True
+            return False, avisar
+
+        balde[0] -= 1
+        balde[2] = False
+        self.liberados += 1
+        return True, False
+
+    def estatisticas(self):
+        return {
+            "usuarios": len(self._baldes),
+            "liberados": self.liberados,
+            "barrados": self.barrados,
+            "barrados_global": self.barrados_global,
+        }
+
+
+def segundos_retry_after(erro: RetryAfter) -> float:
+    espera = erro.retry_after
+    if isinstance(espera, timedelta):
+        return espera.total_seconds()
+    return float(espera)
+
+
+# ————— Limite de pedidos por usuário —————
+# Cada usuário pode mandar PEDIDOS_RAJADA IDs de uma vez e depois PEDIDOS_TAXA por
+# segundo (0 = sem limite por usuário); PEDIDOS_TAXA_GLOBAL (0 = desligado)
+# protege o banco do conjunto todo.
+PEDIDOS_TAXA = float(os.getenv("PEDIDOS_TAXA", "0.2"))
+PEDIDOS_RAJADA = float(os.getenv("PEDIDOS_RAJADA", "5"))
+PEDIDOS_TAXA_GLOBAL = float(os.getenv("PEDIDOS_TAXA_GLOBAL", "0"))
+PEDIDOS_RAJADA_GLOBAL = float(os.getenv("PEDIDOS_RAJADA_GLOBAL", "50"))
+PEDIDOS_MAX_USUARIOS = int(os.getenv("PEDIDOS_MAX_USUARIOS", "100000"))
+
+LIMITE_PEDIDOS = LimitadorPorUsuario(
+    PEDIDOS_TAXA,
+    PEDIDOS_RAJADA,
+    maximo=PEDIDOS_MAX_USUARIOS,
+    limitador_global=(
+        LimitadorTaxa(PEDIDOS_TAXA_GLOBAL, PEDIDOS_RAJADA_GLOBAL) if PEDIDOS_TAXA_GLOBAL > 0 else None
+    ),
+)
 
-        texto = f"📨 Novo pedido de ID\n"
-        texto += f"👤 Usuário: {user.username or user.first_name or 'Usuário desconhecido'} (ID: {user.id})\n"
-        texto += f"🆔 Pedido: {vid}\n"
-        texto += f"🔗 [Ver mensagem]({link_mensagem})\n"
 
-        await context.bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=texto, parse_mode="Markdown")
-    except Exception as e:
-        logger.error(f"Erro ao enviar notificação para o canal: {e}")
+class DespachanteNotificacoes:
+    """
+    Envia mensagens com concorrência limitada, respeitando o limite global do
+    bot e o intervalo mínimo por chat. RetryAfter pausa todos os envios pelo
+    tempo pedido pelo Telegram; timeouts e erros de rede tentam de novo com
+    backoff exponencial. Bloqueio do bot e chat inexistente não são repetidos.
+    """
+
+    def __init__(self, concorrencia=20, taxa_global=25.0, intervalo_chat=1.0, tentativas=5):
+        self.concorrencia = concorrencia
+        self.intervalo_chat = intervalo_chat
+        self.tentativas = tentativas
+        self._global = LimitadorTaxa(taxa_global)
+        self._sem = None
+        self._proximo_por_chat = {}
+        self._pausado_ate = 0.0
+
+        self.enviados = 0
+        self.falhas = 0
+        self.repeticoes = 0
+        self.retry_after = 0
+
+    def _semaforo(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concorrencia)
+        return self._sem
+
+    async def _aguardar_vez(self, chat_id):
+        while True:
+            agora = time.monotonic()
+            espera = max(self._pausado_ate, self._proximo_por_chat.get(chat_id, 0.0)) - agora
+            if espera <= 0:
+                break
+            await asyncio.sleep(espera)
+        self._proximo_por_chat[chat_id] = agora + self.intervalo_chat
+        if len(self._proximo_por_chat) > 10000:
+            # descarta chats cujo intervalo já passou
+            self._proximo_por_chat = {
+                c: t for c, t in self._proximo_por_chat.items() if t > agora
+            }
+        await self._global.aguardar()
+
+    async def tentar_enviar(self, bot, chat_id, texto, **kwargs):
+        """
+        Retorna (entregue, definitiva, erro). `definitiva` indica que não
+        adianta tentar de novo (usuário bloqueou o bot, chat inexistente).
+        """
+        erro = None
+        async with self._semaforo():
+            for tentativa in range(1, self.tentativas + 1):
+                await self._aguardar_vez(chat_id)
+                try:
+                    await bot.send_message(chat_id=chat_id, text=texto, **kwargs)
+                    self.enviados += 1
+                    return True, False, None
+                except RetryAfter as e:
+                    erro = str(e)
+                    self.retry_after += 1
+                    self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos_retry_after(e))
+                except (Forbidden, BadRequest) as e:
+                    logger.warning(f"Mensagem para {chat_id} descartada: {e}")
+                    self.falhas += 1
+                    return False, True, str(e)
+                except NetworkError as e:
+                    # inclui TimedOut
+                    erro = str(e)
+                    logger.warning(f"Falha de rede ao enviar para {chat_id} (tentativa {tentativa}): {e}")
+                    await asyncio.sleep(min(30.0, 0.5 * 2 ** (tentativa - 1)))
+                self.repeticoes += 1
+            self.falhas += 1
+            return False, False, erro
+
+    async def enviar(self, bot, chat_id, texto, **kwargs):
+        """Retorna True se a mensagem foi entregue."""
+        entregue, _, _ = await self.tentar_enviar(bot, chat_id, texto, **kwargs)
+        return entregue
+
+    def estatisticas(self):
+        return {
+            "enviados": self.enviados,
+            "falhas": self.falhas,
+            "repeticoes": self.repeticoes,
+            "retry_after": self.retry_after,
+            "pausado_por": max(0.0, self._pausado_ate - time.monotonic()),
+        }
+
+
+DESPACHANTE = DespachanteNotificacoes(
+    NOTIF_CONCORRENCIA, NOTIF_TAXA_GLOBAL, NOTIF_INTERVALO_CHAT, NOTIF_TENTATIVAS
+)
+
+
+# ————— Caixa de saída de notificações —————
+# Cada pedido concluído vira uma linha em notification_outbox; qualquer número
+# de trabalhadores (tarefas ou processos) reivindica linhas com SKIP LOCKED,
+# envia e só então marca o pedido como 'concluido'.
+OUTBOX_TRABALHADORES = int(os.getenv("OUTBOX_TRABALHADORES", "4"))
+OUTBOX_LOTE = int(os.getenv("OUTBOX_LOTE", "20"))
+OUTBOX_INTERVALO = float(os.getenv("OUTBOX_INTERVALO", "5"))
+OUTBOX_TRAVA_EXPIRA = int(os.getenv("OUTBOX_TRAVA_EXPIRA", "300"))
+OUTBOX_MAX_TENTATIVAS = int(os.getenv("OUTBOX_MAX_TENTATIVAS", "8"))
+
+
+def texto_pedido_concluido(vid, link):
+    return f"📦 Seu pedido para o ID `{vid}` foi concluído!\n🔗 {link}"
+
+
+class CaixaSaidaNotificacoes:
+    def __init__(self, banco, despachante, trabalhadores=4, lote=20, intervalo=5.0,
+                 trava_expira=300, max_tentativas=8):
+        self.banco = banco
+        self.despachante = despachante
+        self.trabalhadores = trabalhadores
+        self.lote = lote
+        self.intervalo = intervalo
+        self.trava_expira = trava_expira
+        self.max_tentativas = max_tentativas
+        self._tarefas = []
+        self._acordar = None
+        self._parando = False
+        # notificações reivindicadas e ainda em envio
+        self.em_envio = 0
+
+    def iniciar(self, bot):
+        self._acordar = asyncio.Event()
+        self._parando = False
+        self._tarefas = [
+            asyncio.create_task(self._trabalhar(bot, n), name=f"outbox-{n}")
+            for n in range(self.trabalhadores)
+        ]
+
+    def acordar(self):
+        if self._acordar is not None:
+            self._acordar.set()
+
+    async def parar(self, timeout=10.0):
+        self._parando = True
+        self.acordar()
+        if not self._tarefas:
+            return
+        _, pendentes = await asyncio.wait(self._tarefas, timeout=timeout)
+        # o que ficar em 'enviando' volta para a fila quando a trava expirar
+        for tarefa in pendentes:
+            tarefa.cancel()
+        self._tarefas = []
+
+    async def _trabalhar(self, bot, n):
+        while not self._parando:
+            try:
+                lote = await self.banco.reivindicar_notificacoes(self.lote, self.trava_expira)
+            except Exception:
+                logger.exception(f"Trabalhador {n} da caixa de saída falhou ao buscar notificações")
+                lote = []
+
+            if not lote:
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), self.intervalo)
+                except asyncio.TimeoutError:
+                    pass
+                self._acordar.clear()
+                continue
+
+            self.em_envio += len(lote)
+            try:
+                await asyncio.gather(*(self._entregar(bot, row) for row in lote))
+            finally:
+                self.em_envio -= len(lote)
+
+    async def _entregar(self, bot, row):
+        entregue, definitiva, erro = await self.despachante.tentar_enviar(
+            bot,
+            row["chat_id"],
+            texto_pedido_concluido(row["video_id"], row["link"]),
+            parse_mode="Markdown"
+        )
+        try:
+            if entregue:
+                await self.banco.marcar_notificacao_entregue(row["id"])
+            else:
+                atraso = min(3600, 30 * 2 ** (row["attempts"] - 1))
+                await self.banco.marcar_notificacao_falha(
+                    row["id"], erro, definitiva, self.max_tentativas, atraso
+                )
+        except Exception:
+            logger.exception(f"Erro ao registrar o resultado da notificação {row['id']}")
+
+
+CAIXA_SAIDA = CaixaSaidaNotificacoes(
+    DB,
+    DESPACHANTE,
+    trabalhadores=OUTBOX_TRABALHADORES,
+    lote=OUTBOX_LOTE,
+    intervalo=OUTBOX_INTERVALO,
+    trava_expira=OUTBOX_TRAVA_EXPIRA,
+    max_tentativas=OUTBOX_MAX_TENTATIVAS,
+)
+
+
+async def acompanhar_notificacoes(mensagem_progresso, rotulo, ids):
+    """Edita a mensagem do admin com o andamento das notificações até terminarem."""
+    total = len(ids)
+    ultimo = None
+    prazo = time.monotonic() + NOTIF_PROGRESSO_MAX
+    while time.monotonic() < prazo:
+        await asyncio.sleep(NOTIF_PROGRESSO_A_CADA)
+        contagem = await executar_db(DB.progresso_notificacoes, ids)
+        if contagem is None:
+            continue
+        entregues = contagem.get("entregue", 0)
+        falhas = contagem.get("falhou", 0)
+        # linhas que sumiram (pedido apagado, cascata) contam como encerradas
+        em_aberto = sum(n for status, n in contagem.items() if status not in ("entregue", "falhou"))
+
+        if em_aberto <= 0:
+            texto = f"✅ Notificação {rotulo} concluída: {entregues} enviada(s), {falhas} falha(s)."
+        else:
+            texto = f"📤 Notificação {rotulo}: {entregues + falhas}/{total} (✅ {entregues} | ❌ {falhas})"
+        if texto != ultimo:
+            try:
+                await mensagem_progresso.edit_text(texto)
+            except Exception as e:
+                logger.warning(f"Não foi possível atualizar o progresso: {e}")
+            ultimo = texto
+        if em_aberto <= 0:
+            return
+    logger.warning(f"Acompanhamento da notificação {rotulo} encerrado após {NOTIF_PROGRESSO_MAX:.0f}s.")
+
+
+# ————— Avisos no canal dos admins —————
+# "janela": uma mensagem por ID a cada CANAL_JANELA segundos, editada com a contagem
+# de quem pediu depois; "resumo": uma única mensagem periódica com todos os IDs.
+CANAL_MODO = os.getenv("CANAL_MODO", "janela").lower()
+CANAL_JANELA = float(os.getenv("CANAL_JANELA", "3600"))
+CANAL_EDITAR_A_CADA = float(os.getenv("CANAL_EDITAR_A_CADA", "15"))
+CANAL_RESUMO_INTERVALO = float(os.getenv("CANAL_RESUMO_INTERVALO", "300"))
+# limite de texto de uma mensagem do Telegram
+LIMITE_MENSAGEM = 4096
+
+
+def _link_mensagem(message):
+    chat_id_str = str(message.chat.id)
+    internal_chat_id = chat_id_str[4:] if chat_id_str.startswith("-100") else None
+    if internal_chat_id:
+        return f"🔗 [Ver mensagem](https://t.me/c/{internal_chat_id}/{message.message_id})"
+    return "🔒 (Chat privado)"
+
+
+class NotificadorCanal:
+    def __init__(self, chat_id, modo="janela", janela=3600.0, editar_a_cada=15.0, resumo_intervalo=300.0):
+        self.chat_id = chat_id
+        self.modo = modo
+        self.janela = janela
+        self.editar_a_cada = editar_a_cada
+        self.resumo_intervalo = resumo_intervalo
+        # vid -> {"texto_base", "extras", "message_id", "inicio", "sujo", "enviando"}
+        self._janelas = {}
+        # vid -> quantidade de pedidos ainda não mostrados no canal (ordem de chegada)
+        self._resumo = OrderedDict()
+        # mensagem de resumo em edição: {"contagens", "message_id", "inicio"}
+        self._resumo_atual = None
+        self._tarefa = None
+        self._bot = None
+
+        self.enviadas = 0
+        self.editadas = 0
+        self.agrupados = 0
+
+    def iniciar(self, bot):
+        self._bot = bot
+        intervalo = self.resumo_intervalo if self.modo == "resumo" else self.editar_a_cada
+        self._tarefa = asyncio.create_task(self._periodico(intervalo), name="notificador-canal")
+
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+        await self._descarregar()
+
+    async def registrar(self, bot, user, vid, message):
+        if self.modo == "resumo":
+            self._resumo[vid] = self._resumo.get(vid, 0) + 1
+            return
+
+        agora = time.monotonic()
+        item = self._janelas.get(vid)
+        if item is not None and agora - item["inicio"] < self.janela:
+            # mesmo ID dentro da janela: só soma e a edição sai no próximo ciclo
+            item["extras"] += 1
+            item["sujo"] = True
+            self.agrupados += 1
+            return
+
+        texto_base = (
+            "📨 Novo pedido de ID\n"
+            f"👤 Usuário: {user.username or user.first_name or 'Usuário desconhecido'} (ID: {user.id})\n"
+            f"🆔 Pedido: {vid}\n"
+            f"{_link_mensagem(message)}\n"
+        )
+        item = {
+            "texto_base": texto_base, "extras": 0, "message_id": None,
+            "inicio": agora, "sujo": False, "enviando": True,
+        }
+        self._janelas[vid] = item
+        try:
+            enviada = await bot.send_message(chat_id=self.chat_id, text=texto_base, parse_mode="Markdown")
+            item["message_id"] = enviada.message_id
+            self.enviadas += 1
+        except Exception as e:
+            # o aviso (e os repetidos agrupados enquanto ele saía) fica para o próximo ciclo
+            logger.error(f"Erro ao enviar notificação para o canal: {e}")
+            item["sujo"] = True
+        finally:
+            item["enviando"] = False
+
+    def _texto_janela(self, item):
+        if not item["extras"]:
+            return item["texto_base"]
+        return item["texto_base"] + f"👥 +{item['extras']} pedido(s) do mesmo ID depois deste\n"
+
+    async def _descarregar(self):
+        if self._bot is None:
+            return
+        if self.modo == "resumo":
+            await self._enviar_resumo()
+            return
+
+        agora = time.monotonic()
+        for vid, item in list(self._janelas.items()):
+            if item["enviando"]:
+                continue
+            if item["sujo"]:
+                item["sujo"] = False
+                try:
+                    if item["message_id"] is None:
+                        enviada = await self._bot.send_message(
+                            chat_id=self.chat_id, text=self._texto_janela(item), parse_mode="Markdown"
+                        )
+                        item["message_id"] = enviada.message_id
+                        self.enviadas += 1
+                    else:
+                        await self._bot.edit_message_text(
+                            chat_id=self.chat_id,
+                            message_id=item["message_id"],
+                            text=self._texto_janela(item),
+                            parse_mode="Markdown"
+                        )
+                        self.editadas += 1
+                except RetryAfter as e:
+                    item["sujo"] = True
+                    await asyncio.sleep(segundos_retry_after(e))
+                except Exception as e:
+                    # um aviso que nunca chegou ao canal é reenviado; uma edição perdida, não
+                    item["sujo"] = item["message_id"] is None
+                    logger.warning(f"Erro ao atualizar aviso do canal para {vid}: {e}")
+            if agora - item["inicio"] >= self.janela:
+                if item["message_id"] is None:
+                    logger.error(f"Aviso do canal para {vid} descartado depois de falhar até o fim da janela")
+                    del self._janelas[vid]
+                elif not item["sujo"]:
+                    del self._janelas[vid]
+
+    @staticmethod
+    def _cabecalho_resumo(quantidade):
+        return f"🗂️ Resumo de pedidos novos ({quantidade} ID(s))\n\n"
+
+    @staticmethod
+    def _linha_resumo(vid, n):
+        return f"🆔 {vid} — 👥 {n}\n"
+
+    def _texto_resumo(self, contagens):
+        linhas = "".join(self._linha_resumo(vid, n) for vid, n in contagens.items())
+        return self._cabecalho_resumo(len(contagens)) + linhas
+
+    def _devolver_resumo(self, contagens):
+        """Devolve contagens que não chegaram ao canal, à frente das que chegaram depois."""
+        for vid, n in self._resumo.items():
+            contagens[vid] = contagens.get(vid, 0) + n
+        self._resumo = contagens
+
+    async def _enviar_resumo(self):
+        if not self._resumo:
+            return
+        novos, self._resumo = self._resumo, OrderedDict()
+
+        # dentro da janela, o resumo do canal é uma mensagem só, editada a cada ciclo
+        atual = self._resumo_atual
+        if atual is not None and time.monotonic() - atual["inicio"] < self.janela:
+            contagens = OrderedDict(atual["contagens"])
+            for vid, n in novos.items():
+                contagens[vid] = contagens.get(vid, 0) + n
+            texto = self._texto_resumo(contagens)
+            if len(texto) <= LIMITE_MENSAGEM:
+                try:
+                    await self._bot.edit_message_text(
+                        chat_id=self.chat_id, message_id=atual["message_id"], text=texto
+                    )
+                    atual["contagens"] = contagens
+                    self.editadas += 1
+                    return
+                except RetryAfter as e:
+                    self._devolver_resumo(novos)
+                    await asyncio.sleep(segundos_retry_after(e))
+                    return
+                except Exception as e:
+                    logger.warning(f"Erro ao editar o resumo do canal, enviando um novo: {e}")
+        self._resumo_atual = None
+
+        # o cabeçalho nunca passa do tamanho que teria com todos os IDs
+        cabecalho = len(self._cabecalho_resumo(len(novos)))
+        blocos, bloco, tamanho = [], OrderedDict(), cabecalho
+        for vid, n in novos.items():
+            linha = len(self._linha_resumo(vid, n))
+            if bloco and tamanho + linha > LIMITE_MENSAGEM:
+                blocos.append(bloco)
+                bloco, tamanho = OrderedDict(), cabecalho
+            bloco[vid] = n
+            tamanho += linha
+        blocos.append(bloco)
+
+        for i, bloco in enumerate(blocos):
+            try:
+                enviada = await self._bot.send_message(chat_id=self.chat_id, text=self._texto_resumo(bloco))
+            except Exception as e:
+                logger.error(f"Erro ao enviar resumo para o canal: {e}")
+                restantes = OrderedDict()
+                for pendente in blocos[i:]:
+                    restantes.update(pendente)
+                self._devolver_resumo(restantes)
+                return
+            self.enviadas += 1
+            self._resumo_atual = {"contagens": bloco, "message_id": enviada.message_id, "inicio": time.monotonic()}
+
+    async def _periodico(self, intervalo):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self._descarregar()
+            except Exception:
+                logger.exception("Erro ao atualizar os avisos do canal")
+
+
+NOTIFICADOR_CANAL = NotificadorCanal(
+    TELEGRAM_CHAT_ID,
+    modo=CANAL_MODO,
+    janela=CANAL_JANELA,
+    editar_a_cada=CANAL_EDITAR_A_CADA,
+    resumo_intervalo=CANAL_RESUMO_INTERVALO,
+)
+
+
+async def notificar_canal_admin(context: ContextTypes.DEFAULT_TYPE, user, vid, message):
+    await NOTIFICADOR_CANAL.registrar(context.bot, user, vid, message)
 
 
 async def tratar_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -298,35 +1493,56 @@ async def tratar_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return WAITING_FOR_ID
 
-    # 1) Tenta buscar link existente
-    link = await executar_db(buscar_link_por_id, vid)
     user = update.effective_user
+    liberado, avisar = LIMITE_PEDIDOS.permitir(user.id)
+    if not liberado:
+        # barrado antes de qualquer acesso ao banco; avisa só uma vez por sequência
+        if avisar:
+            await update.message.reply_text(
+                "🐢 Calma! Você mandou muitos IDs seguidos. Espere um pouco e tente de novo."
+            )
+        return ConversationHandler.END
+
     # Prepara os campos de name
     telegram_id = user.id
     username = user.username or "Usuário desconhecido"
     first_name = user.first_name or "(sem nome)"
 
-    if link:
+    link = CACHE_LINKS.obter(vid)
+    if link is AUSENTE and REPLICA is not None:
+        # a réplica só sabe de links que existem; não achar lá não é cache negativo
+        link = REPLICA.obter(vid) or AUSENTE
+    if link is not AUSENTE and link is not None:
+        # link em cache/réplica: responde sem ir ao banco; o registro vai pelo buffer
         await update.message.reply_text(f"🔗 Link encontrado: {link}")
-        # agora passando também o first_name
-        await executar_db(
-            salvar_pedido_pendente,
-            telegram_id,
-            username,
-            first_name,
-            vid,
-            "encontrado"
+        await BUFFER_AUDITORIA.adicionar(telegram_id, username, first_name, vid)
+        return ConversationHandler.END
+
+    # Busca o link (ou enfileira o pedido pendente) numa ida só ao banco
+    resultado = await executar_db(
+        DB.resolver_pedido,
+        telegram_id,
+        username,
+        first_name,
+        vid,
+        link is None  # cache negativo: vai direto para o caminho de enfileirar
+    )
+    if resultado is not None:
+        CACHE_LINKS.guardar(vid, resultado["link"])
+
+    if resultado is None:
+        await update.message.reply_text(
+            "⚠️ Não consegui consultar esse ID agora. Tente novamente em instantes."
         )
-    else:
-        await executar_db(inserir_video, vid)
-        await executar_db(
-            salvar_pedido_pendente,
-            telegram_id,
-            username,
-            first_name,
-            vid,
-            "pendente"
+    elif resultado["link"]:
+        await update.message.reply_text(f"🔗 Link encontrado: {resultado['link']}")
+        await BUFFER_AUDITORIA.adicionar(telegram_id, username, first_name, vid)
+    elif resultado["repetido"]:
+        # já estava na fila para este usuário: não gera outro pedido nem outro aviso no canal
+        await update.message.reply_text(
+            "⏳ Você já pediu esse ID. Avisarei quando o link estiver disponível."
         )
+    else:
         await update.message.reply_text(
             "✅ ID adicionado à fila. Avisarei quando o link estiver disponível."
         )
@@ -336,8 +1552,8 @@ async def tratar_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def iniciar_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id in ADMIN_IDS:
-        context.user_data["is_admin"] = True
+    if REGISTRO_ADMINS.eh_admin(user_id):
+        # não grava admin_ate: o acesso acompanha o registro (remoção e validade)
         await update.message.reply_text(ADMIN_MENU, parse_mode="Markdown")
         return ConversationHandler.END
 
@@ -347,133 +1563,234 @@ async def iniciar_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def tratar_senha(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text.strip() == str(ADMIN_PASSWORD):
-        context.user_data["is_admin"] = True
+        # vale por ADMIN_SENHA_VALIDADE horas; depois a senha é pedida de novo
+        context.user_data["admin_ate"] = time.time() + ADMIN_SENHA_VALIDADE * 3600
+        context.user_data.pop("is_admin", None)
         await update.message.reply_text(ADMIN_MENU, parse_mode="Markdown")
     else:
         await update.message.reply_text("❌ Senha incorreta. Acesso negado.")
     return ConversationHandler.END
 
 
-# ————— Mostrar fila —————
-async def mostrar_fila(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    if not context.user_data.get("is_admin"):
-        await update.message.reply_text("❌ Você não tem permissão.")
-        return
+# ————— Listagens paginadas —————
+PAGINA_TAMANHO = int(os.getenv("PAGINA_TAMANHO", "10"))
 
-    rows = await asyncio.to_thread(
-        buscar_todos_do_banco,
-        "SELECT user_id, username, video_id, requested_at, status "
-        "FROM pending_requests WHERE status = 'pendente' ORDER BY requested_at ASC"
-    )
+# visão -> (status filtrado, título, mensagem quando vazio, mostra o status?)
+VISOES_PEDIDOS = {
+    "fila": ("pendente", "📋 *Pedidos pendentes:*", "📭 Nenhum pedido pendente!", True),
+    "historico": (None, "📚 *Histórico de todos os pedidos:*", "📭 Nenhum pedido encontrado!", True),
+    "concluidos": ("concluido", "✅ *Pedidos concluídos:*", "📭 Nenhum pedido concluído!", False),
+    "rejeitados": ("rejeitado", "❌ *Pedidos rejeitados:*", "📭 Nenhum pedido rejeitado!", False),
+}
 
-    if not rows:
-        await update.message.reply_text("📭 Nenhum pedido pendente!")
-        return
 
-    resposta = "📋 *Pedidos pendentes:*\n\n"
-    for i, row in enumerate(rows, 1):
-        user_id = row["user_id"]
-        username = row["username"]
-        video_id = row["video_id"]
-        requested_at = row["requested_at"]
-        status = row["status"]
-        resposta += f"*{i}.* 👤 {username} (`{user_id}`)\n"
-        resposta += f"🆔 `{video_id}` — 🕒 `{requested_at}` — *{status}*\n\n"
-    await update.message.reply_text(resposta, parse_mode="Markdown")
+def _dados_pagina(visao, sentido, row, inicio):
+    # cabe nos 64 bytes de callback_data: "pag|historico|n|2025-01-01T00:00:00.000000|123456|1011"
+    # `inicio` é o número do primeiro item da página de destino
+    return f"pag|{visao}|{sentido}|{row['requested_at'].isoformat()}|{row['id']}|{inicio}"
 
 
-# Mostrar histórico completo
-async def mostrar_historico(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get("is_admin"):
-        await update.message.reply_text("❌ Você não tem permissão.")
-        return
+def _ler_dados_pagina(dados):
+    partes = dados.split("|")
+    # botões antigos, de antes da numeração contínua, não têm o `inicio`
+    inicio = int(partes.pop()) if len(partes) == 6 else 1
+    _, visao, sentido, requested_at, row_id = partes
+    return visao, sentido == "p", (datetime.fromisoformat(requested_at), int(row_id)), inicio
 
-    # Executa a consulta em thread separada
-    rows = await asyncio.to_thread(
-        buscar_todos_do_banco,
-        "SELECT user_id, username, video_id, requested_at, status "
-        "FROM pending_requests ORDER BY requested_at ASC"
-    )
 
+async def montar_pagina_pedidos(visao, cursor=None, anterior=False, inicio=1):
+    """Retorna (texto, teclado) da página, ou None se não houver pedidos nela."""
+    status, titulo, _, mostrar_status = VISOES_PEDIDOS[visao]
+    rows, tem_mais = await DB.pagina_pedidos(status, cursor, anterior, PAGINA_TAMANHO)
     if not rows:
-        await update.message.reply_text("📭 Nenhum pedido encontrado!")
-        return
+        return None
+    if anterior and not tem_mais:
+        # voltou até o começo da lista
+        inicio = 1
 
-    resposta = ["📚 *Histórico de todos os pedidos:*",""]
-    for i, row in enumerate(rows, 1):
+    resposta = [titulo, ""]
+    for i, row in enumerate(rows, inicio):
         resposta.append(f"*{i}.* 👤 {row['username']} (`{row['user_id']}`)")
-        resposta.append(f"🆔 `{row['video_id']}` — 🕒 `{row['requested_at']}` — 📄 *{row['status']}*")
+        linha = f"🆔 `{row['video_id']}` — 🕒 `{row['requested_at']}`"
+        if mostrar_status:
+            linha += f" — 📄 *{row['status']}*"
+        resposta.append(linha)
         resposta.append("")
 
-    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
-
-# Mostrar apenas pedidos concluídos
-async def mostrar_concluidos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get("is_admin"):
+    # vindo de um cursor, sempre existe a página de onde viemos
+    tem_anterior = tem_mais if anterior else cursor is not None
+    tem_proxima = tem_mais if not anterior else True
+    botoes = []
+    if tem_anterior:
+        botoes.append(InlineKeyboardButton(
+            "⬅️ Anterior", callback_data=_dados_pagina(visao, "p", rows[0], max(1, inicio - PAGINA_TAMANHO))
+        ))
+    if tem_proxima:
+        botoes.append(InlineKeyboardButton(
+            "Próxima ➡️", callback_data=_dados_pagina(visao, "n", rows[-1], inicio + len(rows))
+        ))
+    teclado = InlineKeyboardMarkup([botoes]) if botoes else None
+    return "\n".join(resposta), teclado
+
+
+async def mostrar_pagina_pedidos(update: Update, context: ContextTypes.DEFAULT_TYPE, visao):
+    if not eh_admin(update, context):
         await update.message.reply_text("❌ Você não tem permissão.")
         return
 
-    # busca em outra thread usando nossa função auxiliar
-    rows = await asyncio.to_thread(
-        buscar_todos_do_banco,
-        "SELECT user_id, username, video_id, requested_at "
-        "FROM pending_requests WHERE status = 'concluido' ORDER BY requested_at ASC"
-    )
+    pagina = await montar_pagina_pedidos(visao)
+    if pagina is None:
+        await update.message.reply_text(VISOES_PEDIDOS[visao][2])
+        return
 
-    if not rows:
-        await update.message.reply_text("📭 Nenhum pedido concluído!")
+    texto, teclado = pagina
+    await update.message.reply_text(texto, parse_mode="Markdown", reply_markup=teclado)
+
+
+async def paginar_pedidos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # botões Anterior/Próxima: edita a própria mensagem com a nova página
+    query = update.callback_query
+    if not eh_admin(update, context):
+        await query.answer("❌ Você não tem permissão.", show_alert=True)
         return
 
-    resposta = ["✅ *Pedidos concluídos:*", ""]
-    for i, row in enumerate(rows, 1):
-        resposta.append(f"*{i}.* 👤 {row['username']} (`{row['user_id']}`)")
-        resposta.append(f"🆔 `{row['video_id']}` — 🕒 `{row['requested_at']}`")
-        resposta.append("")
+    try:
+        visao, anterior, cursor, inicio = _ler_dados_pagina(query.data)
+        VISOES_PEDIDOS[visao]
+    except (ValueError, KeyError):
+        await query.answer("❌ Página inválida.")
+        return
 
-    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+    pagina = await montar_pagina_pedidos(visao, cursor, anterior, inicio)
+    if pagina is None:
+        await query.answer("📭 Não há mais pedidos nessa direção.")
+        return
+
+    texto, teclado = pagina
+    await query.answer()
+    try:
+        await query.edit_message_text(texto, parse_mode="Markdown", reply_markup=teclado)
+    except BadRequest as e:
+        # clique repetido num botão da mesma página: nada mudou, nada a fazer
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def mostrar_fila(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await mostrar_pagina_pedidos(update, context, "fila")
+
+
+# Mostrar histórico completo
+async def mostrar_historico(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await mostrar_pagina_pedidos(update, context, "historico")
+
+# Mostrar apenas pedidos concluídos
+async def mostrar_concluidos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await mostrar_pagina_pedidos(update, context, "concluidos")
 
 # Mostrar apenas pedidos rejeitados
 async def mostrar_rejeitados(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get("is_admin"):
-        await update.message.reply_text("❌ Você não tem permissão.")
-        return
+    await mostrar_pagina_pedidos(update, context, "rejeitados")
 
-    # busca em outra thread usando nossa função auxiliar
-    rows = await asyncio.to_thread(
-        buscar_todos_do_banco,
-        "SELECT user_id, username, video_id, requested_at "
-        "FROM pending_requests WHERE status = 'rejeitado' ORDER BY requested_at ASC"
-    )
 
-    if not rows:
-        await update.message.reply_text("📭 Nenhum pedido rejeitado!")
+# ————— Exportação —————
+EXPORTAR_LOTE = int(os.getenv("EXPORTAR_LOTE", "1000"))
+COLUNAS_EXPORTACAO = ["id", "user_id", "username", "first_name", "video_id", "requested_at", "status"]
+USO_EXPORTAR = (
+    "Use: /exportar [csv|jsonl] [status=pendente] [de=AAAA-MM-DD] [ate=AAAA-MM-DD]"
+)
+# limite de upload de arquivos para bots na Bot API
+EXPORTAR_MAX_BYTES = 50 * 1024 * 1024
+
+
+def _ler_args_exportacao(args):
+    formato, filtros = "csv", {}
+    for arg in args:
+        if arg.lower() in ("csv", "jsonl"):
+            formato = arg.lower()
+        elif "=" in arg:
+            chave, valor = arg.split("=", 1)
+            filtros[chave.lower()] = valor
+        else:
+            raise ValueError(arg)
+
+    desde = ate = None
+    if "de" in filtros:
+        desde = datetime.strptime(filtros.pop("de"), "%Y-%m-%d")
+    if "ate" in filtros:
+        # data final inclusiva: vai até o começo do dia seguinte
+        ate = datetime.strptime(filtros.pop("ate"), "%Y-%m-%d") + timedelta(days=1)
+    status = filtros.pop("status", None)
+    if filtros:
+        raise ValueError(", ".join(filtros))
+    return formato, status, desde, ate
+
+
+async def gravar_exportacao(arquivo, formato, status, desde, ate):
+    """Grava os pedidos comprimidos em `arquivo`, lote por lote. Retorna o total."""
+    total = 0
+    with gzip.open(arquivo, "wt", encoding="utf-8", newline="") as saida:
+        escritor = None
+        if formato == "csv":
+            escritor = csv.DictWriter(saida, fieldnames=COLUNAS_EXPORTACAO)
+            escritor.writeheader()
+
+        # aclosing devolve a conexão do cursor mesmo se a gravação falhar no meio
+        async with aclosing(DB.exportar_pedidos(status, desde, ate, EXPORTAR_LOTE)) as lotes:
+            async for rows in lotes:
+                for row in rows:
+                    if escritor is not None:
+                        escritor.writerow(row)
+                    else:
+                        saida.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+                total += len(rows)
+    return total
+
+
+async def exportar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão.")
         return
 
-    resposta = ["❌ *Pedidos rejeitados:*", ""]
-    for i, row in enumerate(rows, 1):
-        resposta.append(f"*{i}.* 👤 {row['username']} (`{row['user_id']}`)")
-        resposta.append(f"🆔 `{row['video_id']}` — 🕒 `{row['requested_at']}`")
-        resposta.append("")
+    try:
+        formato, status, desde, ate = _ler_args_exportacao(context.args or [])
+    except ValueError:
+        await update.message.reply_text(USO_EXPORTAR)
+        return
 
-    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+    await update.message.reply_text("⏳ Gerando exportação...")
+    nome = f"pedidos_{datetime.now():%Y%m%d_%H%M%S}.{formato}.gz"
+    fd, caminho = tempfile.mkstemp(suffix=".gz")
+    os.close(fd)
+    try:
+        total = await gravar_exportacao(caminho, formato, status, desde, ate)
+        tamanho = os.path.getsize(caminho)
+        if tamanho > EXPORTAR_MAX_BYTES:
+            await update.message.reply_text(
+                f"⚠️ A exportação ficou com {tamanho / 1024 / 1024:.0f} MB e o Telegram aceita até "
+                f"{EXPORTAR_MAX_BYTES // 1024 // 1024} MB. Restrinja o período ou o status "
+                "(de=, ate=, status=) e tente de novo."
+            )
+            return
+        with open(caminho, "rb") as arquivo:
+            # read_file_handle=False: o arquivo vai em streaming em vez de ser lido inteiro
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=InputFile(arquivo, filename=nome, read_file_handle=False),
+                caption=f"📦 {total} pedido(s) exportado(s)."
+            )
+    except Exception:
+        logger.exception("Erro ao exportar pedidos")
+        await update.message.reply_text("❌ Não foi possível gerar a exportação.")
+    finally:
+        os.remove(caminho)
 
 
 async def mostrar_meus_pedidos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
 
-    # roda a consulta em outra thread usando nossa função auxiliar
-    pedidos = await asyncio.to_thread(
-        buscar_todos_do_banco,
-        """
-        SELECT video_id, requested_at, status 
-        FROM pending_requests 
-        WHERE user_id = %s
-        ORDER BY requested_at DESC
-        """,
-        (user_id,)
-    )
+    pedidos = await DB.listar_pedidos(user_id=user_id, mais_recentes_primeiro=True)
 
     if not pedidos:
         await update.message.reply_text("📭 Você ainda não tem pedidos registrados.")
@@ -493,7 +1810,7 @@ async def consultar_pedido(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # 1) Só admin pode usar
-    if not context.user_data.get("is_admin"):
+    if not eh_admin(update, context):
         await update.message.reply_text("❌ Você não tem permissão.")
         return ConversationHandler.END
 
@@ -512,16 +1829,7 @@ async def consultar_pedido(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return WAITING_FOR_QUEM
 
     # 4) Busca todos os pedidos daquele ID
-    resultados = await asyncio.to_thread(
-        buscar_todos_do_banco,
-        """
-        SELECT user_id, username, requested_at, status
-          FROM pending_requests
-         WHERE video_id = %s
-         ORDER BY requested_at ASC
-        """,
-        (video_id,)
-    )
+    resultados = await DB.listar_pedidos(video_id=video_id)
 
     # 5) Resposta para o admin
     if not resultados:
@@ -533,9 +1841,10 @@ async def consultar_pedido(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ""
         ]
         for i, r in enumerate(resultados, start=1):
+            repeticoes = f" — 🔁 {r['repeat_count']}x" if r["repeat_count"] > 1 else ""
             linhas.append(
                 f"*{i}.* 👤 {r['username']} (`{r['user_id']}`) — "
-                f"🕒 `{r['requested_at']}` — *{r['status']}*"
+                f"🕒 `{r['requested_at']}` — *{r['status']}*{repeticoes}"
             )
         await update.message.reply_text("\n".join(linhas), parse_mode="Markdown")
 
@@ -546,6 +1855,61 @@ async def consultar_pedido(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
+# ————— Ciclo de vida da aplicação —————
+async def pos_inicializacao(app: Application):
+    # post_init só guarda um callback, então as etapas ficam todas aqui
+    if REPLICA is not None:
+        # antes do banco: a réplica já responde com o que está no arquivo
+        REPLICA.iniciar()
+    # no SQLite o banco já pode ter sido aberto pela persistência no initialize()
+    await DB.abrir()
+    try:
+        await REGISTRO_ADMINS.carregar()
+    except Exception:
+        logger.exception("Erro ao carregar admins do banco.")
+    REGISTRO_ADMINS.iniciar()
+    CAIXA_SAIDA.iniciar(app.bot)
+    BUFFER_AUDITORIA.iniciar()
+    NOTIFICADOR_CANAL.iniciar(app.bot)
+    app.bot_data["manutencao"] = asyncio.create_task(manutencao_periodica())
+    if METRICAS_ATIVAS and METRICAS_PORTA:
+        servidor = ServidorHTTP(METRICAS_ENDERECO, METRICAS_PORTA)
+        servidor.rota(METRICAS_CAMINHO, rota_metricas)
+        await servidor.iniciar()
+        app.bot_data["servidor_metricas"] = servidor
+    await setup_bot_description(app)
+    await setup_commands(app)
+
+
+MANUTENCAO_INTERVALO = float(os.getenv("MANUTENCAO_INTERVALO", "3600"))
+
+
+async def manutencao_periodica():
+    # limpeza leve que não precisa rodar a cada pedido
+    while True:
+        await asyncio.sleep(MANUTENCAO_INTERVALO)
+        await executar_db(DB.podar_estatisticas, ESTATISTICAS_DIAS + 1)
+        # o registro já ignora admins vencidos; aqui eles saem da tabela
+        await executar_db(DB.remover_admins_expirados, datetime.now())
+
+
+async def pos_parada(app: Application):
+    # para os trabalhadores enquanto o bot ainda consegue enviar
+    await CAIXA_SAIDA.parar()
+    await NOTIFICADOR_CANAL.parar()
+    # grava o que sobrou no buffer antes de fechar o pool
+    await BUFFER_AUDITORIA.parar()
+    app.bot_data["manutencao"].cancel()
+    await REGISTRO_ADMINS.parar()
+    if REPLICA is not None:
+        await REPLICA.parar()
+    if "servidor_metricas" in app.bot_data:
+        await app.bot_data.pop("servidor_metricas").parar()
+
+
+async def pos_encerramento(app: Application):
+    await DB.fechar()
+
 # ————— Configura comandos —————
 async def setup_commands(app):
     # comandos só para chats privados
@@ -567,160 +1931,1339 @@ async def setup_commands(app):
 
     logger.info("Comandos configurados: só aparecem em chats privados.")
 
+# ————— Migrações do banco —————
+# Cada migração roda uma única vez, em ordem e dentro de uma transação; a versão
+# aplicada fica registrada em schema_migrations. Migração nova = item novo no fim.
+MIGRACOES = [
+    (1, "tabelas iniciais", [
+        # tabela de administradores dinâmicos
+        """CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY
+        )""",
+        """CREATE TABLE IF NOT EXISTS videos (
+            id TEXT PRIMARY KEY,
+            link TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS request_log (
+            id SERIAL PRIMARY KEY,
+            vid TEXT,
+            username TEXT,
+            ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS pending_requests (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT,
+            username TEXT,
+            first_name TEXT,
+            video_id TEXT,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pendente'
+        )""",
+        "ALTER TABLE pending_requests ADD COLUMN IF NOT EXISTS first_name TEXT",
+    ]),
+    (2, "caixa de saída de notificações", [
+        """CREATE TABLE IF NOT EXISTS notification_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            request_id INTEGER NOT NULL UNIQUE
+                REFERENCES pending_requests(id) ON DELETE CASCADE,
+            chat_id TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            link TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_at TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP,
+            last_error TEXT
+        )""",
+        """CREATE INDEX IF NOT EXISTS notification_outbox_prontas_idx
+           ON notification_outbox (next_attempt_at) WHERE status = 'pendente'""",
+        """CREATE INDEX IF NOT EXISTS notification_outbox_enviando_idx
+           ON notification_outbox (locked_at) WHERE status = 'enviando'""",
+    ]),
+    (3, "ids do Telegram como BIGINT e índices das consultas do bot", [
+        # ids de usuário do Telegram passam de 2^31
+        "ALTER TABLE admins ALTER COLUMN user_id TYPE BIGINT",
+        """ALTER TABLE pending_requests ALTER COLUMN user_id TYPE BIGINT
+           USING CASE WHEN btrim(user_id) ~ '^-?[0-9]+$' THEN btrim(user_id)::BIGINT END""",
+        "ALTER TABLE notification_outbox ALTER COLUMN chat_id TYPE BIGINT USING chat_id::BIGINT",
+        # notificações e /consultar_pedido
+        """CREATE INDEX IF NOT EXISTS pending_requests_video_status_idx
+           ON pending_requests (video_id, status)""",
+        # /fila, /concluidos, /rejeitados
+        """CREATE INDEX IF NOT EXISTS pending_requests_status_requested_idx
+           ON pending_requests (status, requested_at)""",
+        # /meus_pedidos
+        """CREATE INDEX IF NOT EXISTS pending_requests_user_requested_idx
+           ON pending_requests (user_id, requested_at DESC)""",
+    ]),
+    (4, "índices para paginação por (requested_at, id)", [
+        # o id desempata pedidos com o mesmo requested_at no cursor das listagens
+        "DROP INDEX IF EXISTS pending_requests_status_requested_idx",
+        """CREATE INDEX IF NOT EXISTS pending_requests_status_requested_id_idx
+           ON pending_requests (status, requested_at, id)""",
+        """CREATE INDEX IF NOT EXISTS pending_requests_requested_id_idx
+           ON pending_requests (requested_at, id)""",
+    ]),
+    (5, "contadores e agregados de pedidos mantidos por trigger", [
+        # contadores por status divididos em shards para não virar uma linha quente
+        """CREATE TABLE IF NOT EXISTS request_counters (
+            status TEXT NOT NULL,
+            shard SMALLINT NOT NULL,
+            total BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (status, shard)
+        )""",
+        # chegadas por dia, pelo status com que o pedido foi gravado
+        """CREATE TABLE IF NOT EXISTS request_daily_stats (
+            day DATE NOT NULL,
+            status TEXT NOT NULL,
+            total BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, status)
+        )""",
+        # pedidos por ID e hora, para o ranking das últimas 24h / 7 dias
+        """CREATE TABLE IF NOT EXISTS video_request_hourly (
+            hour TIMESTAMP NOT NULL,
+            video_id TEXT NOT NULL,
+            total BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, video_id)
+        )""",
+        """CREATE OR REPLACE FUNCTION pending_requests_contadores() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status IS NOT NULL THEN
+                UPDATE request_counters SET total = total - 1
+                 WHERE status = OLD.status AND shard = OLD.id % 16;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status IS NOT NULL THEN
+                INSERT INTO request_counters (status, shard, total)
+                VALUES (NEW.status, NEW.id % 16, 1)
+                ON CONFLICT (status, shard) DO UPDATE SET total = request_counters.total + 1;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO request_daily_stats (day, status, total)
+                VALUES (COALESCE(NEW.requested_at, LOCALTIMESTAMP)::date, COALESCE(NEW.status, ''), 1)
+                ON CONFLICT (day, status) DO UPDATE SET total = request_daily_stats.total + 1;
+                IF NEW.video_id IS NOT NULL THEN
+                    INSERT INTO video_request_hourly (hour, video_id, total)
+                    VALUES (date_trunc('hour', COALESCE(NEW.requested_at, LOCALTIMESTAMP)), NEW.video_id, 1)
+                    ON CONFLICT (hour, video_id) DO UPDATE SET total = video_request_hourly.total + 1;
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""",
+        # sem escritas concorrentes entre criar os triggers e preencher os totais
+        "LOCK TABLE pending_requests IN SHARE ROW EXCLUSIVE MODE",
+        """CREATE TRIGGER pending_requests_contadores_ins_del
+           AFTER INSERT OR DELETE ON pending_requests
+           FOR EACH ROW EXECUTE FUNCTION pending_requests_contadores()""",
+        """CREATE TRIGGER pending_requests_contadores_upd
+           AFTER UPDATE OF status ON pending_requests
+           FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+           EXECUTE FUNCTION pending_requests_contadores()""",
+        """INSERT INTO request_counters (status, shard, total)
+           SELECT status, id % 16, COUNT(*) FROM pending_requests
+            WHERE status IS NOT NULL GROUP BY 1, 2""",
+        # para o histórico antigo só se sabe o status atual, não o da chegada
+        """INSERT INTO request_daily_stats (day, status, total)
+           SELECT requested_at::date, COALESCE(status, ''), COUNT(*) FROM pending_requests
+            WHERE requested_at IS NOT NULL GROUP BY 1, 2""",
+        """INSERT INTO video_request_hourly (hour, video_id, total)
+           SELECT date_trunc('hour', requested_at), video_id, COUNT(*) FROM pending_requests
+            WHERE requested_at >= LOCALTIMESTAMP - INTERVAL '8 days' AND video_id IS NOT NULL
+            GROUP BY 1, 2""",
+    ]),
+    (6, "demanda agregada por ID pendente", [
+        """CREATE TABLE IF NOT EXISTS video_demand (
+            video_id TEXT PRIMARY KEY,
+            requesters INTEGER NOT NULL DEFAULT 0,
+            oldest_requested_at TIMESTAMP,
+            last_requested_at TIMESTAMP
+        )""",
+        """CREATE OR REPLACE FUNCTION pending_requests_demanda() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'pendente' AND OLD.video_id IS NOT NULL THEN
+                -- só recalcula o mais antigo quando é ele que está saindo (usa o índice video_id, status)
+                UPDATE video_demand
+                   SET requesters = requesters - 1,
+                       oldest_requested_at = CASE
+                           WHEN oldest_requested_at < OLD.requested_at THEN oldest_requested_at
+                           ELSE (SELECT MIN(requested_at) FROM pending_requests
+                                  WHERE video_id = OLD.video_id AND status = 'pendente')
+                       END
+                 WHERE video_id = OLD.video_id;
+                DELETE FROM video_demand WHERE video_id = OLD.video_id AND requesters <= 0;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'pendente' AND NEW.video_id IS NOT NULL THEN
+                INSERT INTO video_demand (video_id, requesters, oldest_requested_at, last_requested_at)
+                VALUES (NEW.video_id, 1, NEW.requested_at, NEW.requested_at)
+                ON CONFLICT (video_id) DO UPDATE
+                   SET requesters = video_demand.requesters + 1,
+                       oldest_requested_at = LEAST(video_demand.oldest_requested_at, EXCLUDED.oldest_requested_at),
+                       last_requested_at = GREATEST(video_demand.last_requested_at, EXCLUDED.last_requested_at);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""",
+        "LOCK TABLE pending_requests IN SHARE ROW EXCLUSIVE MODE",
+        """CREATE TRIGGER pending_requests_demanda_ins_del
+           AFTER INSERT OR DELETE ON pending_requests
+           FOR EACH ROW EXECUTE FUNCTION pending_requests_demanda()""",
+        """CREATE TRIGGER pending_requests_demanda_upd
+           AFTER UPDATE OF status ON pending_requests
+           FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+           EXECUTE FUNCTION pending_requests_demanda()""",
+        """INSERT INTO video_demand (video_id, requesters, oldest_requested_at, last_requested_at)
+           SELECT video_id, COUNT(*), MIN(requested_at), MAX(requested_at)
+             FROM pending_requests
+            WHERE status = 'pendente' AND video_id IS NOT NULL
+            GROUP BY video_id""",
+    ]),
+    (7, "um pedido aberto por usuário e ID", [
+        "LOCK TABLE pending_requests IN SHARE ROW EXCLUSIVE MODE",
+        "ALTER TABLE pending_requests ADD COLUMN IF NOT EXISTS repeat_count INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE pending_requests ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+        "UPDATE pending_requests SET last_seen_at = requested_at",
+        # junta os pendentes repetidos no mais antigo (ou no que já tem notificação na caixa de saída);
+        # os demais ficam no histórico como 'duplicado' e suas notificações não são mais enviadas
+        """WITH ranqueados AS (
+               SELECT p.id,
+                      ROW_NUMBER() OVER (
+                          PARTITION BY p.user_id, p.video_id ORDER BY (o.id IS NULL), p.id
+                      ) AS posicao,
+                      COUNT(*) OVER (PARTITION BY p.user_id, p.video_id) AS repeticoes,
+                      MAX(p.requested_at) OVER (PARTITION BY p.user_id, p.video_id) AS ultimo
+                 FROM pending_requests p
+                 LEFT JOIN notification_outbox o ON o.request_id = p.id
+                WHERE p.status = 'pendente'
+           ), mantidos AS (
+               UPDATE pending_requests p
+                  SET repeat_count = r.repeticoes, last_seen_at = r.ultimo
+                 FROM ranqueados r
+                WHERE p.id = r.id AND r.posicao = 1 AND r.repeticoes > 1
+           ), duplicados AS (
+               UPDATE pending_requests p
+                  SET status = 'duplicado'
+                 FROM ranqueados r
+                WHERE p.id = r.id AND r.posicao > 1
+            RETURNING p.id
+           )
+           UPDATE notification_outbox
+              SET status = 'falhou', locked_at = NULL, last_error = 'pedido duplicado'
+            WHERE request_id IN (SELECT id FROM duplicados) AND status <> 'entregue'""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS pending_requests_aberto_uniq
+           ON pending_requests (user_id, video_id) WHERE status = 'pendente'""",
+    ]),
+    (8, "persistência de user_data e conversas", [
+        """CREATE TABLE IF NOT EXISTS user_data (
+               user_id BIGINT NOT NULL,
+               chave TEXT NOT NULL,
+               valor JSONB NOT NULL,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (user_id, chave)
+           )""",
+        """CREATE TABLE IF NOT EXISTS conversations (
+               nome TEXT NOT NULL,
+               chave TEXT NOT NULL,
+               estado JSONB NOT NULL,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (nome, chave)
+           )""",
+    ]),
+    (9, "file_ids de mídias enviadas", [
+        """CREATE TABLE IF NOT EXISTS telegram_file_ids (
+               chave TEXT PRIMARY KEY,
+               assinatura TEXT NOT NULL,
+               file_id TEXT NOT NULL,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+    ]),
+    (10, "versão de cada vídeo para a réplica local", [
+        "LOCK TABLE videos IN SHARE ROW EXCLUSIVE MODE",
+        "CREATE SEQUENCE IF NOT EXISTS videos_versao_seq",
+        "ALTER TABLE videos ADD COLUMN IF NOT EXISTS versao BIGINT",
+        "UPDATE videos SET versao = nextval('videos_versao_seq') WHERE versao IS NULL",
+        "ALTER TABLE videos ALTER COLUMN versao SET DEFAULT nextval('videos_versao_seq')",
+        "ALTER TABLE videos ALTER COLUMN versao SET NOT NULL",
+        """CREATE OR REPLACE FUNCTION videos_versao() RETURNS trigger AS $$
+        BEGIN
+            NEW.versao := nextval('videos_versao_seq');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql""",
+        # o upsert dos pedidos (SET id = EXCLUDED.id) não muda o link e não gera versão
+        """CREATE TRIGGER videos_versao_upd
+           BEFORE UPDATE ON videos
+           FOR EACH ROW WHEN (OLD.link IS DISTINCT FROM NEW.link)
+           EXECUTE FUNCTION videos_versao()""",
+        "CREATE INDEX IF NOT EXISTS videos_versao_idx ON videos (versao)",
+    ]),
+    (11, "validade dos admins e versão para sincronizar instâncias", [
+        "ALTER TABLE admins ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP",
+        # uma linha só; cada instância compara este número em vez de reler a tabela
+        """CREATE TABLE IF NOT EXISTS admins_versao (
+               id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+               versao BIGINT NOT NULL DEFAULT 0
+           )""",
+        "INSERT INTO admins_versao (id, versao) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING",
+        """CREATE OR REPLACE FUNCTION admins_versao() RETURNS trigger AS $$
+        BEGIN
+            UPDATE admins_versao SET versao = versao + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER admins_versao
+           AFTER INSERT OR UPDATE OR DELETE ON admins
+           FOR EACH STATEMENT EXECUTE FUNCTION admins_versao()""",
+    ]),
+]
+
+# chave do advisory lock que impede duas instâncias de migrarem ao mesmo tempo
+MIGRACOES_LOCK = 7261001
+
+
+def aplicar_migracoes(conn):
+    """Aplica as migrações pendentes e retorna a versão final do banco."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRACOES_LOCK,))
+        try:
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )"""
+            )
+            conn.commit()
+
+            cur.execute("SELECT COALESCE(MAX(version), 0) AS versao FROM schema_migrations")
+            versao_atual = cur.fetchone()["versao"]
+
+            for versao, descricao, comandos in MIGRACOES:
+                if versao <= versao_atual:
+                    continue
+                logger.info(f"Aplicando migração {versao}: {descricao}")
+                for comando in comandos:
+                    cur.execute(comando)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (versao, descricao)
+                )
+                conn.commit()
+                versao_atual = versao
+        finally:
+            # desfaz a migração que falhou (se houver) antes de soltar o lock
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRACOES_LOCK,))
+            conn.commit()
+    return versao_atual
+
+
 def init_db():
-    conn = None
     try:
-        conn = get_conn_pg()
-        cur = conn.cursor()
-        # tabela de administradores dinâmicos
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS admins (
-                user_id INTEGER PRIMARY KEY
-            )'''
-        )
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS videos (
-                id TEXT PRIMARY KEY,
-                link TEXT
-            )'''
-        )
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS request_log (
-                id SERIAL PRIMARY KEY,
-                vid TEXT,
-                username TEXT,
-                ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )'''
-        )
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS pending_requests (
-                id SERIAL PRIMARY KEY,
-                user_id TEXT,
-                username TEXT,
-                first_name TEXT,
-                video_id TEXT,
-                requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pendente'
-            )'''
-        )
-        conn.commit()
+        with POOL.conexao() as conn:
+            versao = aplicar_migracoes(conn)
+        logger.info(f"Banco de dados na versão {versao}.")
     except Exception:
         logger.exception("Erro ao inicializar o banco de dados")
     finally:
-        if conn:
-            conn.close()
+        # o pool síncrono só serve às migrações; os handlers usam o DB assíncrono
+        POOL.fechar()
+
+
+# ————— Imagens da ajuda —————
+PASSOS_AJUDA = [
+    (IMG1_PATH, "📌 Passo 1: Escolha o Produto e Clique em Compartilhar."),
+    (IMG2_PATH, "📌 Passo 2: Copie o ID mostrado no Formato indicado e cole o código no bot."),
+]
+
+
+class CacheFileIds:
+    """
+    Lembra o file_id que o Telegram devolveu para cada imagem local, para as
+    próximas vezes mandarem só o id em vez de subir o arquivo de novo. A
+    assinatura é o SHA-256 do conteúdo, recalculado só quando tamanho/mtime mudam.
+    """
+
+    def __init__(self, banco):
+        self.banco = banco
+        # chave -> (assinatura, file_id); None até a primeira leitura do banco
+        self._file_ids = None
+        # caminho -> ((tamanho, mtime_ns), assinatura)
+        self._assinaturas = {}
+
+    def assinatura(self, caminho):
+        st = os.stat(caminho)
+        marca = (st.st_size, st.st_mtime_ns)
+        anterior = self._assinaturas.get(caminho)
+        if anterior and anterior[0] == marca:
+            return anterior[1]
+        with open(caminho, "rb") as f:
+            assinatura = hashlib.sha256(f.read()).hexdigest()
+        self._assinaturas[caminho] = (marca, assinatura)
+        return assinatura
+
+    async def _carregar(self):
+        if self._file_ids is None:
+            try:
+                self._file_ids = await self.banco.carregar_file_ids()
+            except Exception as e:
+                logger.error(f"Erro ao carregar file_ids: {e}")
+                return {}
+        return self._file_ids
+
+    async def obter(self, chave, assinatura):
+        item = (await self._carregar()).get(chave)
+        if item and item[0] == assinatura:
+            return item[1]
+        return None
+
+    async def guardar(self, linhas):
+        if self._file_ids is not None:
+            for chave, assinatura, file_id in linhas:
+                self._file_ids[chave] = (assinatura, file_id)
+        try:
+            await self.banco.gravar_file_ids(linhas)
+        except Exception as e:
+            logger.error(f"Erro ao gravar file_ids: {e}")
+
+    def esquecer(self):
+        if self._file_ids is not None:
+            self._file_ids.clear()
+
+
+CACHE_FILE_IDS = CacheFileIds(DB)
+
+
+async def enviar_passos_ajuda(bot, chat_id, usar_cache=True):
+    midias, abertos, novos = [], [], []
+    recusado = None
+    try:
+        for caminho, legenda in PASSOS_AJUDA:
+            if not os.path.exists(caminho):
+                logger.warning(f"Imagem {os.path.basename(caminho)} não encontrada!")
+                continue
+            chave = os.path.basename(caminho)
+            assinatura = CACHE_FILE_IDS.assinatura(caminho)
+            file_id = await CACHE_FILE_IDS.obter(chave, assinatura) if usar_cache else None
+            if file_id is None:
+                arquivo = open(caminho, "rb")
+                abertos.append(arquivo)
+                novos.append((len(midias), chave, assinatura))
+                midias.append(InputMediaPhoto(media=InputFile(arquivo), caption=legenda))
+            else:
+                midias.append(InputMediaPhoto(media=file_id, caption=legenda))
+        if not midias:
+            return
+
+        # uma ida só à API; media group precisa de pelo menos 2 itens
+        try:
+            if len(midias) == 1:
+                mensagens = [await bot.send_photo(chat_id=chat_id, photo=midias[0].media, caption=midias[0].caption)]
+            else:
+                mensagens = await bot.send_media_group(chat_id=chat_id, media=midias)
+        except BadRequest as e:
+            # só vale tentar de novo se algum file_id do cache foi usado
+            if len(novos) == len(midias):
+                raise
+            recusado = e
+    finally:
+        for arquivo in abertos:
+            arquivo.close()
+
+    if recusado is not None:
+        # file_id que o Telegram não aceita mais: esquece e sobe os arquivos de novo
+        logger.warning(f"file_id da ajuda recusado ({recusado}); reenviando os arquivos.")
+        CACHE_FILE_IDS.esquecer()
+        await enviar_passos_ajuda(bot, chat_id, usar_cache=False)
+        return
+
+    if novos:
+        await CACHE_FILE_IDS.guardar([
+            (chave, assinatura, mensagens[i].photo[-1].file_id) for i, chave, assinatura in novos
+        ])
 
 
 async def ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Aqui está como encontrar o ID. Siga os passos abaixo:")
 
+    try:
+        await enviar_passos_ajuda(context.bot, update.effective_chat.id)
+    except TelegramError as e:
+        logger.error(f"Erro ao enviar as imagens da ajuda: {e}")
+        await update.message.reply_text("❌ Não foi possível enviar as imagens agora. Tente de novo mais tarde.")
 
-    # Passo 1
-    if not os.path.exists(IMG1_PATH):
-        logger.warning("Imagem passo1 não encontrada!")
-    else:
-        with open(IMG1_PATH, "rb") as img1:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=InputFile(img1),
-                caption="📌 Passo 1: Escolha o Produto e Clique em Compartilhar."
-            )
 
-    # Passo 2
-    if not os.path.exists(IMG2_PATH):
-        logger.warning("Imagem passo2 não encontrada!")
-    else:
-        with open(IMG2_PATH, "rb") as img2:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=InputFile(img2),
-                caption="📌 Passo 2: Copie o ID mostrado no Formato indicado e cole o código no bot."
-            )
+ESTATISTICAS_DIAS = 7
+
+# prioridade na fila por demanda = pedidos * peso + horas de espera do mais antigo * peso
+FILA_PESO_DEMANDA = float(os.getenv("FILA_PESO_DEMANDA", "1.0"))
+FILA_PESO_IDADE = float(os.getenv("FILA_PESO_IDADE", "0.1"))
+
+
+def formatar_idade(segundos):
+    minutos = int(segundos // 60)
+    if minutos < 60:
+        return f"{minutos}min"
+    horas, minutos = divmod(minutos, 60)
+    if horas < 24:
+        return f"{horas}h {minutos}min"
+    dias, horas = divmod(horas, 24)
+    return f"{dias}d {horas}h"
+
+
+async def mostrar_demanda(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão.")
+        return
+
+    rows = await executar_db(DB.fila_por_demanda, FILA_PESO_DEMANDA, FILA_PESO_IDADE, PAGINA_TAMANHO)
+    if rows is None:
+        await update.message.reply_text("❌ Não foi possível ler a fila agora.")
+        return
+    if not rows:
+        await update.message.reply_text("📭 Nenhum ID aguardando link!")
+        return
+
+    resposta = ["📈 *IDs mais aguardados:*", ""]
+    for i, row in enumerate(rows, 1):
+        resposta.append(
+            f"*{i}.* 🆔 `{row['video_id']}` — 👥 {row['requesters']} — "
+            f"⏳ {formatar_idade(row['idade_segundos'])}"
+        )
+    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+
+
+async def mostrar_proximo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão.")
+        return
+
+    rows = await executar_db(DB.fila_por_demanda, FILA_PESO_DEMANDA, FILA_PESO_IDADE, 1)
+    if rows is None:
+        await update.message.reply_text("❌ Não foi possível ler a fila agora.")
+        return
+    if not rows:
+        await update.message.reply_text("📭 Nenhum ID aguardando link!")
+        return
+
+    row = rows[0]
+    await update.message.reply_text(
+        f"👉 Próximo ID: `{row['video_id']}`\n"
+        f"👥 {row['requesters']} pedido(s) aguardando\n"
+        f"⏳ Mais antigo há {formatar_idade(row['idade_segundos'])}\n\n"
+        "Use /adicionar para cadastrar o link.",
+        parse_mode="Markdown"
+    )
 
 
 async def mostrar_total_pedidos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Apenas admins
-    if not context.user_data.get("is_admin"):
+    if not eh_admin(update, context):
         await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
         return
 
-    # Roda a contagem em thread separada
-    resultado = await asyncio.to_thread(
-        buscar_um_do_banco,
-        "SELECT COUNT(*) AS total FROM pending_requests"
-    )
-    total = resultado["total"] if resultado else 0
+    total = await DB.contar_pedidos()
 
     await update.message.reply_text(f"📊 Total de pedidos registrados no banco: {total}")
 
-def load_admins_from_db():
-    conn = get_conn_pg()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM admins")
-    rows = [r[0] for r in cur.fetchall()]
-    conn.close()
-    return rows
+async def mostrar_estatisticas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Apenas admins
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
+        return
 
-def inserir_admin_db(user_id: int):
-    conn = get_conn_pg()
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO admins(user_id)
-            VALUES (%s)
-            ON CONFLICT (user_id) DO NOTHING
-        """, (user_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    st = await executar_db(DB.estatisticas_pedidos, ESTATISTICAS_DIAS)
+    if st is None:
+        await update.message.reply_text("❌ Não foi possível ler as estatísticas agora.")
+        return
+
+    por_status = st["por_status"]
+    total = sum(por_status.values())
+    encontrados = st["chegadas"].get("encontrado", 0)
+    enfileirados = st["chegadas"].get("pendente", 0)
+    chegadas = encontrados + enfileirados
+
+    resposta = [
+        "📊 *Estatísticas de pedidos*",
+        "",
+        f"📦 Total: {total}",
+        f"⏳ Pendentes: {por_status.get('pendente', 0)}",
+    ]
+    resposta += [
+        f"• {status or '(sem status)'}: {n}"
+        for status, n in por_status.items() if status != "pendente"
+    ]
+    resposta.append("")
+    if chegadas:
+        resposta.append(
+            f"🎯 Últimos {ESTATISTICAS_DIAS} dias: {encontrados} encontrados × {enfileirados} enfileirados "
+            f"({encontrados / chegadas:.0%} com link na hora)"
+        )
+    for titulo, rows in (("24h", st["top_24h"]), (f"{ESTATISTICAS_DIAS} dias", st["top_periodo"])):
+        resposta.append("")
+        resposta.append(f"🔥 *Mais pedidos ({titulo}):*")
+        if not rows:
+            resposta.append("—")
+        for i, row in enumerate(rows, 1):
+            resposta.append(f"*{i}.* `{row['video_id']}` — {row['total']}")
+
+    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+
+
+def _formatar_pool(titulo, st):
+    return [
+        titulo,
+        f"🔌 Em uso: {st['em_uso']} | Ociosas: {st['ociosas']} | Limite: {st['minimo']}–{st['maximo']}",
+        f"⏱️ Espera média: {st['espera_media_ms']:.1f} ms | Máx: {st['espera_max_ms']:.1f} ms",
+        f"📥 Pedidos: {st['pedidos']} | Tiveram que esperar: {st['esperas']} | Timeouts: {st['timeouts']}",
+        f"♻️ Criadas: {st['criadas']} | Recicladas: {st['recicladas']} | Descartadas: {st['descartadas']}",
+        "",
+    ]
+
+
+async def mostrar_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Apenas admins
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
+        return
+
+    st = CACHE_LINKS.estatisticas()
+    lim = LIMITE_PEDIDOS.estatisticas()
+    resposta = [
+        "🧠 *Cache de links*",
+        "",
+        f"📦 Itens: {st['itens']}/{st['maximo']}",
+        f"🎯 Acertos: {st['hits']} | Negativos: {st['hits_negativos']} | Faltas: {st['misses']}",
+        f"📈 Taxa de acerto: {st['taxa_acerto']:.1%}",
+        f"⌛ Expirados: {st['expirados']} | Despejados: {st['despejados']} | Invalidados: {st['invalidacoes']}",
+        "",
+        "🐢 *Limite de pedidos*",
+        f"👥 Usuários acompanhados: {lim['usuarios']}",
+        f"✅ Liberados: {lim['liberados']} | 🚫 Barrados: {lim['barrados']} | Global: {lim['barrados_global']}",
+    ]
+    if REPLICA is not None:
+        rep = REPLICA.estatisticas()
+        sincronizado = (
+            datetime.fromtimestamp(rep["sincronizado_em"]).strftime("%H:%M:%S")
+            if rep["sincronizado_em"] else "nunca"
+        )
+        resposta += [
+            "",
+            "🪞 *Réplica de videos*",
+            f"📦 Links: {rep['itens']} | Cursor: {rep['cursor']} | Última sincronização: {sincronizado}",
+            f"🎯 Acertos: {rep['hits']} | Faltas: {rep['misses']} ({rep['taxa_acerto']:.1%})",
+            f"🔄 Atualizados: {rep['atualizacoes']} | Falhas: {rep['falhas']}",
+        ]
+    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+
+
+async def mostrar_pool(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Apenas admins
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
+        return
+
+    resposta = ["🗄️ *Pool de conexões*", ""]
+    if BANCO == "sqlite":
+        resposta += _formatar_pool("🪶 *SQLite (leitores + escritor)*", DB.estatisticas())
+    else:
+        resposta += _formatar_pool("⚡ *Postgres (assíncrono)*", DB.estatisticas())
+    processador = context.application.update_processor
+    if isinstance(processador, ProcessadorPorUsuario):
+        st = processador.estatisticas()
+        resposta += [
+            "",
+            "🚦 *Updates*",
+            f"⚙️ Concorrência: {st['concorrencia']} | Pendentes: {st['pendentes']} ({st['usuarios']} usuários)",
+            f"✅ Processados: {st['processados']} | 🗑️ Descartados: {st['descartados']}",
+            f"⏱️ Maior espera: {st['espera_max_ms']:.1f} ms",
+        ]
+    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+
+
+def _handlers_de(handler):
+    # os handlers de uma conversa ficam dentro dela (entradas, estados e fallbacks)
+    if isinstance(handler, ConversationHandler):
+        internos = list(handler.entry_points) + list(handler.fallbacks)
+        for estado in handler.states.values():
+            internos += estado
+        for interno in internos:
+            yield from _handlers_de(interno)
+    else:
+        yield handler
+
+
+def instrumentar_handlers(app: Application):
+    """Mede a duração de cada callback registrado, rotulado pelo nome da função."""
+    for grupo in app.handlers.values():
+        for handler in grupo:
+            for h in _handlers_de(handler):
+                h.callback = medir_chamada(h.callback, h.callback.__name__, DURACAO_HANDLERS, ERROS_HANDLERS)
+
+
+def registrar_medidores(app: Application):
+    def filas():
+        profundidades = {
+            ("updates_recebidos",): app.update_queue.qsize(),
+            ("auditoria",): BUFFER_AUDITORIA.estatisticas()["pendentes"],
+            ("outbox_em_envio",): CAIXA_SAIDA.em_envio,
+        }
+        if isinstance(app.update_processor, ProcessadorPorUsuario):
+            profundidades[("updates_em_processamento",)] = app.update_processor.estatisticas()["pendentes"]
+        return profundidades
+
+    METRICAS.medidor("fila_itens", "Itens aguardando em cada fila interna.", filas, ("fila",))
+    METRICAS.medidor(
+        "telegram_pausa_segundos", "Pausa global restante por RetryAfter nas notificações.",
+        lambda: DESPACHANTE.estatisticas()["pausado_por"]
+    )
+
+
+def _linhas_latencia(metrica, erros, limite, chave):
+    if metrica is None:
+        return ["(sem dados)"]
+    erros = erros.valores() if erros is not None else {}
+    series = sorted(metrica.resumo().items(), key=lambda item: item[1][chave], reverse=True)
+    if not series:
+        return ["(sem dados)"]
+    return [
+        f"`{rotulos[0]}`: {r['total']} | média {r['soma'] / r['total'] * 1000:.1f} ms | "
+        f"p95 {r['p95'] * 1000:.1f} ms | erros {erros.get(rotulos, 0)}"
+        for rotulos, r in series[:limite]
+    ]
+
+
+async def mostrar_metricas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Apenas admins
+    if not eh_admin(update, context):
+        await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
+        return
+    if not METRICAS_ATIVAS:
+        await update.message.reply_text("📊 As métricas estão desligadas (METRICAS=0).")
+        return
+
+    retry_after = METRICAS.obter("telegram_retry_after_total")
+    filas = METRICAS.obter("fila_itens")
+    resposta = [
+        "📊 *Métricas* (chamadas | média | p95 | erros)",
+        "",
+        "⚙️ *Handlers* (mais chamados)",
+        *_linhas_latencia(DURACAO_HANDLERS, ERROS_HANDLERS, 10, "total"),
+        "",
+        "🗄️ *Banco* (mais tempo somado)",
+        *_linhas_latencia(METRICAS.obter("banco_segundos"), METRICAS.obter("banco_erros_total"), 10, "soma"),
+        "",
+        "📡 *Bot API* (mais chamados)",
+        *_linhas_latencia(
+            METRICAS.obter("telegram_segundos"), METRICAS.obter("telegram_erros_total"), 5, "total"
+        ),
+        f"🐢 RetryAfter: {sum(retry_after.valores().values()) if retry_after else 0}",
+    ]
+    if filas is not None:
+        resposta += [
+            "",
+            "📥 *Filas*",
+            " | ".join(f"{rotulos[0]}: {valor}" for rotulos, valor in sorted(filas.valores().items())),
+        ]
+    if METRICAS_PORTA:
+        resposta += ["", f"🌐 Prometheus: http://{METRICAS_ENDERECO}:{METRICAS_PORTA}{METRICAS_CAMINHO}"]
+    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
 
 
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 1) só admin pode usar
-    if not context.user_data.get("is_admin"):
+    if not eh_admin(update, context):
         return await update.message.reply_text("❌ Você não tem permissão para isso.")
 
-    # 2) pega o argumento
-    if not context.args:
-        return await update.message.reply_text("Use: /addadmin <user_id>")
+    # 2) pega os argumentos
+    if not context.args or len(context.args) > 2:
+        return await update.message.reply_text("Use: /addadmin <user_id> [dias de validade]")
 
     try:
         novo_id = int(context.args[0])
+        dias = float(context.args[1]) if len(context.args) > 1 else None
     except ValueError:
         return await update.message.reply_text("❌ ID inválido. Passe um número de usuário válido.")
+    if dias is not None and dias <= 0:
+        return await update.message.reply_text("❌ A validade precisa ser maior que zero.")
 
-    # 3) checa se já é admin
-    if novo_id in ADMIN_IDS:
+    # 3) admins fixos do .env não passam pelo banco
+    if novo_id in REGISTRO_ADMINS.fixos:
         return await update.message.reply_text("⚠️ Esse usuário já é admin.")
 
-    # 4) insere no DB e na lista em memória
-    await asyncio.to_thread(inserir_admin_db, novo_id)
-    ADMIN_IDS.append(novo_id)
+    # 4) grava no banco (cadastra ou renova a validade) e no registro em memória
+    expira_em = datetime.now() + timedelta(days=dias) if dias is not None else None
+    await REGISTRO_ADMINS.adicionar(novo_id, expira_em)
 
-    await update.message.reply_text(f"✅ Usuário `{novo_id}` adicionado como admin.", parse_mode="Markdown")
+    validade = f" até {expira_em:%d/%m/%Y %H:%M}" if expira_em else ""
+    await update.message.reply_text(f"✅ Usuário `{novo_id}` adicionado como admin{validade}.", parse_mode="Markdown")
 
 
-# ————— Ponto de entrada —————
-if __name__ == "__main__":
-    init_db()
-    conn = get_conn_pg()
-    if conn:
-        print("Conexão com o banco de dados bem-sucedida!")
-        conn.close()
+async def remover_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not eh_admin(update, context):
+        return await update.message.reply_text("❌ Você não tem permissão para isso.")
+
+    if len(context.args or []) != 1:
+        return await update.message.reply_text("Use: /rmadmin <user_id>")
+    try:
+        alvo = int(context.args[0])
+    except ValueError:
+        return await update.message.reply_text("❌ ID inválido. Passe um número de usuário válido.")
+
+    if alvo in REGISTRO_ADMINS.fixos:
+        return await update.message.reply_text("⚠️ Esse admin vem de ADMIN_IDS no .env; remova-o de lá.")
+
+    removido = await REGISTRO_ADMINS.remover(alvo)
+    # encerra também um acesso feito pela senha: em memória e no banco, de onde
+    # as outras instâncias o tiram no próximo refresh
+    dados = context.application.user_data.get(alvo)
+    if dados is not None:
+        dados.pop("admin_ate", None)
+    try:
+        await PERSISTENCIA.remover_chaves(alvo, ["admin_ate", "is_admin"])
+    except Exception as e:
+        logger.error(f"Erro ao remover o acesso pela senha de {alvo}: {e}")
+
+    if removido:
+        await update.message.reply_text(f"🗑️ Usuário `{alvo}` não é mais admin.", parse_mode="Markdown")
     else:
-        print("Falha na conexão com o banco de dados.")
+        await update.message.reply_text("⚠️ Esse usuário não estava cadastrado como admin.")
+
 
-    dynamic_admins = load_admins_from_db()
-    # mescla com os admins fixos que você colocava manualmente
-    ADMIN_IDS = list(set(ADMIN_IDS + dynamic_admins))
+async def listar_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not eh_admin(update, context):
+        return await update.message.reply_text("❌ Você não tem permissão para isso.")
+
+    resposta = ["👮 *Admins*", ""]
+    for uid, expira, fixo in REGISTRO_ADMINS.listar():
+        if fixo:
+            detalhe = "fixo (.env)"
+        elif expira:
+            detalhe = f"até {expira:%d/%m/%Y %H:%M}"
+        else:
+            detalhe = "sem validade"
+        resposta.append(f"• `{uid}` — {detalhe}")
+    if len(resposta) == 2:
+        resposta.append("Nenhum admin cadastrado.")
+    await update.message.reply_text("\n".join(resposta), parse_mode="Markdown")
+
+
+# ————— Persistência de user_data e conversas —————
+# O PTB chama update_* a cada PERSISTENCIA_INTERVALO segundos só para quem mudou;
+# aqui cada usuário vira só as chaves alteradas, gravadas juntas numa transação.
+PERSISTENCIA_INTERVALO = float(os.getenv("PERSISTENCIA_INTERVALO", "5"))
+# user_data lido há mais que isso é relido do banco (outra instância pode ter mudado)
+PERSISTENCIA_RECARREGAR = float(os.getenv("PERSISTENCIA_RECARREGAR", "30"))
+
+
+class PersistenciaBanco(BasePersistence):
+    """
+    Guarda user_data (uma linha por chave) e o estado das conversas no banco.
+    Na inicialização só são lidas as conversas abertas e a lista de quem tem
+    user_data gravado; o user_data em si é carregado no primeiro update de cada
+    um desses usuários (refresh_user_data). Quem não tem nada gravado, como quem
+    só consulta IDs, não custa leitura nenhuma.
+    """
+
+    def __init__(self, banco, intervalo=5.0, recarregar=30.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=intervalo,
+        )
+        self.banco = banco
+        self.recarregar = recarregar
+        # user_id -> {chave: valor em JSON} como está no banco
+        self._gravado = {}
+        # user_id -> momento da última leitura
+        self._lido_em = {}
+        # quem tem alguma linha em user_data, relido a cada `recarregar` segundos
+        self._com_dados = set()
+        self._com_dados_em = None
+        # alterações ainda não gravadas
+        self._dados_pendentes = {}
+        self._conversas_pendentes = {}
+        self._tarefa = None
+
+    # ——— user_data ———
+    async def get_user_data(self):
+        await self._carregar_com_dados()
+        return {}
+
+    async def _carregar_com_dados(self):
+        self._com_dados_em = time.monotonic()
+        try:
+            self._com_dados = await self.banco.listar_usuarios_com_dados()
+        except Exception as e:
+            logger.error(f"Erro ao listar usuários com user_data: {e}")
+
+    @staticmethod
+    def _serializar(data, avisar=False):
+        serializado = {}
+        for chave, valor in data.items():
+            try:
+                serializado[chave] = json.dumps(valor, sort_keys=True)
+            except TypeError:
+                if avisar:
+                    logger.warning(f"user_data[{chave!r}] não é serializável em JSON; não será persistido.")
+        return serializado
+
+    async def refresh_user_data(self, user_id, user_data):
+        agora = time.monotonic()
+        lido = self._lido_em.get(user_id)
+        if user_id in self._dados_pendentes or (lido is not None and agora - lido < self.recarregar):
+            return
+        if self._com_dados_em is None or agora - self._com_dados_em >= self.recarregar:
+            # uma consulta só para todos, em vez de uma leitura por usuário
+            await self._carregar_com_dados()
+        if user_id not in self._com_dados and not self._gravado.get(user_id):
+            return
+        try:
+            dados = await self.banco.carregar_dados_usuario(user_id)
+        except Exception as e:
+            logger.error(f"Erro ao carregar dados do usuário {user_id}: {e}")
+            return
+        # o PTB só chama update_user_data a cada `intervalo`: chaves alteradas em
+        # memória e ainda não gravadas prevalecem sobre o que veio do banco
+        gravado = self._gravado.get(user_id, {})
+        atual = self._serializar(user_data)
+        locais = {k for k in set(atual) | set(gravado) if atual.get(k) != gravado.get(k)}
+        for chave in set(dados) | set(gravado):
+            if chave in locais:
+                continue
+            if chave in dados:
+                user_data[chave] = dados[chave]
+            else:
+                user_data.pop(chave, None)
+        self._lido_em[user_id] = agora
+        self._gravado[user_id] = self._serializar(dados)
+
+    async def update_user_data(self, user_id, data):
+        gravado = self._gravado.get(user_id, {})
+        atual = self._serializar(data, avisar=True)
+        alteradas = {k: v for k, v in atual.items() if gravado.get(k) != v}
+        removidas = [k for k in gravado if k not in atual]
+        if alteradas or removidas:
+            self._dados_pendentes[user_id] = (alteradas, removidas, atual)
+            self._agendar()
+
+    async def remover_chaves(self, user_id, chaves):
+        """
+        Apaga chaves de um usuário no banco agora, sem esperar o próximo
+        update_user_data. Quem chama tira as chaves do user_data em memória.
+        """
+        pendente = self._dados_pendentes.get(user_id)
+        if pendente is not None:
+            alteradas, _, atual = pendente
+            for chave in chaves:
+                alteradas.pop(chave, None)
+                atual.pop(chave, None)
+        gravado = self._gravado.get(user_id, {})
+        for chave in chaves:
+            gravado.pop(chave, None)
+        # o próximo refresh relê o usuário do banco
+        self._lido_em.pop(user_id, None)
+        await self.banco.gravar_dados_usuarios([], [(user_id, chave) for chave in chaves])
+
+    async def drop_user_data(self, user_id):
+        self._dados_pendentes.pop(user_id, None)
+        self._gravado.pop(user_id, None)
+        self._lido_em.pop(user_id, None)
+        self._com_dados.discard(user_id)
+        await self.banco.remover_dados_usuario(user_id)
+
+    # ——— conversas ———
+    async def get_conversations(self, name):
+        rows = await self.banco.carregar_conversas(name)
+        return {tuple(json.loads(r["chave"])): r["estado"] for r in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversas_pendentes[(name, json.dumps(list(key)))] = new_state
+        self._agendar()
+
+    # ——— gravação em lote ———
+    def _agendar(self):
+        # junta tudo o que mudou nesta rodada do PTB numa só ida ao banco
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = asyncio.create_task(self._gravar_depois())
+
+    async def _gravar_depois(self):
+        await asyncio.sleep(0)
+        await self.flush()
+
+    async def flush(self):
+        dados, self._dados_pendentes = self._dados_pendentes, {}
+        conversas, self._conversas_pendentes = self._conversas_pendentes, {}
+        if dados:
+            gravar = [
+                (user_id, chave, valor)
+                for user_id, (alteradas, _, _) in dados.items()
+                for chave, valor in alteradas.items()
+            ]
+            remover = [(user_id, chave) for user_id, (_, removidas, _) in dados.items() for chave in removidas]
+            try:
+                await self.banco.gravar_dados_usuarios(gravar, remover)
+                for user_id, (_, _, atual) in dados.items():
+                    self._gravado[user_id] = atual
+                    self._com_dados.add(user_id)
+            except Exception as e:
+                logger.error(f"Erro ao gravar user_data: {e}")
+                # volta para a fila sem passar por cima do que chegou enquanto isso
+                self._dados_pendentes = {**dados, **self._dados_pendentes}
+        if conversas:
+            gravar = [(nome, chave, json.dumps(estado)) for (nome, chave), estado in conversas.items() if estado is not None]
+            remover = [(nome, chave) for (nome, chave), estado in conversas.items() if estado is None]
+            try:
+                await self.banco.gravar_conversas(gravar, remover)
+            except Exception as e:
+                logger.error(f"Erro ao gravar conversas: {e}")
+                self._conversas_pendentes = {**conversas, **self._conversas_pendentes}
+
+    # ——— dados que este bot não persiste ———
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
 
-    app = (
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+
+PERSISTENCIA = PersistenciaBanco(DB, PERSISTENCIA_INTERVALO, PERSISTENCIA_RECARREGAR)
+
+
+# ————— Processamento concorrente de updates —————
+class ProcessadorPorUsuario(BaseUpdateProcessor):
+    """
+    Roda updates de usuários diferentes em paralelo (até `concorrencia`), mas os
+    de um mesmo usuário em ordem de chegada, para o estado da conversa não se
+    embaralhar. Com a fila cheia, updates novos são descartados em vez de esperar.
+    """
+
+    def __init__(self, concorrencia, fila_max, por_usuario):
+        # o semáforo do PTB só limita quantos entram aqui; acima de fila_max o
+        # descarte é imediato, então ele nunca chega a segurar ninguém
+        super().__init__(fila_max + 1)
+        self.concorrencia = concorrencia
+        self.fila_max = fila_max
+        self.por_usuario = por_usuario
+        self._execucao = asyncio.Semaphore(concorrencia)
+        # usuário -> [Lock, updates pendentes]; some quando não há mais nenhum
+        self._usuarios = {}
+        self._pendentes = 0
+
+        self.processados = 0
+        self.descartados = 0
+        self.espera_max_ms = 0.0
+
+    @staticmethod
+    def _chave(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        chave = self._chave(update)
+        item = self._usuarios.get(chave) if chave is not None else None
+        if self._pendentes >= self.fila_max or (item is not None and item[1] >= self.por_usuario):
+            self.descartados += 1
+            coroutine.close()
+            logger.warning(f"Update descartado por excesso de carga (usuário {chave}).")
+            return
+
+        if chave is not None and item is None:
+            item = self._usuarios[chave] = [asyncio.Lock(), 0]
+        self._pendentes += 1
+        if item is not None:
+            item[1] += 1
+        inicio = time.monotonic()
+        try:
+            if item is not None:
+                # Lock do asyncio é FIFO: a ordem de chegada do usuário se mantém
+                async with item[0], self._execucao:
+                    self._registrar_espera(inicio)
+                    await coroutine
+            else:
+                async with self._execucao:
+                    self._registrar_espera(inicio)
+                    await coroutine
+        finally:
+            self._pendentes -= 1
+            self.processados += 1
+            if item is not None:
+                item[1] -= 1
+                if item[1] == 0:
+                    del self._usuarios[chave]
+
+    def _registrar_espera(self, inicio):
+        self.espera_max_ms = max(self.espera_max_ms, (time.monotonic() - inicio) * 1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def estatisticas(self):
+        return {
+            "concorrencia": self.concorrencia,
+            "pendentes": self._pendentes,
+            "usuarios": len(self._usuarios),
+            "processados": self.processados,
+            "descartados": self.descartados,
+            "espera_max_ms": self.espera_max_ms,
+        }
+
+
+# ————— Servidor HTTP (webhook e health check) —————
+# HTTP/1.1 mínimo sobre asyncio, suficiente para o Telegram e para o balanceador;
+# evita depender do extra [webhooks] (tornado) do python-telegram-bot.
+HTTP_CORPO_MAX = 1024 * 1024
+HTTP_OCIOSO = 30.0
+STATUS_HTTP = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+
+class CorpoGrandeDemais(Exception):
+    pass
+
+
+class ServidorHTTP:
+    def __init__(self, endereco, porta):
+        self.endereco = endereco
+        self.porta = porta
+        # caminho -> async fn(metodo, cabecalhos, corpo) -> (status, content_type, corpo)
+        self.rotas = {}
+        self._servidor = None
+
+    def rota(self, caminho, fn):
+        self.rotas[caminho] = fn
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, self.endereco, self.porta)
+        logger.info(f"Servidor HTTP ouvindo em {self.endereco}:{self.porta}")
+
+    async def parar(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+            self._servidor = None
+
+    async def _ler_requisicao(self, reader):
+        linha = await asyncio.wait_for(reader.readline(), HTTP_OCIOSO)
+        if not linha:
+            return None
+        # ValueError aqui (linha ou Content-Length malformados) vira 400
+        metodo, alvo, _ = linha.decode("latin-1").split(" ", 2)
+        cabecalhos = {}
+        while True:
+            linha = await reader.readline()
+            if linha in (b"\r\n", b"\n", b""):
+                break
+            nome, _, valor = linha.decode("latin-1").partition(":")
+            cabecalhos[nome.strip().lower()] = valor.strip()
+        tamanho = int(cabecalhos.get("content-length") or 0)
+        if tamanho < 0:
+            raise ValueError("Content-Length negativo")
+        if tamanho > HTTP_CORPO_MAX:
+            raise CorpoGrandeDemais()
+        corpo = await reader.readexactly(tamanho) if tamanho else b""
+        return metodo.upper(), alvo.split("?", 1)[0], cabecalhos, corpo
+
+    async def _responder(self, writer, status, tipo, corpo, manter):
+        if isinstance(corpo, str):
+            corpo = corpo.encode()
+        if "charset" not in tipo:
+            tipo += "; charset=utf-8"
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {STATUS_HTTP.get(status, '')}\r\n"
+                f"Content-Type: {tipo}\r\n"
+                f"Content-Length: {len(corpo)}\r\n"
+                f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n"
+            ).encode() + corpo
+        )
+        await writer.drain()
+
+    async def _atender(self, reader, writer):
+        try:
+            while True:
+                try:
+                    req = await self._ler_requisicao(reader)
+                except CorpoGrandeDemais:
+                    await self._responder(writer, 413, "text/plain", "grande demais", False)
+                    return
+                except ValueError:
+                    await self._responder(writer, 400, "text/plain", "requisição inválida", False)
+                    return
+                if req is None:
+                    return
+                metodo, caminho, cabecalhos, corpo = req
+                fn = self.rotas.get(caminho)
+                if fn is None:
+                    status, tipo, resposta = 404, "text/plain", "não encontrado"
+                else:
+                    try:
+                        status, tipo, resposta = await fn(metodo, cabecalhos, corpo)
+                    except Exception:
+                        logger.exception(f"Erro ao atender {metodo} {caminho}")
+                        status, tipo, resposta = 503, "text/plain", "erro"
+                manter = cabecalhos.get("connection", "").lower() != "close"
+                await self._responder(writer, status, tipo, resposta, manter)
+                if not manter:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("Erro no servidor HTTP")
+        finally:
+            writer.close()
+
+
+# ————— Modo webhook —————
+# BOT_MODO=webhook (ou --webhook na linha de comando) troca o long polling por um
+# webhook; várias instâncias podem ficar atrás de um balanceador usando /health.
+BOT_MODO = os.getenv("BOT_MODO", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_ENDERECO = os.getenv("WEBHOOK_ENDERECO", "0.0.0.0")
+WEBHOOK_PORTA = int(os.getenv("WEBHOOK_PORTA", "8443"))
+WEBHOOK_CAMINHO = os.getenv("WEBHOOK_CAMINHO", "/telegram")
+WEBHOOK_SEGREDO = os.getenv("WEBHOOK_SEGREDO")
+# conexões simultâneas que o Telegram abre para entregar updates (1–100)
+WEBHOOK_MAX_CONEXOES = int(os.getenv("WEBHOOK_MAX_CONEXOES", "40"))
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "2"))
+
+
+def modo_execucao(argv):
+    if "--webhook" in argv:
+        return "webhook"
+    if "--polling" in argv:
+        return "polling"
+    return BOT_MODO
+
+
+def rota_webhook(app: Application):
+    async def receber(metodo, cabecalhos, corpo):
+        if metodo != "POST":
+            return 405, "text/plain", "use POST"
+        recebido = cabecalhos.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(recebido.encode(), WEBHOOK_SEGREDO.encode()):
+            return 403, "text/plain", "segredo inválido"
+        try:
+            update = Update.de_json(json.loads(corpo), app.bot)
+        except Exception:
+            return 400, "text/plain", "update inválido"
+        await app.update_queue.put(update)
+        return 200, "text/plain", "ok"
+    return receber
+
+
+def rota_health(app: Application):
+    async def health(metodo, cabecalhos, corpo):
+        if not app.running:
+            return 503, "application/json", json.dumps({"status": "parando"})
+        # porta pública: só o estado; detalhes ficam no log e no /pool
+        try:
+            await asyncio.wait_for(DB.verificar(), HEALTH_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Health check sem banco: {e!r}")
+            return 503, "application/json", json.dumps({"status": "sem banco"})
+        return 200, "application/json", json.dumps({"status": "ok"})
+    return health
+
+
+async def rota_metricas(metodo, cabecalhos, corpo):
+    return 200, "text/plain; version=0.0.4", METRICAS.texto()
+
+
+async def rodar_webhook(app: Application):
+    """Equivalente ao run_polling, mas recebendo updates pelo servidor HTTP."""
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL é obrigatório no modo webhook.")
+    if not WEBHOOK_SEGREDO:
+        # sem o segredo qualquer um poderia postar updates falsos (inclusive de admin)
+        raise RuntimeError("WEBHOOK_SEGREDO é obrigatório no modo webhook.")
+
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sinal, parar.set)
+
+    servidor = ServidorHTTP(WEBHOOK_ENDERECO, WEBHOOK_PORTA)
+    servidor.rota(WEBHOOK_CAMINHO, rota_webhook(app))
+    servidor.rota("/health", rota_health(app))
+
+    # mesma ordem de ganchos que o run_polling segue
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await app.start()
+        await servidor.iniciar()
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_CAMINHO,
+            secret_token=WEBHOOK_SEGREDO,
+            max_connections=WEBHOOK_MAX_CONEXOES,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Webhook registrado; aguardando updates.")
+        await parar.wait()
+    finally:
+        # o webhook fica registrado para as outras instâncias continuarem recebendo
+        await servidor.parar()
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# ————— Ponto de entrada —————
+def construir_app():
+    construtor = (
         ApplicationBuilder()
         .token(BOT_TOKEN)
-        .post_init(setup_bot_description)
-        .post_init(setup_commands)
-        .build()
+        .concurrent_updates(ProcessadorPorUsuario(
+            ATUALIZACOES_CONCORRENCIA,
+            ATUALIZACOES_FILA_MAX,
+            ATUALIZACOES_POR_USUARIO,
+        ))
+        .persistence(PERSISTENCIA)
+        .post_init(pos_inicializacao)
+        .post_stop(pos_parada)
+        .post_shutdown(pos_encerramento)
     )
+    if METRICAS_ATIVAS:
+        # só as chamadas do bot; o getUpdates do polling fica de fora (espera longa de propósito)
+        construtor.request(RequisicaoMedida(METRICAS))
+    app = construtor.build()
 
     # Conversation handler principal, incluindo /adicionar e menu admin
     main_conv = ConversationHandler(
@@ -729,6 +3272,9 @@ if __name__ == "__main__":
             CommandHandler("admin", iniciar_admin, filters=filters.ChatType.PRIVATE),
             CommandHandler("ajuda", ajuda, filters=filters.ChatType.PRIVATE),
             CommandHandler("meus_pedidos", mostrar_meus_pedidos, filters=filters.ChatType.PRIVATE),
+            # precisam ser entry points para a conversa seguir para os próximos estados
+            CommandHandler("adicionar", iniciar_adicionar, filters=filters.ChatType.PRIVATE),
+            CommandHandler("importar", iniciar_importar, filters=filters.ChatType.PRIVATE),
         ],
         states={
             AGUARDANDO_SENHA: [
@@ -747,22 +3293,36 @@ if __name__ == "__main__":
             WAITING_FOR_QUEM: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, consultar_pedido),
             ],
+            WAITING_FOR_ARQUIVO_IMPORTACAO: [
+                MessageHandler(filters.Document.ALL, receber_arquivo_importacao),
+            ],
         },
         fallbacks=[ CommandHandler("cancelar", cancelar)],
         allow_reentry=True,
+        name="principal",
+        persistent=True,
         conversation_timeout=259200
     )
 
     app.add_handler(main_conv)
     admin_handlers = [
-        CommandHandler("adicionar", iniciar_adicionar),
         CommandHandler("fila", mostrar_fila),
         CommandHandler("historico", mostrar_historico),
         CommandHandler("concluidos", mostrar_concluidos),
         CommandHandler("rejeitados", mostrar_rejeitados),
         CommandHandler("consultar_pedido", consultar_pedido),
         CommandHandler("total_pedidos", mostrar_total_pedidos),
-        CommandHandler("addadmin", add_admin)
+        CommandHandler("addadmin", add_admin),
+        CommandHandler("rmadmin", remover_admin),
+        CommandHandler("admins", listar_admins),
+        CommandHandler("pool", mostrar_pool),
+        CommandHandler("cache", mostrar_cache),
+        CommandHandler("metricas", mostrar_metricas),
+        CommandHandler("exportar", exportar),
+        CommandHandler("estatisticas", mostrar_estatisticas),
+        CommandHandler("demanda", mostrar_demanda),
+        CommandHandler("proximo", mostrar_proximo),
+        CallbackQueryHandler(paginar_pedidos, pattern=r"^pag\|"),
     ]
 
     app.add_handler(
@@ -773,4 +3333,20 @@ if __name__ == "__main__":
     )
     for handler in admin_handlers:
         app.add_handler(handler)
-    app.run_polling()
\ No newline at end of file
+    if METRICAS_ATIVAS:
+        instrumentar_handlers(app)
+        registrar_medidores(app)
+    return app
+
+
+if __name__ == "__main__":
+    if BANCO == "postgres":
+        init_db()
+    # no SQLite o esquema é criado/migrado pelo próprio DB.abrir()
+
+    app = construir_app()
+    if modo_execucao(sys.argv[1:]) == "webhook":
+        asyncio.run(rodar_webhook(app))
+    else:
+        # o run_polling já remove um webhook registrado antes
+        app.run_polling()
\ No newline at end of file
@@ -0,0 +1,220 @@
+import bisect
+import functools
+import time
+
+from telegram.request import HTTPXRequest
+
+from armazenamento import Armazenamento
+
+# Métricas em memória (contadores, histogramas e medidores), exportadas no formato
+# de texto do Prometheus. Tudo roda no laço de eventos do bot: registrar uma
+# observação é um perf_counter, um bisect e um acesso a dict, sem travas, para
+# poder ficar ligado em produção.
+
+# em segundos; cobre de uma ida rápida ao SQLite até uma chamada lenta à Bot API
+LIMITES_PADRAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _rotulos(nomes, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+
+    def inc(self, *rotulos, valor=1):
+        self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def valores(self):
+        return dict(self._valores)
+
+    def linhas(self):
+        for rotulos, valor in sorted(self._valores.items()):
+            yield f"{self.nome}{_rotulos(self.rotulos, rotulos)} {_numero(valor)}"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(limites)
+        # rótulos -> [contagem por faixa (a última é +Inf), soma, total]
+        self._series = {}
+
+    def observar(self, valor, *rotulos):
+        serie = self._series.get(rotulos)
+        if serie is None:
+            serie = self._series[rotulos] = [[0] * (len(self.limites) + 1), 0.0, 0]
+        serie[0][bisect.bisect_left(self.limites, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def resumo(self):
+        """{rótulos: {"total", "soma", "p50", "p95", "p99"}}, com quantis estimados pelas faixas."""
+        return {
+            rotulos: {
+                "total": total,
+                "soma": soma,
+                "p50": self._quantil(faixas, total, 0.50),
+                "p95": self._quantil(faixas, total, 0.95),
+                "p99": self._quantil(faixas, total, 0.99),
+            }
+            for rotulos, (faixas, soma, total) in self._series.items()
+        }
+
+    def _quantil(self, faixas, total, q):
+        # interpolação linear dentro da faixa, como o histogram_quantile do Prometheus
+        if not total:
+            return 0.0
+        alvo = q * total
+        acumulado = 0
+        for i, n in enumerate(faixas):
+            if acumulado + n >= alvo and n:
+                if i == len(self.limites):
+                    return self.limites[-1]
+                inferior = self.limites[i - 1] if i else 0.0
+                return inferior + (self.limites[i] - inferior) * (alvo - acumulado) / n
+            acumulado += n
+        return self.limites[-1]
+
+    def linhas(self):
+        for rotulos, (faixas, soma, total) in sorted(self._series.items()):
+            acumulado = 0
+            for limite, n in zip(self.limites + (float("inf"),), faixas):
+                acumulado += n
+                le = f'le="{_numero(limite)}"'
+                yield f"{self.nome}_bucket{_rotulos(self.rotulos, rotulos, le)} {acumulado}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {_numero(soma)}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, rotulos)} {total}"
+
+
+class Medidor:
+    """Valor lido na hora da coleta: fn() -> número ou {rótulos: número}."""
+    tipo = "gauge"
+
+    def __init__(self, nome, ajuda, fn, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.fn = fn
+
+    def valores(self):
+        valor = self.fn()
+        return valor if isinstance(valor, dict) else {(): valor}
+
+    def linhas(self):
+        for rotulos, valor in sorted(self.valores().items()):
+            yield f"{self.nome}{_rotulos(self.rotulos, rotulos)} {_numero(valor)}"
+
+
+class RegistroMetricas:
+    def __init__(self, prefixo="buscavideo"):
+        self.prefixo = prefixo
+        self._metricas = {}
+
+    def _registrar(self, metrica):
+        self._metricas[metrica.nome] = metrica
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(f"{self.prefixo}_{nome}", ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        return self._registrar(Histograma(f"{self.prefixo}_{nome}", ajuda, rotulos, limites))
+
+    def medidor(self, nome, ajuda, fn, rotulos=()):
+        return self._registrar(Medidor(f"{self.prefixo}_{nome}", ajuda, fn, rotulos))
+
+    def obter(self, nome):
+        """Métrica registrada com esse nome (sem o prefixo), ou None."""
+        return self._metricas.get(f"{self.prefixo}_{nome}")
+
+    def texto(self):
+        """Exposição no formato de texto do Prometheus (versão 0.0.4)."""
+        saida = []
+        for metrica in self._metricas.values():
+            saida.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            saida.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            saida.extend(metrica.linhas())
+        return "\n".join(saida) + "\n"
+
+
+# ————— Instrumentação —————
+def medir_chamada(fn, nome, histograma, erros):
+    """Envolve uma corrotina registrando duração e exceções sob o rótulo `nome`."""
+    @functools.wraps(fn)
+    async def medida(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            erros.inc(nome)
+            raise
+        finally:
+            histograma.observar(time.perf_counter() - inicio, nome)
+    return medida
+
+
+def medir_armazenamento(banco, registro):
+    """Troca as operações do banco por versões medidas, rotuladas pelo nome da operação."""
+    duracao = registro.histograma("banco_segundos", "Duração das operações de banco.", ("operacao",))
+    erros = registro.contador("banco_erros_total", "Operações de banco que levantaram exceção.", ("operacao",))
+    # exportar_pedidos é um gerador assíncrono, não uma corrotina
+    ignoradas = {"abrir", "fechar", "estatisticas", "exportar_pedidos"}
+    for nome in sorted(Armazenamento.__abstractmethods__ - ignoradas):
+        setattr(banco, nome, medir_chamada(getattr(banco, nome), nome, duracao, erros))
+
+
+class RequisicaoMedida(HTTPXRequest):
+    """HTTPXRequest que mede cada chamada à Bot API, por método."""
+    __slots__ = ("_duracao", "_erros", "_retry_after")
+
+    def __init__(self, registro, **kwargs):
+        super().__init__(**kwargs)
+        self._duracao = registro.histograma(
+            "telegram_segundos", "Duração das chamadas à Bot API.", ("metodo",)
+        )
+        self._erros = registro.contador(
+            "telegram_erros_total", "Chamadas à Bot API com erro (rede ou HTTP >= 400).", ("metodo",)
+        )
+        self._retry_after = registro.contador(
+            "telegram_retry_after_total", "Respostas 429 (RetryAfter) da Bot API.", ("metodo",)
+        )
+
+    async def do_request(self, url, method, *args, **kwargs):
+        metodo = url.rsplit("/", 1)[-1]
+        inicio = time.perf_counter()
+        try:
+            status, corpo = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            self._erros.inc(metodo)
+            raise
+        finally:
+            self._duracao.observar(time.perf_counter() - inicio, metodo)
+        if status == 429:
+            self._retry_after.inc(metodo)
+        elif status >= 400:
+            self._erros.inc(metodo)
+        return status, corpo
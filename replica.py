@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+# Réplica local da tabela videos (id -> link) para responder buscas sem ir ao
+# banco principal. Fica num arquivo SQLite ao lado do bot e inteira num dict em
+# memória; um laço em segundo plano puxa só o que mudou, pela coluna `versao`
+# (cursor de mudanças), e grava no arquivo. Ao reiniciar, o arquivo já tem o
+# suficiente para responder antes da primeira ida ao banco.
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaVideos:
+    def __init__(self, banco, caminho, intervalo=5.0, lote=5000, sobreposicao=1000, ressincronizar=3600.0):
+        self.banco = banco
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self.lote = lote
+        # versões atribuídas em transações que ainda não tinham feito commit na
+        # leitura anterior aparecem depois; reler um pouco para trás as pega
+        self.sobreposicao = sobreposicao
+        # releitura completa periódica como rede de segurança (0 = nunca)
+        self.ressincronizar = ressincronizar
+
+        self._links = {}
+        self._cursor = 0
+        self._conn = None
+        self._tarefa = None
+        self._ultima_completa = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.atualizacoes = 0
+        self.falhas = 0
+        self.sincronizado_em = None
+
+    # ————— arquivo local —————
+    def _abrir_arquivo(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+        conn = sqlite3.connect(self.caminho, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS videos (id TEXT PRIMARY KEY, link TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+        return conn
+
+    def _carregar_arquivo(self):
+        self._conn = self._abrir_arquivo()
+        self._links = dict(self._conn.execute("SELECT id, link FROM videos"))
+        row = self._conn.execute("SELECT valor FROM estado WHERE chave = 'cursor'").fetchone()
+        self._cursor = row[0] if row else 0
+
+    def _gravar_arquivo(self, gravar, remover, cursor):
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT INTO videos (id, link) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET link = excluded.link",
+                gravar
+            )
+            self._conn.executemany("DELETE FROM videos WHERE id = ?", [(vid,) for vid in remover])
+            self._conn.execute(
+                "INSERT INTO estado (chave, valor) VALUES ('cursor', ?) "
+                "ON CONFLICT (chave) DO UPDATE SET valor = excluded.valor",
+                (cursor,)
+            )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    # ————— ciclo de vida —————
+    def iniciar(self):
+        """Carrega o arquivo (síncrono e local) e dispara a sincronização em segundo plano."""
+        try:
+            self._carregar_arquivo()
+            logger.info(f"Réplica de videos carregada: {len(self._links)} links (cursor {self._cursor}).")
+        except Exception:
+            logger.exception("Erro ao carregar a réplica local; começando vazia.")
+            self._links, self._cursor = {}, 0
+        self._ultima_completa = time.monotonic()
+        self._tarefa = asyncio.create_task(self._laco(), name="replica-videos")
+
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ————— leitura —————
+    def obter(self, vid):
+        """Link conhecido ou None (None não quer dizer que não exista no banco)."""
+        link = self._links.get(vid)
+        if link is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return link
+
+    def aplicar(self, vid, link):
+        """Atualização local imediata (ex.: o admin desta instância cadastrou o link)."""
+        if link is not None:
+            self._links[vid] = link
+
+    # ————— sincronização —————
+    async def sincronizar(self, completa=False):
+        if completa:
+            return await self._sincronizar_completa()
+        cursor = max(self._cursor - self.sobreposicao, 0)
+        maior = self._cursor
+        total = 0
+        while True:
+            rows = await self.banco.videos_alterados(cursor, self.lote)
+            if not rows:
+                break
+            # a sobreposição relê linhas já aplicadas: só o que mudou vai para o arquivo
+            gravar = [
+                (r["id"], r["link"]) for r in rows
+                if r["link"] is not None and self._links.get(r["id"]) != r["link"]
+            ]
+            remover = [r["id"] for r in rows if r["link"] is None and r["id"] in self._links]
+            cursor = rows[-1]["versao"]
+            anterior, maior = maior, max(maior, cursor)
+            for vid, link in gravar:
+                self._links[vid] = link
+            for vid in remover:
+                del self._links[vid]
+            total += len(gravar) + len(remover)
+            if gravar or remover or maior != anterior:
+                await asyncio.to_thread(self._gravar_arquivo, gravar, remover, maior)
+            if len(rows) < self.lote:
+                break
+        self._cursor = maior
+        self.atualizacoes += total
+        self.sincronizado_em = time.time()
+        return total
+
+    async def _sincronizar_completa(self):
+        """Relê a tabela inteira num dict novo e troca de uma vez: o que sumiu do banco sai daqui também."""
+        links = {}
+        cursor = 0
+        maior = self._cursor
+        while True:
+            rows = await self.banco.videos_alterados(cursor, self.lote)
+            if not rows:
+                break
+            for r in rows:
+                if r["link"] is not None:
+                    links[r["id"]] = r["link"]
+            cursor = rows[-1]["versao"]
+            maior = max(maior, cursor)
+            if len(rows) < self.lote:
+                break
+        gravar = [(vid, link) for vid, link in links.items() if self._links.get(vid) != link]
+        remover = [vid for vid in self._links if vid not in links]
+        if gravar or remover or maior != self._cursor:
+            await asyncio.to_thread(self._gravar_arquivo, gravar, remover, maior)
+        self._links = links
+        self._cursor = maior
+        total = len(gravar) + len(remover)
+        self.atualizacoes += total
+        self.sincronizado_em = time.time()
+        return total
+
+    async def _laco(self):
+        while True:
+            agora = time.monotonic()
+            completa = bool(self.ressincronizar) and agora - self._ultima_completa >= self.ressincronizar
+            try:
+                mudou = await self.sincronizar(completa)
+                if completa:
+                    self._ultima_completa = agora
+                if mudou:
+                    logger.info(f"Réplica de videos: {mudou} link(s) atualizados.")
+            except Exception as e:
+                # banco fora do ar: segue respondendo com o que já tem
+                self.falhas += 1
+                logger.warning(f"Falha ao sincronizar a réplica de videos: {e}")
+            await asyncio.sleep(self.intervalo)
+
+    def estatisticas(self):
+        consultas = self.hits + self.misses
+        return {
+            "itens": len(self._links),
+            "cursor": self._cursor,
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / consultas if consultas else 0.0,
+            "atualizacoes": self.atualizacoes,
+            "falhas": self.falhas,
+            "sincronizado_em": self.sincronizado_em,
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from banco_sqlite import BancoSQLite  # noqa: E402
+
+VID = "ABC-DEF-GHI"
+
+
+def rodar(cenario):
+    """Roda `cenario(banco)` num BancoSQLite novo, num arquivo temporário."""
+    async def principal():
+        banco = BancoSQLite(os.path.join(tempfile.mkdtemp(), "teste.sqlite3"), leitores=2)
+        await banco.abrir()
+        try:
+            await cenario(banco)
+        finally:
+            await banco.fechar()
+
+    asyncio.run(principal())
+
+
+def test_resolver_pedido_pendente_repetido_e_encontrado():
+    async def cenario(banco):
+        primeiro = await banco.resolver_pedido(1, "ana", "Ana", VID)
+        assert primeiro == {"link": None, "novo": True, "status": "pendente", "repetido": False}
+
+        # o mesmo usuário pedindo de novo soma no pedido aberto
+        segundo = await banco.resolver_pedido(1, "ana", "Ana", VID, provavelmente_sem_link=True)
+        assert segundo == {"link": None, "novo": False, "status": "pendente", "repetido": True}
+        abertos = await banco.listar_pedidos(status="pendente", user_id=1)
+        assert len(abertos) == 1
+
+        # outro usuário abre o próprio pedido
+        outro = await banco.resolver_pedido(2, "bia", "Bia", VID)
+        assert outro["repetido"] is False
+        assert len(await banco.listar_pedidos(status="pendente", video_id=VID)) == 2
+
+        await banco.upsert_video(VID, "https://exemplo.com/v")
+        achado = await banco.resolver_pedido(3, "caio", "Caio", VID)
+        assert achado == {"link": "https://exemplo.com/v", "novo": False, "status": "encontrado", "repetido": False}
+        assert await banco.listar_pedidos(user_id=3) == []
+
+    rodar(cenario)
+
+
+def test_pedido_aberto_unico_conta_repeticoes():
+    async def cenario(banco):
+        for _ in range(3):
+            await banco.resolver_pedido(1, "ana", "Ana", VID)
+        row = await banco._buscar_um(
+            "SELECT COUNT(*) AS n, MAX(repeat_count) AS repeticoes FROM pending_requests "
+            "WHERE user_id = 1 AND video_id = ?",
+            (VID,)
+        )
+        assert (row["n"], row["repeticoes"]) == (1, 3)
+
+    rodar(cenario)
+
+
+def test_caixa_de_saida_entrega_e_falha_definitiva():
+    async def cenario(banco):
+        await banco.resolver_pedido(1, "ana", "Ana", VID)
+        await banco.resolver_pedido(2, "bia", "Bia", VID)
+        await banco.upsert_video(VID, "https://exemplo.com/v")
+
+        ids = await banco.enfileirar_notificacoes([VID])
+        assert len(ids) == 2
+        reivindicadas = await banco.reivindicar_notificacoes(10, 60)
+        assert sorted(r["chat_id"] for r in reivindicadas) == [1, 2]
+        # já estão com um trabalhador: ninguém mais as pega
+        assert await banco.reivindicar_notificacoes(10, 60) == []
+
+        por_usuario = {r["chat_id"]: r for r in reivindicadas}
+        await banco.marcar_notificacao_entregue(por_usuario[1]["id"])
+        await banco.marcar_notificacao_falha(por_usuario[2]["id"], "Forbidden", True, 5, 0)
+
+        assert await banco.progresso_notificacoes(ids) == {"entregue": 1, "falhou": 1}
+        assert [p["status"] for p in await banco.listar_pedidos(user_id=1)] == ["concluido"]
+        assert [p["status"] for p in await banco.listar_pedidos(user_id=2)] == ["falhou"]
+
+    rodar(cenario)
+
+
+def test_falha_temporaria_volta_para_a_fila():
+    async def cenario(banco):
+        await banco.resolver_pedido(1, "ana", "Ana", VID)
+        await banco.upsert_video(VID, "https://exemplo.com/v")
+        [outbox_id] = await banco.enfileirar_notificacoes([VID])
+        await banco.reivindicar_notificacoes(10, 60)
+
+        await banco.marcar_notificacao_falha(outbox_id, "timeout", False, 5, 0)
+        assert await banco.progresso_notificacoes([outbox_id]) == {"pendente": 1}
+        assert [p["status"] for p in await banco.listar_pedidos(user_id=1)] == ["pendente"]
+        [de_novo] = await banco.reivindicar_notificacoes(10, 60)
+        assert de_novo["attempts"] == 2
+
+    rodar(cenario)
+
+
+def test_paginacao_por_cursor():
+    async def cenario(banco):
+        for usuario in range(1, 6):
+            await banco.registrar_pedido(usuario, f"u{usuario}", None, f"AAA-AAA-{usuario:03d}")
+
+        def cursor(row):
+            return row["requested_at"], row["id"]
+
+        pagina1, tem_mais = await banco.pagina_pedidos(limite=2)
+        assert [r["user_id"] for r in pagina1] == [1, 2] and tem_mais
+        pagina2, tem_mais = await banco.pagina_pedidos(cursor=cursor(pagina1[-1]), limite=2)
+        assert [r["user_id"] for r in pagina2] == [3, 4] and tem_mais
+        pagina3, tem_mais = await banco.pagina_pedidos(cursor=cursor(pagina2[-1]), limite=2)
+        assert [r["user_id"] for r in pagina3] == [5] and not tem_mais
+
+        # voltando da última página
+        volta, tem_mais = await banco.pagina_pedidos(cursor=cursor(pagina3[0]), anterior=True, limite=2)
+        assert [r["user_id"] for r in volta] == [3, 4] and tem_mais
+        inicio, tem_mais = await banco.pagina_pedidos(cursor=cursor(volta[0]), anterior=True, limite=2)
+        assert [r["user_id"] for r in inicio] == [1, 2] and not tem_mais
+
+        concluidos, _ = await banco.pagina_pedidos(status="concluido", limite=2)
+        assert concluidos == []
+
+    rodar(cenario)
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+# buscavideo lê a configuração do ambiente na importação
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TESTE")
+os.environ["BANCO"] = "sqlite"
+os.environ.setdefault("SQLITE_CAMINHO", os.path.join(tempfile.mkdtemp(), "teste.sqlite3"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import buscavideo  # noqa: E402
+
+
+def test_initialize_carrega_conversas_antes_do_post_init(monkeypatch):
+    async def sem_get_me(self):
+        pass
+
+    async def cenario():
+        app = buscavideo.construir_app()
+        # o Bot.initialize chamaria getMe na API de verdade
+        monkeypatch.setattr(type(app.bot), "initialize", sem_get_me)
+        assert app.persistence is buscavideo.PERSISTENCIA
+        try:
+            # o PTB lê as conversas persistentes aqui, antes do post_init abrir o banco
+            await app.initialize()
+            assert await buscavideo.DB.carregar_conversas("principal") == []
+        finally:
+            await app.shutdown()
+            await buscavideo.DB.fechar()
+
+    asyncio.run(cenario())
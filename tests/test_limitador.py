@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+# buscavideo lê a configuração do ambiente na importação
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TESTE")
+os.environ["BANCO"] = "sqlite"
+os.environ.setdefault("SQLITE_CAMINHO", os.path.join(tempfile.mkdtemp(), "teste.sqlite3"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import buscavideo  # noqa: E402
+
+
+def test_taxa_zero_desliga_o_limite_por_usuario():
+    limitador = buscavideo.LimitadorPorUsuario(0, 5)
+    assert all(limitador.permitir(1) == (True, False) for _ in range(50))
+    assert limitador.liberados == 50 and limitador.barrados == 0
+
+
+def test_taxa_zero_ainda_respeita_o_limite_global():
+    global_ = buscavideo.LimitadorTaxa(0.001, rajada=2)
+    limitador = buscavideo.LimitadorPorUsuario(0, 5, limitador_global=global_)
+    assert [limitador.permitir(usuario) for usuario in (1, 2, 3)] == [(True, False), (True, False), (False, False)]
+    assert limitador.barrados_global == 1
+
+
+def test_rajada_esgotada_avisa_uma_vez():
+    limitador = buscavideo.LimitadorPorUsuario(0.001, 2)
+    assert limitador.permitir(1) == (True, False)
+    assert limitador.permitir(1) == (True, False)
+    assert limitador.permitir(1) == (False, True)
+    assert limitador.permitir(1) == (False, False)
+    # outro usuário tem o próprio balde
+    assert limitador.permitir(2) == (True, False)
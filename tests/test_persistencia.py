@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# buscavideo lê a configuração do ambiente na importação
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TESTE")
+os.environ["BANCO"] = "sqlite"
+os.environ["SQLITE_CAMINHO"] = os.path.join(tempfile.mkdtemp(), "teste.sqlite3")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import buscavideo  # noqa: E402
+
+
+class BancoFalso:
+    def __init__(self, dados):
+        self.dados = dados
+        self.leituras = 0
+
+    async def carregar_dados_usuario(self, user_id):
+        self.leituras += 1
+        return dict(self.dados.get(user_id, {}))
+
+    async def listar_usuarios_com_dados(self):
+        return {user_id for user_id, dados in self.dados.items() if dados}
+
+    async def gravar_dados_usuarios(self, gravar, remover):
+        for user_id, chave, valor in gravar:
+            # a persistência manda o valor já em JSON
+            self.dados.setdefault(user_id, {})[chave] = json.loads(valor)
+        for user_id, chave in remover:
+            self.dados.get(user_id, {}).pop(chave, None)
+
+
+def test_recarga_nao_apaga_chaves_ainda_nao_gravadas():
+    async def cenario():
+        banco = BancoFalso({1: {"idioma": "pt"}})
+        # recarregar=0: toda chamada de refresh relê o banco
+        persistencia = buscavideo.PersistenciaBanco(banco, intervalo=5.0, recarregar=0)
+        user_data = {}
+        await persistencia.refresh_user_data(1, user_data)
+        assert user_data == {"idioma": "pt"}
+
+        # handler do /adicionar grava o rascunho; o update_user_data do PTB ainda não rodou
+        user_data["id_produto"] = "ABC-DEF-GHI"
+        # outra instância mudou uma chave que este processo não mexeu
+        banco.dados[1]["idioma"] = "en"
+
+        await persistencia.refresh_user_data(1, user_data)
+        assert banco.leituras == 2
+        assert user_data == {"idioma": "en", "id_produto": "ABC-DEF-GHI"}
+
+        # o rascunho continua sendo detectado como alteração a gravar
+        await persistencia.update_user_data(1, user_data)
+        await persistencia.flush()
+        assert banco.dados[1]["id_produto"] == "ABC-DEF-GHI"
+
+    asyncio.run(cenario())
+
+
+def test_recarga_nao_restaura_chave_removida_em_memoria():
+    async def cenario():
+        banco = BancoFalso({1: {"nome_produto": "Caneca"}})
+        persistencia = buscavideo.PersistenciaBanco(banco, intervalo=5.0, recarregar=0)
+        user_data = {}
+        await persistencia.refresh_user_data(1, user_data)
+
+        user_data.pop("nome_produto")
+        await persistencia.refresh_user_data(1, user_data)
+        assert "nome_produto" not in user_data
+
+    asyncio.run(cenario())
+
+
+def test_usuario_sem_dados_gravados_nao_custa_leitura():
+    async def cenario():
+        banco = BancoFalso({1: {"idioma": "pt"}})
+        persistencia = buscavideo.PersistenciaBanco(banco, intervalo=5.0, recarregar=60)
+        await persistencia.get_user_data()
+
+        for _ in range(3):
+            await persistencia.refresh_user_data(2, {})
+        assert banco.leituras == 0
+
+        await persistencia.refresh_user_data(1, {})
+        assert banco.leituras == 1
+
+        # quem passa a ter dados gravados volta a ser relido
+        await persistencia.update_user_data(2, {"admin_ate": 1})
+        await persistencia.flush()
+        persistencia.recarregar = 0
+        await persistencia.refresh_user_data(2, {})
+        assert banco.leituras == 2
+
+    asyncio.run(cenario())
+
+
+def test_acesso_pela_senha_expira():
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=99))
+    context = SimpleNamespace(user_data={"admin_ate": time.time() + 60})
+    assert buscavideo.eh_admin(update, context)
+
+    context.user_data["admin_ate"] = time.time() - 1
+    assert not buscavideo.eh_admin(update, context)
+
+    # flag antiga, sem validade, não dá mais acesso
+    context.user_data = {"is_admin": True}
+    assert not buscavideo.eh_admin(update, context)
+
+
+def test_remover_chaves_apaga_no_banco_e_forca_releitura():
+    async def cenario():
+        banco = BancoFalso({7: {"admin_ate": time.time() + 3600, "idioma": "pt"}})
+        persistencia = buscavideo.PersistenciaBanco(banco, intervalo=5.0, recarregar=60)
+        await persistencia.get_user_data()
+        user_data = {}
+        await persistencia.refresh_user_data(7, user_data)
+
+        # como o /rmadmin: tira da memória e do banco
+        user_data.pop("admin_ate")
+        await persistencia.remover_chaves(7, ["admin_ate", "is_admin"])
+        assert banco.dados[7] == {"idioma": "pt"}
+
+        # dentro do intervalo de recarga, mas o usuário é relido do banco
+        banco.dados[7]["idioma"] = "en"
+        await persistencia.refresh_user_data(7, user_data)
+        assert banco.leituras == 2
+        assert user_data == {"idioma": "en"}
+
+        # nada a regravar: o acesso não volta no próximo update_user_data
+        await persistencia.update_user_data(7, user_data)
+        await persistencia.flush()
+        assert "admin_ate" not in banco.dados[7]
+
+    asyncio.run(cenario())